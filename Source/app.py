@@ -1,14 +1,27 @@
 #!/usr/bin/env python3
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
+import gzip
+import hashlib
 import json
 import os
-import subprocess
+import threading
 import traceback
 import logging
+import time
 from datetime import datetime
 from monitor import IPMonitor
-from config import Config
+from engine import MonitoringEngine
+from events import EventHub
+from config import Config, data_path
+from logfiles import LogIndex, read_recent_lines
+import metrics
+
+# Log lines included in the dashboard payload
+DASHBOARD_LOG_LINES = 5
+
+# Config keys the dashboard displays
+DASHBOARD_CONFIG_KEYS = ('config_source', 'is_editable', 'webhook_url', 'webhook_method', 'webhook_user', 'app_name')
 
 # Setup Flask app logging
 logging.basicConfig(
@@ -19,18 +32,80 @@ logging.basicConfig(
 
 app = Flask(__name__)
 app.logger.setLevel(logging.INFO)
+metrics.registry.set_role('web')
 
 class WebIPMonitor:
     def __init__(self):
         self.monitor = IPMonitor()
-        self.log_file = '/var/log/ip-monitor.log'
+        self.monitor.start_outbox_worker()
+        self.log_file = self.monitor.log_file
         self.logger = logging.getLogger(__name__)
         
         # Ensure log file exists
         self.ensure_log_file()
         
+        # Keep a search index over the log and its backups current in the background;
+        # one worker indexes and the others load its snapshots when searched
+        self.log_index = LogIndex(self.log_file, logger=self.logger, snapshot_dir=data_path('log-index'))
+        self.log_index.start()
+        
+        # Push channel for dashboards
+        self.events = EventHub(lambda: self.monitor, self.log_file, self.logger)
+        
+        # Last rendered /api/dashboard body: (version, json bytes, gzipped bytes)
+        self.dashboard_lock = threading.Lock()
+        self.dashboard_cache = None
+        
         self.logger.info("Web IP Monitor initialized")
     
+    def get_dashboard_version(self):
+        """Cheap fingerprint of everything the dashboard payload is built from; None if it can't be cached"""
+        monitor = self.monitor
+        last_check = monitor.history.last_timestamp()
+        if last_check is None:
+            # No recorded check yet; the payload needs a live lookup
+            return None
+        
+        try:
+            st = os.stat(self.log_file)
+            log_version = (st.st_ino, st.st_size)
+        except OSError:
+            log_version = None
+        
+        config = json.dumps(monitor.config.to_dict(), sort_keys=True, default=str)
+        return (last_check, monitor.get_state_version(), log_version, config, monitor.should_send_alert())
+    
+    def build_dashboard(self):
+        """Status, config summary and log tail in one payload"""
+        monitor = self.monitor
+        config = monitor.config.to_dict()
+        return {
+            "status": monitor.get_last_status() or monitor.get_status(),
+            "config": {key: config.get(key) for key in DASHBOARD_CONFIG_KEYS},
+            "logs": self.get_recent_logs(DASHBOARD_LOG_LINES)
+        }
+    
+    def get_dashboard_etag(self, version):
+        """Strong ETag for a dashboard version, without rendering it"""
+        if version is None:
+            return None
+        return hashlib.sha1(repr(version).encode('utf-8')).hexdigest()[:20]
+    
+    def get_dashboard(self, version):
+        """Return (json bytes, gzipped bytes) for version, rendering only when it changed"""
+        with self.dashboard_lock:
+            cache = self.dashboard_cache
+            if version is not None and cache is not None and cache[0] == version:
+                return cache[1], cache[2]
+        
+        body = json.dumps(self.build_dashboard(), default=str).encode('utf-8')
+        compressed = gzip.compress(body, compresslevel=6)
+        
+        if version is not None:
+            with self.dashboard_lock:
+                self.dashboard_cache = (version, body, compressed)
+        return body, compressed
+    
     def ensure_log_file(self):
         """Ensure log file exists and is accessible"""
         try:
@@ -54,34 +129,17 @@ class WebIPMonitor:
                 self.logger.error(f"Log file not readable: {self.log_file}")
                 return [f"Log file not readable: {self.log_file}"]
             
-            # Try to read with tail command first
-            try:
-                result = subprocess.run(
-                    ['tail', '-n', str(lines), self.log_file], 
-                    capture_output=True, 
-                    text=True,
-                    timeout=5
-                )
-                if result.returncode == 0:
-                    log_lines = result.stdout.split('\n')
-                    filtered_lines = [line for line in log_lines if line.strip()]
-                    self.logger.debug(f"Retrieved {len(filtered_lines)} log lines via tail")
-                    return filtered_lines
-                else:
-                    self.logger.warning(f"tail command failed: {result.stderr}")
-            except (subprocess.TimeoutExpired, FileNotFoundError) as e:
-                self.logger.warning(f"tail command not available or timed out: {e}")
+            # Include what this process has logged but not yet written
+            self.monitor.log_handler.flush()
             
-            # Fallback to Python file reading
+            # Walk backwards from the end of the log (and its rotated backups) so
+            # cost depends on the number of lines requested, not the file size
             try:
-                with open(self.log_file, 'r') as f:
-                    all_lines = f.readlines()
-                    recent_lines = all_lines[-lines:] if all_lines else []
-                    filtered_lines = [line.strip() for line in recent_lines if line.strip()]
-                    self.logger.debug(f"Retrieved {len(filtered_lines)} log lines via Python")
-                    return filtered_lines
+                recent_lines = read_recent_lines(self.log_file, lines)
+                self.logger.debug(f"Retrieved {len(recent_lines)} log lines")
+                return recent_lines
             except Exception as e:
-                self.logger.error(f"Failed to read log file with Python: {e}")
+                self.logger.error(f"Failed to read log file: {e}")
                 return [f"Error reading log file: {str(e)}"]
                 
         except Exception as e:
@@ -91,6 +149,11 @@ class WebIPMonitor:
 web_monitor = WebIPMonitor()
 
 # Routes
+@app.before_request
+def reload_config():
+    """Pick up config.json changes saved by any process; a single stat when nothing changed"""
+    web_monitor.monitor.reload_config()
+
 @app.route('/')
 def dashboard():
     """Main dashboard"""
@@ -113,6 +176,45 @@ def api_status():
         app.logger.error(f"API status error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/events')
+def api_events():
+    """Server-Sent Events stream of status changes, check results and new log lines"""
+    return Response(
+        web_monitor.events.stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/dashboard')
+def api_dashboard():
+    """Everything the dashboard shows in one response, with ETag revalidation and gzip"""
+    try:
+        version = web_monitor.get_dashboard_version()
+        etag = web_monitor.get_dashboard_etag(version)
+        use_gzip = request.accept_encodings['gzip'] > 0
+        
+        if etag is not None:
+            # One strong tag per content coding; either proves the client has this version
+            tag = f"{etag}-gzip" if use_gzip else etag
+            if request.if_none_match.contains(etag) or request.if_none_match.contains(f"{etag}-gzip"):
+                response = Response(status=304)
+                response.set_etag(tag)
+                response.headers['Vary'] = 'Accept-Encoding'
+                return response
+        
+        body, compressed = web_monitor.get_dashboard(version)
+        response = Response(compressed if use_gzip else body, mimetype='application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        if etag is not None:
+            response.set_etag(tag)
+        return response
+    except Exception as e:
+        app.logger.error(f"API dashboard error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/config', methods=['GET', 'POST'])
 def api_config():
     """Configuration management API"""
@@ -133,8 +235,8 @@ def api_config():
             # Save new configuration
             web_monitor.monitor.config.save_config(new_config)
             
-            # Reload monitor with new config
-            web_monitor.monitor = IPMonitor()
+            # Apply it in this worker now; other processes notice the file change
+            web_monitor.monitor.reload_config()
             
             app.logger.info("Configuration updated via API")
             return jsonify({
@@ -152,8 +254,7 @@ def api_migrate_config():
     try:
         success = web_monitor.monitor.config.migrate_from_env()
         if success:
-            # Reload monitor
-            web_monitor.monitor = IPMonitor()
+            web_monitor.monitor.reload_config()
             return jsonify({
                 "success": True,
                 "message": "Configuration migrated successfully. Remove environment variables and restart for full effect."
@@ -174,11 +275,23 @@ def api_test():
         app.logger.info("Manual test requested")
         
         # Add a log entry indicating manual test
-        with open(web_monitor.log_file, 'a') as f:
-            f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] INFO: Manual test initiated via web interface\n")
+        web_monitor.monitor.logger.info("Manual test initiated via web interface")
+        
+        # Skip instead of overlapping a check the scheduler or cron is running
+        check_lock = web_monitor.monitor.try_check_lock()
+        if check_lock is None:
+            app.logger.info("Manual test skipped: another check is running")
+            return jsonify({
+                "success": False,
+                "error": "Another check is already running"
+            }), 409
         
-        # Run the monitor check
-        success = web_monitor.monitor.run_check()
+        # Run the monitor check, including all egress targets
+        try:
+            web_monitor.monitor.refresh_state()
+            success, _ = MonitoringEngine(web_monitor.monitor).run_cycle()
+        finally:
+            check_lock.release()
         
         if success:
             app.logger.info("Manual test completed successfully")
@@ -215,13 +328,14 @@ def api_webhook_test():
                 "error": "Could not retrieve current IP"
             }), 500
         
-        # Send test notification
+        # Queue test notification; the outbox worker delivers it
         web_monitor.monitor.send_notification(current_ip, "TEST-RANGE")
         
-        app.logger.info("Webhook test completed")
+        app.logger.info("Webhook test queued")
         return jsonify({
             "success": True,
-            "message": "Test webhook sent successfully"
+            "message": "Test webhook queued for delivery",
+            "outbox": web_monitor.monitor.outbox.get_stats()
         })
         
     except Exception as e:
@@ -240,18 +354,12 @@ def api_logs():
         level = request.args.get('level', '', type=str)
         
         app.logger.info(f"API logs request for {lines} lines")
-        logs = web_monitor.get_recent_logs(lines)
         
-        # Filter logs if search or level specified
         if search or level:
-            filtered_logs = []
-            for log in logs:
-                if search and search.lower() not in log.lower():
-                    continue
-                if level and f"] {level.upper()}:" not in log:
-                    continue
-                filtered_logs.append(log)
-            logs = filtered_logs
+            # Filter over the whole retained history, newest matches first
+            logs = web_monitor.log_index.query(search, level, lines)
+        else:
+            logs = web_monitor.get_recent_logs(lines)
         
         return jsonify({
             "logs": logs,
@@ -266,6 +374,33 @@ def api_logs():
         app.logger.error(f"API logs error: {e}")
         return jsonify({"error": str(e)}), 500
 
+def parse_history_time(value, default):
+    """Parse an epoch timestamp or ISO 8601 string from a query parameter"""
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/api/history')
+def api_history():
+    """Downsampled check history"""
+    try:
+        now = time.time()
+        end = parse_history_time(request.args.get('to'), now)
+        start = parse_history_time(request.args.get('from'), end - 86400)
+        step = request.args.get('step', '', type=str)
+        step = web_monitor.monitor.parse_time_string(step) if step else None
+        target = request.args.get('target') or None
+        
+        return jsonify(web_monitor.monitor.history.query(start, end, step, target))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid history query: {e}"}), 400
+    except Exception as e:
+        app.logger.error(f"API history error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/stats')
 def api_stats():
     """Get monitor statistics"""
@@ -273,11 +408,38 @@ def api_stats():
         stats = web_monitor.monitor.state.copy()
         stats['config_source'] = web_monitor.monitor.config.config_source
         stats['log_file_size'] = os.path.getsize(web_monitor.log_file) if os.path.exists(web_monitor.log_file) else 0
+        stats['http_pool'] = web_monitor.monitor.get_http_stats()
+        stats['outbox'] = web_monitor.monitor.outbox.get_stats()
         return jsonify(stats)
     except Exception as e:
         app.logger.error(f"API stats error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/providers')
+def api_providers():
+    """Get IP service health, in the order the next lookup will try them"""
+    try:
+        web_monitor.monitor.refresh_state()
+        return jsonify({"providers": web_monitor.monitor.providers.get_scores(web_monitor.monitor.get_ip_services())})
+    except Exception as e:
+        app.logger.error(f"API providers error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text format metrics, merged from the web workers, the scheduler and one-shot checks"""
+    try:
+        outbox_stats = web_monitor.monitor.outbox.get_stats()
+        extra = [
+            ('ipmonitor_log_file_size_bytes', 'gauge', 'Current size of the monitor log file',
+             os.path.getsize(web_monitor.log_file) if os.path.exists(web_monitor.log_file) else 0),
+            ('ipmonitor_webhook_queue_depth', 'gauge', 'Alerts waiting in the webhook outbox', outbox_stats['queue_depth'])
+        ]
+        return Response(metrics.registry.render(extra), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        app.logger.error(f"Metrics error: {e}")
+        return Response(f"# metrics unavailable: {e}\n", status=500, mimetype='text/plain')
+
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
@@ -296,6 +458,7 @@ def health_check():
             "log_file_accessible": log_accessible,
             "current_ip": status.get("current_ip"),
             "monitor_status": status.get("status"),
+            "observation_age": status.get("observation_age"),
             "config_source": web_monitor.monitor.config.config_source
         })
     except Exception as e:
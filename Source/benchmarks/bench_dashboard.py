@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import monitor
+from history import HistoryStore
+from outbox import WebhookOutbox
+from benchmarks.stubs import StubIPServer
+
+REFRESHES = 500
+
+def measure(client, refresh):
+    """Average response bytes and CPU microseconds per refresh"""
+    total_bytes = 0
+    start = time.process_time()
+    for _ in range(REFRESHES):
+        total_bytes += sum(len(response.get_data()) for response in refresh(client))
+    cpu = time.process_time() - start
+    return total_bytes / REFRESHES, cpu / REFRESHES * 1e6
+
+def bench_dashboard():
+    """Compare the three-request dashboard refresh with /api/dashboard"""
+    import app as web_app
+
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer(ip='203.0.113.7') as stub:
+        monitor.IP_SERVICES[:] = [f"{stub.url}/ip"]
+        web_app.web_monitor.log_file = os.path.join(tmp, 'ip-monitor.log')
+        with open(web_app.web_monitor.log_file, 'w') as f:
+            for i in range(50):
+                f.write(f"[2025-01-09 14:30:{i:02d}] INFO: Retrieved IP: 203.0.113.7 via {stub.url}/ip (3.0 ms)\n")
+        
+        ip_monitor = web_app.web_monitor.monitor
+        ip_monitor.outbox_worker.stop()
+        ip_monitor.outbox = WebhookOutbox(os.path.join(tmp, 'outbox.jsonl'), ip_monitor.logger)
+        ip_monitor.state_file = os.path.join(tmp, 'monitor_state.json')
+        ip_monitor.load_state()
+        ip_monitor.save_state()
+        ip_monitor.history = HistoryStore(os.path.join(tmp, 'history'))
+        ip_monitor.history.append(time.time(), 'protected', '203.0.113.7', None, stub.url, 3.0)
+        client = web_app.app.test_client()
+
+        def before(client):
+            return [client.get('/api/status'), client.get('/api/config'), client.get('/api/logs?lines=5')]
+
+        def after_full(client):
+            return [client.get('/api/dashboard', headers={'Accept-Encoding': 'gzip'})]
+
+        def after_changed(client):
+            ip_monitor.history.append(time.time(), 'protected', '203.0.113.7', None, stub.url, 3.0)
+            return after_full(client)
+
+        print("=" * 64)
+        print(f"Dashboard refresh benchmark ({REFRESHES} refreshes)")
+        print("=" * 64)
+        print(f"{'scenario':<36} {'bytes':>10} {'cpu us':>12}")
+        for name, refresh in (("before: status + config + logs", before),
+                              ("after: /api/dashboard, gzip", after_full)):
+            size, cpu = measure(client, refresh)
+            print(f"{name:<36} {size:>10.0f} {cpu:>12.0f}")
+
+        # Revalidation while nothing changes: the client sends back the tag it got
+        etag = after_full(client)[0].headers['ETag']
+        size, cpu = measure(client, lambda client: [
+            client.get('/api/dashboard', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        ])
+        print(f"{'after: /api/dashboard, 304':<36} {size:>10.0f} {cpu:>12.0f}")
+
+        # A check lands before every refresh, so every response is re-rendered
+        size, cpu = measure(client, after_changed)
+        print(f"{'after: /api/dashboard, changed':<36} {size:>10.0f} {cpu:>12.0f}")
+
+if __name__ == '__main__':
+    bench_dashboard()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark suite against local stub IP providers and a stub webhook.
+
+Usage: bench_e2e.py [--quick] [--output FILE] [--compare BASELINE]
+
+Nothing leaves the machine: IP services and webhook live on 127.0.0.1, and
+all state and logs (also those of the imported web app) in a temp dir. Results are written as JSON (by default to
+benchmarks/results/) and can be compared with an earlier run.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SOURCE_DIR)
+
+# Every default path (config, state, outbox, metrics, logs) is read from DATA_DIR
+# and LOG_DIR, so they must point here before the monitor or web app is imported;
+# importing app builds a monitor and starts its background workers right away
+SANDBOX = tempfile.mkdtemp(prefix='bench-e2e-')
+os.environ['DATA_DIR'] = os.path.join(SANDBOX, 'data')
+os.environ['LOG_DIR'] = os.path.join(SANDBOX, 'log')
+
+import metrics
+import monitor
+from history import HistoryStore
+from outbox import WebhookOutbox
+from benchmarks.stubs import StubIPServer, StubWebhookSink
+
+RESULTS_DIR = os.path.join(SOURCE_DIR, 'benchmarks', 'results')
+
+# Full and --quick sizes: operations per scenario and concurrent callers
+SIZES = {
+    'full': {'checks': 400, 'notifications': 400, 'requests': 1000, 'concurrency': 8},
+    'quick': {'checks': 60, 'notifications': 60, 'requests': 150, 'concurrency': 4}
+}
+
+# Provider scenarios: the stub every check tries first, with a healthy fallback behind it
+PROVIDERS = {
+    'healthy': {'latency': 0.005},
+    'slow': {'latency': 0.05},
+    'flaky': {'latency': 0.005, 'error_rate': 0.3},
+    'malformed': {'latency': 0.005, 'malformed_rate': 0.3}
+}
+
+ROUTES = ['/api/status', '/api/dashboard', '/api/history', '/api/logs?search=retrieved', '/health', '/metrics']
+
+def summarize(latencies, elapsed, errors=0):
+    """Latency percentiles in milliseconds plus throughput for one scenario"""
+    latencies = sorted(latencies)
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else None,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+        'throughput_per_s': round(len(latencies) / elapsed, 1) if elapsed else None
+    }
+
+def run_concurrently(operation, count, concurrency):
+    """Call operation(i) count times from concurrency threads; returns (latencies, elapsed, errors)"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    next_index = iter(range(count))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok = operation(i)
+            except Exception:
+                ok = False
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                if ok is False:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start, errors[0]
+
+def isolate(ip_monitor, tmp):
+    """Point a monitor's state, history, outbox, metrics and log at tmp"""
+    ip_monitor.state_file = os.path.join(tmp, 'monitor_state.json')
+    ip_monitor.load_state()
+    ip_monitor.history = HistoryStore(os.path.join(tmp, 'history'))
+    ip_monitor.outbox = WebhookOutbox(os.path.join(tmp, 'outbox.jsonl'), ip_monitor.logger)
+    ip_monitor.observations = monitor.ObservationCache(os.path.join(tmp, 'observation.json'))
+    metrics.registry.directory = os.path.join(tmp, 'metrics')
+
+    # Keep the cost of logging, but write to the temp dir instead of the console
+    ip_monitor.log_file = os.path.join(tmp, 'ip-monitor.log')
+    ip_monitor.setup_logging(console=False)
+
+    ip_monitor.config.SAFE_IP_RANGE = '192.168.1.0/24'
+    ip_monitor.config.ALERT_COOLDOWN = '0'
+    ip_monitor.config.ALERT_COALESCE_WINDOW = '0'
+    ip_monitor.config.STATUS_CACHE_TTL = '0'
+    return ip_monitor
+
+def bench_checks(tmp, sizes):
+    """IPMonitor.run_check latency for each provider scenario, in both lookup modes"""
+    results = {}
+    with StubIPServer(ip='203.0.113.7', latency=0.005) as fallback:
+        for name, options in PROVIDERS.items():
+            with StubIPServer(ip='203.0.113.7', **options) as primary:
+                for mode in ('sequential', 'race'):
+                    scenario_dir = os.path.join(tmp, f"checks-{name}-{mode}")
+                    os.makedirs(scenario_dir)
+                    ip_monitor = isolate(monitor.IPMonitor(), scenario_dir)
+                    ip_monitor.config.IP_LOOKUP_MODE = mode
+                    monitor.IP_SERVICES[:] = [f"{primary.url}/ip", f"{fallback.url}/ip"]
+
+                    latencies, elapsed, errors = run_concurrently(
+                        lambda i: ip_monitor.run_check(), sizes['checks'], sizes['concurrency']
+                    )
+                    results[f"run_check/{name}/{mode}"] = summarize(latencies, elapsed, errors)
+                    ip_monitor.close()
+    return results
+
+def bench_notifications(tmp, sizes):
+    """send_notification (enqueue) latency and end-to-end delivery to the webhook sink"""
+    results = {}
+    with StubWebhookSink(latency=0.002) as sink:
+        ip_monitor = isolate(monitor.IPMonitor(), tmp)
+        ip_monitor.config.WEBHOOK_URL = f"{sink.url}/webhook"
+        ip_monitor.start_outbox_worker()
+
+        count = sizes['notifications']
+        start = time.time()
+        latencies, elapsed, errors = run_concurrently(
+            lambda i: ip_monitor.send_notification('192.168.1.20', '192.168.1.0/24'), count, sizes['concurrency']
+        )
+        results['send_notification/enqueue'] = summarize(latencies, elapsed, errors)
+
+        delivered = sink.wait_for(count, timeout=120)
+        finished = time.time()
+        delivery = [
+            received - datetime.fromisoformat(payload['timestamp']).timestamp()
+            for received, payload in sink.received if isinstance(payload, dict)
+        ]
+        summary = summarize(delivery, finished - start, count - len(delivery))
+        summary['complete'] = delivered
+        results['send_notification/delivery'] = summary
+        ip_monitor.close()
+    return results
+
+def bench_routes(tmp, sizes):
+    """Flask route latency with several clients requesting at once"""
+    import app as web_app
+
+    results = {}
+    # Flask and the web monitor log through the root logger; keep that off the console too
+    root = logging.getLogger()
+    root.handlers[:] = [logging.FileHandler(os.path.join(tmp, 'web.log'))]
+
+    with StubIPServer(ip='203.0.113.7', latency=0.005) as stub:
+        monitor.IP_SERVICES[:] = [f"{stub.url}/ip"]
+        web_monitor = web_app.web_monitor
+        web_monitor.log_index.stop()
+        web_monitor.monitor.close()
+        ip_monitor = isolate(web_monitor.monitor, tmp)
+        web_monitor.log_file = ip_monitor.log_file
+        web_monitor.log_index = type(web_monitor.log_index)(web_monitor.log_file)
+
+        for i in range(200):
+            ip_monitor.history.append(time.time() - 600 + i, 'protected', '203.0.113.7', None, f"{stub.url}/ip", 5.0)
+        ip_monitor.run_check()
+
+        local = threading.local()
+
+        def request(route):
+            def operation(i):
+                client = getattr(local, 'client', None)
+                if client is None:
+                    client = local.client = web_app.app.test_client()
+                return client.get(route).status_code < 400
+            return operation
+
+        for route in ROUTES:
+            latencies, elapsed, errors = run_concurrently(request(route), sizes['requests'], sizes['concurrency'])
+            results[f"GET {route}"] = summarize(latencies, elapsed, errors)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=SOURCE_DIR, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    """Table of all scenarios, with the change in p50/p95/throughput against a baseline run"""
+    print(f"{'scenario':<42} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'errors':>7}")
+    for name, result in results.items():
+        line = (f"{name:<42} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+                f"{result['throughput_per_s'] or 0:>9.1f} {result['errors']:>7}")
+        before = (baseline or {}).get(name)
+        if before:
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'throughput_per_s'):
+                if before.get(key):
+                    changes.append(f"{key.split('_')[0]} {(result[key] - before[key]) / before[key] * 100:+.0f}%")
+            line += f"   ({', '.join(changes)})"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='smaller run for a fast sanity check')
+    parser.add_argument('--output', help='where to write the JSON results')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    sizes = SIZES['quick' if args.quick else 'full']
+    saved_services = list(monitor.IP_SERVICES)
+    try:
+        results = {}
+        for name, bench in (('checks', bench_checks), ('notifications', bench_notifications), ('routes', bench_routes)):
+            scenario_dir = os.path.join(SANDBOX, name)
+            os.makedirs(scenario_dir)
+            results.update(bench(scenario_dir, sizes))
+        # Write the last snapshot while the temp dir still exists, not at exit
+        metrics.registry.flush()
+    finally:
+        shutil.rmtree(SANDBOX, ignore_errors=True)
+    monitor.IP_SERVICES[:] = saved_services
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'sizes': sizes,
+        'results': results
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"e2e-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    print("=" * 86)
+    print(f"End-to-end benchmark ({'quick' if args.quick else 'full'}, concurrency {sizes['concurrency']})")
+    print("=" * 86)
+    print_results(results, baseline)
+    print(f"\nResults written to {output}")
+
+if __name__ == '__main__':
+    main()
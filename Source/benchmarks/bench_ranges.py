@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ranges import RangeIndex, load_range_index
+
+SIZES = [1, 10, 100, 1000, 10000, 100000]
+LOOKUPS = 100000
+FILE_PREFIXES = 500000
+
+def random_cidrs(count, rng):
+    """Generate count random IPv4 prefixes between /8 and /32"""
+    cidrs = []
+    for _ in range(count):
+        prefixlen = rng.randint(8, 32)
+        address = rng.getrandbits(32) & (0xFFFFFFFF << (32 - prefixlen)) & 0xFFFFFFFF
+        cidrs.append(f"{address >> 24}.{(address >> 16) & 255}.{(address >> 8) & 255}.{address & 255}/{prefixlen}")
+    return cidrs
+
+def random_ips(count, rng):
+    """Generate count random IPv4 address strings"""
+    return [f"{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}" for _ in range(count)]
+
+def bench_ranges():
+    """Measure index build time and per-lookup latency for growing range lists"""
+    rng = random.Random(42)
+    ips = random_ips(LOOKUPS, rng)
+
+    print("=" * 64)
+    print("Protected range index benchmark")
+    print("=" * 64)
+    print(f"{'ranges':>10} {'intervals':>10} {'build ms':>10} {'lookup ns':>12} {'hits':>8}")
+
+    for size in SIZES:
+        cidrs = random_cidrs(size, rng)
+
+        start = time.perf_counter()
+        index = RangeIndex.from_cidrs(cidrs)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        lookup = index.lookup
+        start = time.perf_counter()
+        hits = sum(1 for ip in ips if lookup(ip))
+        lookup_ns = (time.perf_counter() - start) / len(ips) * 1e9
+
+        print(f"{size:>10} {len(index):>10} {build_ms:>10.1f} {lookup_ns:>12.0f} {hits:>8}")
+
+    print("=" * 64)
+    return True
+
+def bench_compiled():
+    """Measure compiling a large gzipped prefix file and cold-loading the compiled index"""
+    rng = random.Random(7)
+    ips = random_ips(LOOKUPS, rng)
+
+    print(f"Compiled index with {FILE_PREFIXES} prefixes from a gzipped file")
+    with tempfile.TemporaryDirectory() as tmp:
+        range_file = os.path.join(tmp, 'prefixes.txt.gz')
+        index_file = os.path.join(tmp, 'protected_ranges.idx')
+        with gzip.open(range_file, 'wt') as f:
+            f.write('\n'.join(random_cidrs(FILE_PREFIXES, rng)))
+
+        start = time.perf_counter()
+        load_range_index('', [range_file], index_file)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        index = load_range_index('', [range_file], index_file)
+        load_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        hits = sum(1 for ip in ips if index.lookup(ip))
+        lookup_ns = (time.perf_counter() - start) / len(ips) * 1e9
+
+        print(f"  compile:    {compile_ms:10.1f} ms (first run only)")
+        print(f"  cold load:  {load_ms:10.3f} ms ({os.path.getsize(index_file) / 1024 / 1024:.1f} MiB mapped)")
+        print(f"  lookup:     {lookup_ns:10.0f} ns ({hits} hits)")
+
+    print("=" * 64)
+    return True
+
+if __name__ == "__main__":
+    success = bench_ranges() and bench_compiled()
+    sys.exit(0 if success else 1)
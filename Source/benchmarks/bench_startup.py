@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SOURCE_DIR)
+
+from benchmarks.stubs import StubIPServer
+
+RUNS = 10
+TOP_IMPORTS = 8
+
+# One cron-style check in a fresh interpreter, with state kept in a temp dir
+CHECK_SCRIPT = '''
+import os, sys
+sys.path.insert(0, {source!r})
+import monitor
+from history import HistoryStore
+from outbox import WebhookOutbox
+monitor.IP_SERVICES[:] = [{url!r}]
+ip_monitor = monitor.IPMonitor(fast_start={fast_start})
+ip_monitor.state_file = os.path.join({tmp!r}, 'monitor_state.json')
+ip_monitor.load_state()
+ip_monitor.history = HistoryStore(os.path.join({tmp!r}, 'history'))
+ip_monitor.outbox = WebhookOutbox(os.path.join({tmp!r}, 'outbox.jsonl'), ip_monitor.logger)
+ip_monitor.config.SAFE_IP_RANGE = '192.168.1.0/24'
+ok = ip_monitor.run_check()
+ip_monitor.drain_outbox()
+# Fail if the fast path pulled in requests after all
+sys.exit(0 if ok and ('requests' in sys.modules) != {fast_start} else 1)
+'''
+
+def run(args):
+    """Run a child interpreter; returns (wall seconds, peak RSS in KiB)"""
+    start = time.perf_counter()
+    process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=SOURCE_DIR)
+    # wait4 gives this child's own rusage, not the maximum over all children
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"{args[-1][:60]!r} exited with {process.returncode}")
+    return elapsed, usage.ru_maxrss
+
+def summarize(args):
+    """Median wall milliseconds and peak RSS over RUNS runs"""
+    results = [run(args) for _ in range(RUNS)]
+    return statistics.median(r[0] for r in results) * 1000, max(r[1] for r in results) / 1024
+
+def import_times(modules):
+    """-X importtime cumulative microseconds of each module and of its direct imports"""
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {', '.join(modules)}"],
+        capture_output=True, text=True, cwd=SOURCE_DIR, check=True
+    ).stderr
+
+    # Children are printed before their parent, indented two more spaces
+    totals, children, pending = {}, {}, []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth == 0:
+            totals[name] = int(cumulative)
+            children[name] = [entry for entry in pending if entry[0] == 1]
+            pending = []
+        else:
+            pending.append((depth, name, int(cumulative)))
+    return {name: (totals[name], children[name]) for name in modules if name in totals}
+
+def bench_startup():
+    """Compare a one-shot check on the standard library path with the requests session path"""
+    print("=" * 64)
+    print(f"Startup benchmark (median of {RUNS} runs, peak RSS)")
+    print("=" * 64)
+
+    for label, modules in (("fast start", ['monitor']), ("classic", ['monitor', 'requests'])):
+        times = import_times(modules)
+        print(f"\n{label}: {sum(total for total, _ in times.values()) / 1000:.1f} ms of imports (-X importtime)")
+        for name, (total, children) in times.items():
+            print(f"  {name:<32} {total / 1000:>8.1f} ms")
+            for _, child, micros in sorted(children, key=lambda entry: -entry[2])[:TOP_IMPORTS]:
+                print(f"    {child:<30} {micros / 1000:>8.1f} ms")
+
+    print(f"\n{'scenario':<36} {'wall ms':>10} {'peak RSS MiB':>14}")
+    wall, rss = summarize([sys.executable, '-c', 'pass'])
+    print(f"{'bare interpreter':<36} {wall:>10.1f} {rss:>14.1f}")
+
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer(ip='203.0.113.7') as stub:
+        for label, fast_start in (("check, classic (requests)", False), ("check, fast start (urllib)", True)):
+            script = CHECK_SCRIPT.format(source=SOURCE_DIR, url=f"{stub.url}/ip", tmp=tmp, fast_start=fast_start)
+            wall, rss = summarize([sys.executable, '-c', script])
+            print(f"{label:<36} {wall:>10.1f} {rss:>14.1f}")
+
+if __name__ == '__main__':
+    bench_startup()
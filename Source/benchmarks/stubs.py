@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import ipaddress
+import json
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class StubServer:
+    """Threaded local HTTP server; subclasses answer requests in handle()"""
+
+    def __init__(self, host='127.0.0.1'):
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; without this, Nagle
+            # plus delayed ACKs add ~40 ms to every keep-alive response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                stub._dispatch(self)
+
+            def do_POST(self):
+                stub._dispatch(self)
+
+            do_PUT = do_PATCH = do_HEAD = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        server_class = ThreadingHTTPServer
+        if ':' in host:
+            server_class = type('ThreadingHTTPServerV6', (ThreadingHTTPServer,), {'address_family': socket.AF_INET6})
+        self.server = server_class((host, 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://[{host}]:{port}" if ':' in host else f"http://{host}:{port}"
+
+    def _dispatch(self, handler):
+        with self._lock:
+            self.requests += 1
+        self.handle(handler)
+
+    def handle(self, handler):
+        raise NotImplementedError
+
+    def respond(self, handler, status, body=b'', content_type='text/plain'):
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if handler.command != 'HEAD':
+            handler.wfile.write(body)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+class StubIPServer(StubServer):
+    """Local IP-echo server for tests and benchmarks.
+
+    Every request is answered with a fixed IP, or with the client's own address
+    when no IP is given. Proxied requests (absolute request URIs) get the same
+    answer, so the server doubles as an HTTP forward proxy standing in for a
+    tunnel exit. error_rate and malformed_rate make that share of responses a
+    503 or a body that is not an IP address, drawn from a seeded generator so
+    runs are repeatable.
+    """
+
+    def __init__(self, ip=None, latency=0.0, host='127.0.0.1', error_rate=0.0, malformed_rate=0.0, seed=0):
+        super().__init__(host)
+        self.ip = ip
+        self.latency = latency
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+
+    def handle(self, handler):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            roll = self.random.random()
+
+        if roll < self.error_rate:
+            self.respond(handler, 503, b'upstream unavailable\n')
+        elif roll < self.error_rate + self.malformed_rate:
+            self.respond(handler, 200, b'<html><body>rate limited</body></html>\n', 'text/html')
+        else:
+            self.respond(handler, 200, f"{self.ip or handler.client_address[0]}\n".encode())
+
+class StubWebhookSink(StubServer):
+    """Local webhook receiver that records every delivered payload with its arrival time"""
+
+    def __init__(self, latency=0.0, status=200, host='127.0.0.1'):
+        super().__init__(host)
+        self.latency = latency
+        self.status = status
+        self.received = []
+        self._arrived = threading.Condition(self._lock)
+
+    def handle(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = body.decode('utf-8', errors='replace')
+
+        with self._arrived:
+            self.received.append((time.time(), payload))
+            self._arrived.notify_all()
+        self.respond(handler, self.status, b'{"ok": true}', 'application/json')
+
+    def wait_for(self, count, timeout=30):
+        """Block until count payloads have arrived; returns whether they did"""
+        with self._arrived:
+            return self._arrived.wait_for(lambda: len(self.received) >= count, timeout)
+
+class StubDNSServer:
+    """Local UDP DNS server answering "whoami" names with fixed records.
+
+    records maps a name to (type, value), e.g. {'myip.test': ('A', '203.0.113.7')}.
+    A question for a known name and another type gets an empty answer, an unknown
+    name NXDOMAIN. TXT answers are preceded by a non-IP string, like real
+    whoami services that add EDNS client subnet details.
+    """
+
+    TYPES = {'A': 1, 'TXT': 16, 'AAAA': 28}
+
+    def __init__(self, records, latency=0.0, host='127.0.0.1'):
+        self.records = {name.lower(): record for name, record in records.items()}
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                data, sock = self.request
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                sock.sendto(stub.answer(data), self.client_address)
+
+        self.server = socketserver.ThreadingUDPServer((host, 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def provider(self, name, record_type='A'):
+        """dns:// provider URL asking this server for name"""
+        host, port = self.address
+        return f"dns://{host}:{port}/{name}?type={record_type}"
+
+    def answer(self, query):
+        query_id = struct.unpack('>H', query[:2])[0]
+        # Question: labels up to the root label, then type and class
+        offset, labels = 12, []
+        while query[offset]:
+            labels.append(query[offset + 1:offset + 1 + query[offset]].decode('ascii'))
+            offset += 1 + query[offset]
+        qtype = struct.unpack('>H', query[offset + 1:offset + 3])[0]
+        question = query[12:offset + 5]
+
+        record = self.records.get('.'.join(labels).lower())
+        if record is None:
+            return struct.pack('>HHHHHH', query_id, 0x8183, 1, 0, 0, 0) + question
+
+        record_type, value = record
+        answers = []
+        if self.TYPES[record_type] == qtype:
+            if record_type == 'TXT':
+                rdatas = [b'edns0-client-subnet 198.51.100.0/24', value.encode('ascii')]
+            else:
+                rdatas = [ipaddress.ip_address(value).packed]
+            for rdata in rdatas:
+                if record_type == 'TXT':
+                    rdata = bytes([len(rdata)]) + rdata
+                # Name as a pointer to the question name at offset 12
+                answers.append(struct.pack('>HHHIH', 0xC00C, qtype, 1, 0, len(rdata)) + rdata)
+        header = struct.pack('>HHHHHH', query_id, 0x8180, 1, len(answers), 0, 0)
+        return header + question + b''.join(answers)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
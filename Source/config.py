@@ -1,14 +1,27 @@
 import os
 import json
 import logging
+import re
 from typing import Optional, Dict, Any
+from resolver import parse_dns_provider
+
+def data_path(*names):
+    """Path of a file under the data directory (DATA_DIR, /app/data by default)"""
+    return os.path.join(os.getenv('DATA_DIR', '/app/data'), *names)
+
+def log_path(name):
+    """Path of a log file under the log directory (LOG_DIR, /var/log by default)"""
+    return os.path.join(os.getenv('LOG_DIR', '/var/log'), name)
 
 class Config:
     """Production-ready configuration class for ip monitor"""
     
-    def __init__(self):
-        self.config_file = '/app/data/config.json'
+    def __init__(self, config_file=None, version=1):
+        self.config_file = config_file or data_path('config.json')
         self.logger = logging.getLogger(__name__)
+        # Bumped by reload(); identity of the file this instance was loaded from
+        self.version = version
+        self.file_key = None
         
         # Ensure data directory exists
         os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
@@ -24,9 +37,11 @@ class Config:
         
         # Load from file if it exists
         file_config = {}
+        self.file_key = None
         if os.path.exists(self.config_file):
             try:
                 with open(self.config_file, 'r') as f:
+                    self.file_key = self.get_file_key(os.fstat(f.fileno()))
                     file_config = json.load(f)
                 self.logger.info(f"Loaded configuration from {self.config_file}")
             except Exception as e:
@@ -39,6 +54,11 @@ class Config:
             self._get_env_var('SAFE_IP_RANGE', '192.168.1.0/24')
         )
         
+        self.SAFE_IP_RANGE_FILES = (
+            file_config.get('safe_ip_range_files') or
+            self._get_env_var('SAFE_IP_RANGE_FILES', '')
+        )
+        
         self.WEBHOOK_URL = (
             file_config.get('webhook_url') or
             self._get_env_var('WEBHOOK_URL', 'http://your-home-assistant:8123/api/webhook/your_webhook_id')
@@ -59,26 +79,139 @@ class Config:
             self._get_env_var('WEBHOOK_PASS', '')
         )
         
+        self.WEBHOOK_MAX_AGE = (
+            file_config.get('webhook_max_age') or
+            self._get_env_var('WEBHOOK_MAX_AGE', '24h')
+        )
+        
         self.CHECK_INTERVAL = (
             file_config.get('check_interval') or
             self._get_env_var('CHECK_INTERVAL', '12h')
         )
         
+        self.CHECK_JITTER = (
+            file_config.get('check_jitter') or
+            self._get_env_var('CHECK_JITTER', '30s')
+        )
+        
         self.ALERT_COOLDOWN = (
             file_config.get('alert_cooldown') or
             self._get_env_var('ALERT_COOLDOWN', '1h')
         )
         
+        self.ALERT_COALESCE_WINDOW = (
+            file_config.get('alert_coalesce_window') or
+            self._get_env_var('ALERT_COALESCE_WINDOW', '0')
+        )
+        
         self.APP_NAME = (
             file_config.get('app_name') or
             self._get_env_var('APP_NAME', 'ip monitor')
         )
         
+        self.IP_LOOKUP_MODE = (
+            file_config.get('ip_lookup_mode') or
+            self._get_env_var('IP_LOOKUP_MODE', 'sequential')
+        ).lower()
+        
+        self.TARGETS = (
+            file_config.get('targets') or
+            self._get_env_var('TARGETS', '')
+        )
+        
+        self.TARGET_CONCURRENCY = int(
+            file_config.get('target_concurrency') or
+            self._get_env_var('TARGET_CONCURRENCY', '32')
+        )
+        
+        self.HTTP_CONNECT_TIMEOUT = float(
+            file_config.get('http_connect_timeout') or
+            self._get_env_var('HTTP_CONNECT_TIMEOUT', '3')
+        )
+        
+        self.HTTP_READ_TIMEOUT = float(
+            file_config.get('http_read_timeout') or
+            self._get_env_var('HTTP_READ_TIMEOUT', '10')
+        )
+        
+        # Total time one IP lookup may take over all the services it tries
+        self.LOOKUP_TIMEOUT = float(
+            file_config.get('lookup_timeout') or
+            self._get_env_var('LOOKUP_TIMEOUT', '15')
+        )
+        
+        self.HTTP_POOL_SIZE = int(
+            file_config.get('http_pool_size') or
+            self._get_env_var('HTTP_POOL_SIZE', '4')
+        )
+        
+        self.STATUS_CACHE_TTL = (
+            file_config.get('status_cache_ttl') or
+            self._get_env_var('STATUS_CACHE_TTL', '60s')
+        )
+        
+        self.IP_PROVIDERS = (
+            file_config.get('ip_providers') or
+            self._get_env_var('IP_PROVIDERS', '')
+        )
+        
+        self.IP_FAMILIES = (
+            file_config.get('ip_families') or
+            self._get_env_var('IP_FAMILIES', '')
+        )
+        
+        self.CONSENSUS_PROVIDERS = int(
+            file_config.get('consensus_providers') or
+            self._get_env_var('CONSENSUS_PROVIDERS', '3')
+        )
+        
+        self.CONSENSUS_QUORUM = int(
+            file_config.get('consensus_quorum') or
+            self._get_env_var('CONSENSUS_QUORUM', '2')
+        )
+        
+        self.CONSENSUS_TIMEOUT = float(
+            file_config.get('consensus_timeout') or
+            self._get_env_var('CONSENSUS_TIMEOUT', '2')
+        )
+        
         # Determine config source
         self.config_source = 'file' if os.path.exists(self.config_file) and file_config else 'environment'
         
         self.logger.info(f"Configuration source: {self.config_source}")
     
+    @staticmethod
+    def get_file_key(st):
+        """Identity of a config file version: replaced files get a new inode, edited ones a new mtime or size"""
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+    
+    def has_changed(self) -> bool:
+        """Check with a single stat whether config.json differs from what this instance was loaded from"""
+        try:
+            key = self.get_file_key(os.stat(self.config_file))
+        except OSError:
+            key = None
+        return key != self.file_key
+    
+    def reload(self) -> 'Config':
+        """Load config.json into a new, validated instance with the next version number"""
+        return Config(self.config_file, self.version + 1)
+    
+    def write_file(self, config_to_save: Dict[str, Any]):
+        """Validate and atomically replace config.json, so no process ever reads a partial or invalid file"""
+        tmp_path = f"{self.config_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(config_to_save, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            # Raises before the live file is touched if the new values are invalid
+            Config(tmp_path)
+            os.replace(tmp_path, self.config_file)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
     def _get_env_var(self, key: str, default: str) -> str:
         """Get environment variable with default value"""
         return os.getenv(key, default)
@@ -96,11 +229,82 @@ class Config:
         
         if self.WEBHOOK_METHOD not in ['GET', 'POST', 'PUT', 'PATCH', 'HEAD']:
             raise ValueError("WEBHOOK_METHOD must be one of: GET, POST, PUT, PATCH, HEAD")
+        
+        # Validate egress targets
+        names = set()
+        for target in self.get_targets():
+            if not isinstance(target, dict) or not target.get('name'):
+                raise ValueError("Each target must be an object with a name")
+            if target['name'] in names:
+                raise ValueError(f"Duplicate target name: {target['name']}")
+            names.add(target['name'])
+            if not target.get('proxy') and not target.get('source_address'):
+                raise ValueError(f"Target {target['name']} needs a proxy or source_address")
+        
+        if self.IP_LOOKUP_MODE not in ['sequential', 'race', 'consensus']:
+            raise ValueError("IP_LOOKUP_MODE must be one of: sequential, race, consensus")
+        
+        self.get_ip_families()
+        self.get_coalesce_window()
+        
+        if not 1 <= self.CONSENSUS_QUORUM <= self.CONSENSUS_PROVIDERS:
+            raise ValueError("CONSENSUS_QUORUM must be between 1 and CONSENSUS_PROVIDERS")
+        
+        providers = self.get_ip_providers()
+        if self.IP_LOOKUP_MODE == 'consensus' and providers and self.CONSENSUS_QUORUM > len(providers):
+            raise ValueError(f"CONSENSUS_QUORUM ({self.CONSENSUS_QUORUM}) is more than the {len(providers)} configured IP providers")
+        
+        # Validate IP providers
+        for provider in providers:
+            if provider.startswith('dns://'):
+                parse_dns_provider(provider)
+            elif not provider.startswith(('http://', 'https://')):
+                raise ValueError(f"IP provider must be an http(s):// or dns:// URL: {provider}")
     
     def get_safe_ranges(self):
         """Get list of protected IP ranges (ranges where VPN is disabled/alert should trigger)"""
         return [r.strip() for r in self.SAFE_IP_RANGE.split(',') if r.strip()]
     
+    def get_range_files(self):
+        """Get list of files with additional protected ranges (one CIDR per line, optionally gzipped)"""
+        return [f.strip() for f in self.SAFE_IP_RANGE_FILES.split(',') if f.strip()]
+    
+    def get_targets(self):
+        """Get list of egress targets; stored as a JSON list in the file or a JSON string in TARGETS"""
+        targets = self.TARGETS
+        if isinstance(targets, str):
+            targets = json.loads(targets) if targets.strip() else []
+        return targets
+    
+    def get_ip_providers(self):
+        """Get the configured IP providers in order; a list in the file or comma-separated in IP_PROVIDERS"""
+        providers = self.IP_PROVIDERS
+        if isinstance(providers, str):
+            providers = providers.split(',')
+        return [p.strip() for p in providers if p.strip()]
+    
+    def get_ip_families(self):
+        """Address families (4, 6) checked separately, from e.g. 'ipv4,ipv6'; empty means whichever the route uses"""
+        families = []
+        for name in self.IP_FAMILIES.split(','):
+            name = name.strip().lower()
+            if not name:
+                continue
+            if name not in ('ipv4', 'ipv6'):
+                raise ValueError(f"IP_FAMILIES entries must be ipv4 or ipv6: {name}")
+            if int(name[3]) not in families:
+                families.append(int(name[3]))
+        return families
+    
+    def get_coalesce_window(self):
+        """Alert coalescing window in seconds, from e.g. '30s', '2m' or '1h30m'; 0 (with any unit) disables it"""
+        value = str(self.ALERT_COALESCE_WINDOW).strip().lower()
+        match = re.fullmatch(r'(\d+)|(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?', value)
+        if not value or not match:
+            raise ValueError(f"ALERT_COALESCE_WINDOW must be a duration like 30s, 2m or 0 (disabled): {value}")
+        seconds, hours, minutes, rest = (int(group or 0) for group in match.groups())
+        return seconds + hours * 3600 + minutes * 60 + rest
+    
     def is_editable(self):
         """Check if configuration can be edited via web interface"""
         return self.config_source == 'file' or not os.path.exists(self.config_file)
@@ -109,13 +313,30 @@ class Config:
         """Convert configuration to dictionary"""
         return {
             'safe_ip_range': self.SAFE_IP_RANGE,
+            'safe_ip_range_files': self.SAFE_IP_RANGE_FILES,
             'webhook_url': self.WEBHOOK_URL,
             'webhook_method': self.WEBHOOK_METHOD,
             'webhook_user': self.WEBHOOK_USER,
             'webhook_pass': self.WEBHOOK_PASS,
+            'webhook_max_age': self.WEBHOOK_MAX_AGE,
             'check_interval': self.CHECK_INTERVAL,
+            'check_jitter': self.CHECK_JITTER,
             'alert_cooldown': self.ALERT_COOLDOWN,
+            'alert_coalesce_window': self.ALERT_COALESCE_WINDOW,
             'app_name': self.APP_NAME,
+            'ip_lookup_mode': self.IP_LOOKUP_MODE,
+            'targets': self.get_targets(),
+            'target_concurrency': self.TARGET_CONCURRENCY,
+            'status_cache_ttl': self.STATUS_CACHE_TTL,
+            'ip_providers': self.get_ip_providers(),
+            'ip_families': self.IP_FAMILIES,
+            'consensus_providers': self.CONSENSUS_PROVIDERS,
+            'consensus_quorum': self.CONSENSUS_QUORUM,
+            'consensus_timeout': self.CONSENSUS_TIMEOUT,
+            'http_connect_timeout': self.HTTP_CONNECT_TIMEOUT,
+            'http_read_timeout': self.HTTP_READ_TIMEOUT,
+            'lookup_timeout': self.LOOKUP_TIMEOUT,
+            'http_pool_size': self.HTTP_POOL_SIZE,
             'config_source': self.config_source,
             'is_editable': self.is_editable()
         }
@@ -129,22 +350,34 @@ class Config:
             # Validate new config
             config_to_save = {
                 'safe_ip_range': new_config.get('safe_ip_range', self.SAFE_IP_RANGE),
+                'safe_ip_range_files': new_config.get('safe_ip_range_files', self.SAFE_IP_RANGE_FILES),
                 'webhook_url': new_config.get('webhook_url', self.WEBHOOK_URL),
                 'webhook_method': new_config.get('webhook_method', self.WEBHOOK_METHOD).upper(),
                 'webhook_user': new_config.get('webhook_user', self.WEBHOOK_USER),
                 'webhook_pass': new_config.get('webhook_pass', self.WEBHOOK_PASS),
+                'webhook_max_age': new_config.get('webhook_max_age', self.WEBHOOK_MAX_AGE),
                 'check_interval': new_config.get('check_interval', self.CHECK_INTERVAL),
+                'check_jitter': new_config.get('check_jitter', self.CHECK_JITTER),
                 'alert_cooldown': new_config.get('alert_cooldown', self.ALERT_COOLDOWN),
-                'app_name': new_config.get('app_name', self.APP_NAME)
+                'alert_coalesce_window': new_config.get('alert_coalesce_window', self.ALERT_COALESCE_WINDOW),
+                'app_name': new_config.get('app_name', self.APP_NAME),
+                'ip_lookup_mode': new_config.get('ip_lookup_mode', self.IP_LOOKUP_MODE).lower(),
+                'status_cache_ttl': new_config.get('status_cache_ttl', self.STATUS_CACHE_TTL),
+                'ip_providers': new_config.get('ip_providers', self.get_ip_providers()),
+                'ip_families': new_config.get('ip_families', self.IP_FAMILIES),
+                'consensus_providers': new_config.get('consensus_providers', self.CONSENSUS_PROVIDERS),
+                'consensus_quorum': new_config.get('consensus_quorum', self.CONSENSUS_QUORUM),
+                'consensus_timeout': new_config.get('consensus_timeout', self.CONSENSUS_TIMEOUT),
+                'targets': new_config.get('targets', self.get_targets()),
+                'target_concurrency': new_config.get('target_concurrency', self.TARGET_CONCURRENCY),
+                'http_connect_timeout': new_config.get('http_connect_timeout', self.HTTP_CONNECT_TIMEOUT),
+                'http_read_timeout': new_config.get('http_read_timeout', self.HTTP_READ_TIMEOUT),
+                'lookup_timeout': new_config.get('lookup_timeout', self.LOOKUP_TIMEOUT),
+                'http_pool_size': new_config.get('http_pool_size', self.HTTP_POOL_SIZE)
             }
             
-            # Save to file
-            with open(self.config_file, 'w') as f:
-                json.dump(config_to_save, f, indent=2)
-            
-            # Reload configuration
-            self.load_config()
-            self._validate_config()
+            # Save to file; running monitors pick it up with reload()
+            self.write_file(config_to_save)
             
             self.logger.info("Configuration saved successfully")
             return True
@@ -157,22 +390,36 @@ class Config:
         """Migrate configuration from environment variables to file"""
         env_config = {
             'safe_ip_range': self._get_env_var('SAFE_IP_RANGE', ''),
+            'safe_ip_range_files': self._get_env_var('SAFE_IP_RANGE_FILES', ''),
             'webhook_url': self._get_env_var('WEBHOOK_URL', ''),
             'webhook_method': self._get_env_var('WEBHOOK_METHOD', 'POST'),
             'webhook_user': self._get_env_var('WEBHOOK_USER', ''),
             'webhook_pass': self._get_env_var('WEBHOOK_PASS', ''),
+            'webhook_max_age': self._get_env_var('WEBHOOK_MAX_AGE', ''),
             'check_interval': self._get_env_var('CHECK_INTERVAL', '12h'),
-            'alert_cooldown': self._get_env_var('ALERT_COOLDOWN', '1h')
+            'check_jitter': self._get_env_var('CHECK_JITTER', ''),
+            'alert_cooldown': self._get_env_var('ALERT_COOLDOWN', '1h'),
+            'alert_coalesce_window': self._get_env_var('ALERT_COALESCE_WINDOW', ''),
+            'ip_lookup_mode': self._get_env_var('IP_LOOKUP_MODE', ''),
+            'status_cache_ttl': self._get_env_var('STATUS_CACHE_TTL', ''),
+            'ip_providers': [p.strip() for p in self._get_env_var('IP_PROVIDERS', '').split(',') if p.strip()],
+            'ip_families': self._get_env_var('IP_FAMILIES', ''),
+            'consensus_providers': self._get_env_var('CONSENSUS_PROVIDERS', ''),
+            'consensus_quorum': self._get_env_var('CONSENSUS_QUORUM', ''),
+            'consensus_timeout': self._get_env_var('CONSENSUS_TIMEOUT', ''),
+            'targets': json.loads(self._get_env_var('TARGETS', '') or '[]'),
+            'target_concurrency': self._get_env_var('TARGET_CONCURRENCY', ''),
+            'http_connect_timeout': self._get_env_var('HTTP_CONNECT_TIMEOUT', ''),
+            'http_read_timeout': self._get_env_var('HTTP_READ_TIMEOUT', ''),
+            'lookup_timeout': self._get_env_var('LOOKUP_TIMEOUT', ''),
+            'http_pool_size': self._get_env_var('HTTP_POOL_SIZE', '')
         }
         
         # Only save non-empty values
         config_to_save = {k: v for k, v in env_config.items() if v}
         
         if config_to_save:
-            with open(self.config_file, 'w') as f:
-                json.dump(config_to_save, f, indent=2)
-            
-            self.load_config()
+            self.write_file(config_to_save)
             self.logger.info("Configuration migrated from environment variables")
             return True
         
@@ -185,8 +432,16 @@ class Config:
   Source: {self.config_source}
   Editable: {self.is_editable()}
   Safe IP Ranges: {self.SAFE_IP_RANGE}
+  Safe IP Range Files: {self.SAFE_IP_RANGE_FILES or 'none'}
   Webhook URL: {self.WEBHOOK_URL}
   Webhook Method: {self.WEBHOOK_METHOD}
   Basic Auth: {auth_status}
   Check Interval: {self.CHECK_INTERVAL}
-  Alert Cooldown: {self.ALERT_COOLDOWN}"""
\ No newline at end of file
+  Check Jitter: {self.CHECK_JITTER}
+  Alert Cooldown: {self.ALERT_COOLDOWN}
+  Alert Coalesce Window: {self.ALERT_COALESCE_WINDOW}
+  IP Lookup Mode: {self.IP_LOOKUP_MODE}{f' ({self.CONSENSUS_QUORUM} of {self.CONSENSUS_PROVIDERS} within {self.CONSENSUS_TIMEOUT}s)' if self.IP_LOOKUP_MODE == 'consensus' else ''}
+  Status Cache TTL: {self.STATUS_CACHE_TTL}
+  IP Providers: {', '.join(self.get_ip_providers()) or 'built-in'}
+  IP Families: {self.IP_FAMILIES or 'any'}
+  Egress Targets: {len(self.get_targets())}"""
\ No newline at end of file
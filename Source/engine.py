@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from requests.adapters import HTTPAdapter
+
+from monitor import build_session, is_inconclusive
+from ranges import RangeIndex
+
+class SourceAddressAdapter(HTTPAdapter):
+    """HTTP adapter that binds outgoing connections to a local source address"""
+    
+    def __init__(self, source_address=None, **kwargs):
+        self.source_address = (source_address, 0)
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['source_address'] = self.source_address
+        super().init_poolmanager(*args, **kwargs)
+    
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        proxy_kwargs['source_address'] = self.source_address
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+class EgressTarget:
+    """A named egress path to monitor: a proxy URL and/or a bound source address"""
+    
+    def __init__(self, name, proxy=None, source_address=None, safe_ip_range=None, alert_cooldown=None):
+        self.name = name
+        self.proxy = proxy
+        self.source_address = source_address
+        self.safe_ip_range = safe_ip_range
+        self.alert_cooldown = alert_cooldown
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Create a target from a config entry"""
+        return cls(
+            name=data['name'],
+            proxy=data.get('proxy') or None,
+            source_address=data.get('source_address') or None,
+            safe_ip_range=data.get('safe_ip_range') or None,
+            alert_cooldown=data.get('alert_cooldown') or None
+        )
+    
+    def key(self):
+        """Identity of the target definition, used to detect config changes"""
+        return (self.name, self.proxy, self.source_address, self.safe_ip_range, self.alert_cooldown)
+    
+    def get_safe_ranges(self, config):
+        """Get protected ranges for this target, falling back to the global ones"""
+        if not self.safe_ip_range:
+            return config.get_safe_ranges()
+        return [r.strip() for r in self.safe_ip_range.split(',') if r.strip()]
+    
+    def build_session(self, config):
+        """Create a keep-alive session that sends traffic through this target's egress path"""
+        if self.source_address:
+            session = build_session(config, SourceAddressAdapter, source_address=self.source_address)
+        else:
+            session = build_session(config)
+        
+        # Ignore HTTP(S)_PROXY from the environment so every target uses only its own path
+        session.trust_env = False
+        
+        if self.proxy:
+            session.proxies = {'http': self.proxy, 'https': self.proxy}
+        
+        return session
+
+class MonitoringEngine:
+    """Runs the default check plus every configured egress target concurrently on a bounded thread pool"""
+    
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.logger = monitor.logger
+        # target name -> (target key, session, range index)
+        self._runtime = {}
+        self._runtime_lock = threading.Lock()
+    
+    def get_targets(self):
+        """Build target objects from the current configuration"""
+        return [EgressTarget.from_dict(entry) for entry in self.monitor.config.get_targets()]
+    
+    def get_runtime(self, target):
+        """Get the cached session and range index for a target, rebuilding them if its definition changed"""
+        with self._runtime_lock:
+            key = target.key() + (self.monitor.config.HTTP_POOL_SIZE,)
+            cached = self._runtime.get(target.name)
+            if cached and cached[0] == key:
+                return cached[1], cached[2]
+            
+            if cached:
+                cached[1].close()
+            
+            session = target.build_session(self.monitor.config)
+            if target.safe_ip_range:
+                index = RangeIndex.from_cidrs(target.get_safe_ranges(self.monitor.config), self.logger)
+            else:
+                index = None
+            self._runtime[target.name] = (key, session, index)
+            return session, index
+    
+    def prune(self, targets):
+        """Close sessions of targets that were removed from the configuration"""
+        names = {target.name for target in targets}
+        with self._runtime_lock:
+            for name in list(self._runtime):
+                if name not in names:
+                    self._runtime.pop(name)[1].close()
+    
+    def check_target(self, target):
+        """Check a single egress target and record the result in its state"""
+        started = time.monotonic()
+        session, index = self.get_runtime(target)
+        result = {
+            "name": target.name,
+            "current_ip": None,
+            "is_safe": None,
+            "protected_range": None,
+            "status": "Error",
+            "error": None,
+            "last_check": datetime.now().isoformat()
+        }
+        
+        lookup = {'ip': None, 'provider': None, 'latencies': {}}
+        try:
+            lookup = self.monitor.lookup_public_ip(session)
+            current_ip = lookup['ip']
+            
+            if is_inconclusive(lookup):
+                result.update({"status": "Inconclusive", "error": "IP services disagree on the egress IP"})
+                self.logger.warning(f"[{target.name}] IP services disagree on the egress IP")
+            elif not current_ip:
+                result['error'] = "Could not retrieve egress IP"
+                self.logger.error(f"[{target.name}] Could not retrieve egress IP")
+            else:
+                index = index or self.monitor.get_range_index()
+                protected_range = index.lookup(current_ip)
+                result.update({
+                    "current_ip": current_ip,
+                    "is_safe": protected_range is None,
+                    "protected_range": protected_range,
+                    "status": "Protected" if protected_range is None else "Alert",
+                    "provider": lookup['provider']
+                })
+                
+                self.monitor.track_ip_change([current_ip], target.name)
+                
+                if protected_range:
+                    self.logger.warning(f"⚠️  VPN ALERT [{target.name}]: IP {current_ip} is in protected range {protected_range}")
+                    self.monitor.send_notification(current_ip, protected_range, target)
+                else:
+                    self.logger.info(f"[{target.name}] Success; egress IP {current_ip} is outside protected ranges")
+        
+        except Exception as e:
+            result['error'] = str(e)
+            self.logger.error(f"[{target.name}] Check failed: {e}")
+        
+        if 'consensus' in lookup:
+            result['consensus'] = lookup['consensus']
+        outcome = self.monitor.record_history(lookup, result['protected_range'], target.name)
+        
+        with self.monitor.state_lock:
+            self.monitor.increment_state('total_checks', 1, target.name)
+            for key, field in (('last_check', 'last_check'), ('last_status', 'status'), ('last_error', 'error'),
+                               ('last_is_safe', 'is_safe'), ('last_protected_range', 'protected_range')):
+                self.monitor.set_state(key, result[field], target.name)
+            if result['is_safe']:
+                self.monitor.set_state('consecutive_alerts', 0, target.name)
+        
+        self.monitor.record_check_duration(started, outcome, target.name)
+        return result
+    
+    def run_cycle(self):
+        """Check the default egress path and all targets; returns the default check result and per-target results"""
+        targets = self.get_targets()
+        self.prune(targets)
+        
+        if not targets:
+            return self.monitor.run_check(), []
+        
+        max_workers = max(1, min(self.monitor.config.TARGET_CONCURRENCY, len(targets) + 1))
+        self.logger.info(f"Checking default egress and {len(targets)} target(s) with {max_workers} worker(s)")
+        
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='egress-check') as executor:
+            default_future = executor.submit(self.monitor.run_check)
+            results = list(executor.map(self.check_target, targets))
+            success = default_future.result()
+        
+        self.monitor.save_state()
+        
+        alerts = sum(1 for result in results if result['status'] == 'Alert')
+        errors = sum(1 for result in results if result['status'] == 'Error')
+        self.logger.info(f"Target checks completed: {len(results) - alerts - errors} protected, {alerts} alert(s), {errors} error(s)")
+        return success, results
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import queue
+import threading
+import time
+
+from logfiles import LogFollower, read_recent_lines
+
+# How often the watcher looks for new check results, state changes and log lines
+POLL_INTERVAL = 0.5
+
+# Comment line sent to idle clients so dropped connections are noticed
+HEARTBEAT_INTERVAL = 15
+
+# Events buffered per client before it is told to resync instead
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# Log lines included in the snapshot sent on connect
+SNAPSHOT_LOG_LINES = 5
+
+class EventHub:
+    """Fan-out of dashboard events to Server-Sent Events clients.
+
+    A single watcher thread polls the shared files the check process writes
+    (history store, state file, log file) and publishes what changed, so the
+    cost is per event rather than per client and poll. Each client gets its
+    own bounded queue; a client that falls behind gets a 'resync' marker and
+    a fresh snapshot instead of an unbounded backlog.
+    """
+
+    def __init__(self, get_monitor, log_file, logger=None):
+        self.get_monitor = get_monitor
+        self.log_file = log_file
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.follower = LogFollower(log_file)
+        self.last_check = None
+        self.last_state_version = None
+        self.last_status = None
+        self.last_config = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def subscribe(self):
+        """Register a client; starts the watcher with the first one"""
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            if not self.subscribers:
+                self.reset()
+            self.subscribers.add(subscriber)
+            if self.thread is None or not self.thread.is_alive():
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self.loop, name='event-hub', daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def publish(self, event, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # Too far behind; drop the backlog and let the stream send a snapshot
+                while True:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        break
+                subscriber.put_nowait(('resync', None))
+
+    def reset(self):
+        """Start watching from now, so new clients are not replayed old events"""
+        monitor = self.get_monitor()
+        self.follower.seek_end()
+        self.last_check = time.time()
+        self.last_state_version = monitor.get_state_version()
+        self.last_status = None
+        self.last_config = monitor.config.to_dict()
+
+    def snapshot(self):
+        """Events that bring a newly connected (or resyncing) client up to date"""
+        monitor = self.get_monitor()
+        status = monitor.get_last_status() or monitor.get_status()
+        return [
+            ('status', status),
+            ('config', monitor.config.to_dict()),
+            ('log_tail', read_recent_lines(self.log_file, SNAPSHOT_LOG_LINES))
+        ]
+
+    def poll(self):
+        """Publish everything that changed since the last poll"""
+        monitor = self.get_monitor()
+        monitor.reload_config()
+
+        checks = monitor.history.points_since(self.last_check)
+        for point in checks:
+            self.publish('check', point)
+        if checks:
+            self.last_check = checks[-1]['timestamp']
+
+        state_version = monitor.get_state_version()
+        if checks or state_version != self.last_state_version:
+            self.last_state_version = state_version
+            status = monitor.get_last_status()
+            if status is not None:
+                encoded = json.dumps(status, sort_keys=True, default=str)
+                if encoded != self.last_status:
+                    self.last_status = encoded
+                    self.publish('status', status)
+
+        config = monitor.config.to_dict()
+        if config != self.last_config:
+            self.last_config = config
+            self.publish('config', config)
+
+        lines = self.follower.read_new()
+        if lines:
+            self.publish('logs', lines)
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            if not self.subscriber_count():
+                # Nobody listening; stop until the next client subscribes
+                with self.lock:
+                    if not self.subscribers:
+                        self.thread = None
+                        return
+            try:
+                self.poll()
+            except Exception as e:
+                self.logger.error(f"Event hub error: {e}")
+            self.stop_event.wait(POLL_INTERVAL)
+
+    def stream(self):
+        """Generator of Server-Sent Events for one client"""
+        subscriber = self.subscribe()
+        try:
+            for event, data in self.snapshot():
+                yield format_event(event, data)
+
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                if event == 'resync':
+                    for event, data in self.snapshot():
+                        yield format_event(event, data)
+                else:
+                    yield format_event(event, data)
+        finally:
+            self.unsubscribe(subscriber)
+
+def format_event(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
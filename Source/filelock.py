@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import fcntl
+import os
+import threading
+
+class FileLock:
+    """Exclusive advisory lock on a file, shared between processes and between threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        # flock works per open file, so threads of one process queue here first;
+        # this also keeps them from overwriting each other's fd
+        self.thread_lock = threading.Lock()
+
+    def acquire(self, blocking=True):
+        if not self.thread_lock.acquire(blocking):
+            return False
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            self.thread_lock.release()
+            raise
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            self.thread_lock.release()
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fd, self.fd = self.fd, None
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""gunicorn hooks; startup.py passes this file with --config, and gunicorn also reads it from the working directory"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def when_ready(server):
+    """Log the web server start once, from the master, rather than from every worker"""
+    from config import log_path
+
+    log_file = log_path('ip-monitor.log')
+    try:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        with open(log_file, 'a') as f:
+            f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] INFO: Web server started on port {os.getenv('WEB_PORT', 8080)} "
+                    f"(gunicorn, {server.num_workers} workers)\n")
+    except Exception as e:
+        server.log.error(f"Could not write startup log: {e}")
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from config import data_path
+from filelock import FileLock
+
+# Segment file layout: SEGMENT_HEADER, then fixed-size RECORDs in append
+# (time) order. Each segment covers SEGMENT_SPAN seconds and is named after
+# its start, so the file names are the coarse time index and bisecting the
+# fixed-size records is the fine one.
+SEGMENT_MAGIC = b'IPHIST01'
+SEGMENT_HEADER = struct.Struct('<8sd')
+# timestamp, outcome, address family, packed IP, range id, provider id, target id, latency (ms, NaN if unknown)
+RECORD = struct.Struct('<dBB16sIHHf2x')
+SEGMENT_SPAN = 86400
+
+# Closed segments are summarised into ROLLUP_STEP buckets so long-range
+# queries read a few hundred rows per day instead of every check
+ROLLUP_STEP = 300
+
+# Most recent points kept in memory
+RING_SIZE = 4096
+
+# Upper bound on buckets returned by a query when no step is given
+MAX_POINTS = 500
+
+OUTCOMES = ('protected', 'alert', 'error', 'inconclusive')
+
+class HistoryStore:
+    """Append-only time-series store of check results.
+
+    Points are appended to daily binary segments under directory. Strings
+    (ranges, providers, targets) are interned in an append-only dictionary
+    file so records stay fixed-size. Recent points are also kept in an
+    in-memory ring buffer that follows the active segment, so dashboard-sized
+    queries never touch older segments.
+    """
+
+    def __init__(self, directory=None, logger=None):
+        self.directory = directory or data_path('history')
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.file_lock = FileLock(os.path.join(directory, '.lock'))
+        self.strings_file = os.path.join(directory, 'strings.jsonl')
+        self.strings = [None]
+        self.string_ids = {None: 0}
+        self._strings_offset = 0
+        self.ring = deque(maxlen=RING_SIZE)
+        # (segment start, byte offset) the ring buffer has consumed up to
+        self._ring_position = None
+        # segment start -> (segment size, rollup buckets)
+        self._rollups = {}
+        # (directory mtime, segment starts) from the last listing
+        self._segments = None
+        os.makedirs(directory, exist_ok=True)
+
+    def segment_path(self, start):
+        return os.path.join(self.directory, f"seg-{int(start)}.bin")
+
+    def list_segments(self):
+        """Sorted segment start times present on disk"""
+        # Creating or removing a segment changes the directory mtime
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return []
+        today = time.time() // SEGMENT_SPAN * SEGMENT_SPAN
+        if self._segments is not None and self._segments[0] == mtime and today in self._segments[1]:
+            return self._segments[1]
+
+        starts = []
+        for path in glob.glob(os.path.join(self.directory, 'seg-*.bin')):
+            try:
+                starts.append(int(os.path.basename(path)[4:-4]))
+            except ValueError:
+                continue
+        starts.sort()
+        self._segments = (mtime, starts)
+        return starts
+
+    def _load_strings(self):
+        """Read dictionary entries appended since the last call"""
+        try:
+            if os.path.getsize(self.strings_file) == self._strings_offset:
+                return
+            with open(self.strings_file, 'rb') as f:
+                f.seek(self._strings_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # Only consume complete lines; a partial one is still being written
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            value = json.loads(line)
+            self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        self._strings_offset += end
+
+    def _intern(self, value):
+        """Dictionary id for value, appending it if new; caller holds the file lock"""
+        if value in self.string_ids:
+            return self.string_ids[value]
+        self._load_strings()
+        if value not in self.string_ids:
+            with open(self.strings_file, 'a') as f:
+                f.write(json.dumps(value) + '\n')
+            self._load_strings()
+        return self.string_ids[value]
+
+    def append(self, timestamp, outcome, ip=None, protected_range=None, provider=None, latency_ms=None, target=None):
+        """Store one check result"""
+        if ip and ':' in ip:
+            family, packed = 6, socket.inet_pton(socket.AF_INET6, ip)
+        elif ip:
+            family, packed = 4, socket.inet_pton(socket.AF_INET, ip)
+        else:
+            family, packed = 0, b''
+
+        start = timestamp - timestamp % SEGMENT_SPAN
+        path = self.segment_path(start)
+
+        with self.lock, self.file_lock:
+            record = RECORD.pack(
+                timestamp, OUTCOMES.index(outcome), family, packed,
+                self._intern(protected_range), self._intern(provider), self._intern(target),
+                math.nan if latency_ms is None else latency_ms
+            )
+            with open(path, 'ab') as f:
+                if f.tell() == 0:
+                    f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, start))
+                f.write(record)
+
+    def decode(self, data, offset=SEGMENT_HEADER.size):
+        """Decode the complete records in data from offset onwards"""
+        end = offset + (len(data) - offset) // RECORD.size * RECORD.size
+        points = []
+        for timestamp, outcome, family, packed, range_id, provider_id, target_id, latency in RECORD.iter_unpack(data[offset:end]):
+            if family == 4:
+                ip = socket.inet_ntop(socket.AF_INET, packed[:4])
+            elif family == 6:
+                ip = socket.inet_ntop(socket.AF_INET6, packed)
+            else:
+                ip = None
+            points.append((timestamp, outcome, ip, range_id, provider_id, target_id, None if math.isnan(latency) else latency))
+        return points
+
+    def read_segment(self, start, offset=None, since=None, until=None):
+        """Return (points, end offset) for a segment from a byte offset, or only points with since <= timestamp < until"""
+        try:
+            with open(self.segment_path(start), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+
+        if len(data) < SEGMENT_HEADER.size or SEGMENT_HEADER.unpack_from(data)[0] != SEGMENT_MAGIC:
+            self.logger.error(f"Ignoring unreadable history segment {self.segment_path(start)}")
+            return [], 0
+
+        offset = offset or SEGMENT_HEADER.size
+        end = offset + (len(data) - offset) // RECORD.size * RECORD.size
+        if since is not None or until is not None:
+            # Bisect the raw records so only the requested slice is decoded
+            timestamps = TimestampView(data, offset, end)
+            lo = bisect.bisect_left(timestamps, since) if since is not None else 0
+            hi = bisect.bisect_left(timestamps, until) if until is not None else len(timestamps)
+            return self.decode(data[:offset + hi * RECORD.size], offset + lo * RECORD.size), end
+        return self.decode(data[:end], offset), end
+
+    def refresh(self):
+        """Pull points appended by any process into the ring buffer"""
+        with self.lock:
+            self._load_strings()
+            segments = self.list_segments()
+            if not segments:
+                return
+
+            if self._ring_position is None:
+                self._ring_position = (segments[-1], None)
+
+            position_start, offset = self._ring_position
+            if position_start == segments[-1] and offset is not None:
+                try:
+                    if os.path.getsize(self.segment_path(position_start)) == offset:
+                        return
+                except OSError:
+                    pass
+
+            for start in segments[bisect.bisect_left(segments, position_start):]:
+                points, end = self.read_segment(start, offset if start == position_start else None)
+                self.ring.extend(points)
+                if end:
+                    self._ring_position = (start, end)
+
+    def points_between(self, start, end):
+        """Raw points with start <= timestamp < end, served from the ring buffer when it covers the range"""
+        self.refresh()
+        ring = list(self.ring)
+        if ring and start >= ring[0][0]:
+            return [point for point in ring if start <= point[0] < end]
+
+        points = []
+        first = start - start % SEGMENT_SPAN
+        for segment in self.list_segments():
+            if segment < first or segment >= end:
+                continue
+            segment_points, _ = self.read_segment(segment, since=start, until=end)
+            points.extend(segment_points)
+        return points
+
+    def points_since(self, timestamp):
+        """Formatted points appended after timestamp that are still in the ring buffer, oldest first"""
+        self.refresh()
+        points = []
+        for point in reversed(list(self.ring)):
+            if point[0] <= timestamp:
+                break
+            points.append(self.format_point(point))
+        points.reverse()
+        return points
+
+    def last_timestamp(self):
+        """Timestamp of the newest stored point, or None"""
+        self.refresh()
+        return self.ring[-1][0] if self.ring else None
+
+    def latest(self, target=None):
+        """Most recent point for a target, whatever its outcome, or None"""
+        self.refresh()
+        target_id = self.string_ids.get(target)
+        for point in reversed(list(self.ring)):
+            if point[5] == target_id:
+                return self.format_point(point)
+        return None
+
+    def format_point(self, point):
+        timestamp, outcome, ip, range_id, provider_id, target_id, latency = point
+        return {
+            'timestamp': timestamp,
+            'outcome': OUTCOMES[outcome],
+            'ip': ip,
+            'protected_range': self.strings[range_id] if range_id else None,
+            'provider': self.strings[provider_id] if provider_id else None,
+            'target': self.strings[target_id] if target_id else None,
+            'latency_ms': latency
+        }
+
+    def rollup(self, start):
+        """ROLLUP_STEP buckets of a closed segment, rebuilt whenever the segment changes"""
+        path = self.segment_path(start)
+        rollup_path = f"{path[:-4]}.rollup"
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return {}
+
+        cached = self._rollups.get(start)
+        if cached and cached[0] == size:
+            return cached[1]
+
+        try:
+            with open(rollup_path, 'r') as f:
+                stored = json.load(f)
+            if stored['segment_size'] == size:
+                buckets = {(row[0], row[1]): row[2:] for row in stored['rows']}
+                self._rollups[start] = (size, buckets)
+                return buckets
+        except (OSError, ValueError, KeyError):
+            pass
+
+        points, _ = self.read_segment(start)
+        buckets = aggregate(points, ROLLUP_STEP)
+        tmp_path = f"{rollup_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'segment_size': size, 'rows': [list(key) + bucket for key, bucket in buckets.items()]}, f)
+            os.replace(tmp_path, rollup_path)
+        except OSError as e:
+            self.logger.error(f"Could not write history rollup {rollup_path}: {e}")
+        self._rollups[start] = (size, buckets)
+        return buckets
+
+    def query(self, start, end, step=None, target=None):
+        """Downsample points between start and end into step-second buckets for one target (None = default egress).
+
+        Without a step, one is picked to return at most MAX_POINTS buckets,
+        rounded up to a multiple of ROLLUP_STEP for long ranges so closed
+        segments are answered from their rollups.
+        """
+        if end <= start:
+            return {'from': start, 'to': end, 'step': step, 'points': []}
+
+        if not step:
+            step = max(1, math.ceil((end - start) / MAX_POINTS))
+            if step > ROLLUP_STEP:
+                step = math.ceil(step / ROLLUP_STEP) * ROLLUP_STEP
+        step = max(1, int(step))
+        # Widen the range to whole buckets so partial buckets are never reported
+        start = start - start % step
+        end = end if end % step == 0 else end - end % step + step
+
+        self.refresh()
+        target_id = self.string_ids.get(target)
+        if target_id is None:
+            return {'from': start, 'to': end, 'step': step, 'points': []}
+
+        buckets = {}
+        ring_start = self.ring[0][0] if self.ring else None
+        use_rollups = step % ROLLUP_STEP == 0
+        active = self.list_segments()[-1:] or [None]
+
+        if use_rollups and (ring_start is None or start < ring_start):
+            # Whole closed segments come from their rollups, the rest from raw points
+            raw_from = start
+            for segment in self.list_segments():
+                if segment + SEGMENT_SPAN <= start or segment >= end or segment == active[0]:
+                    continue
+                for (point_target, bucket_start), bucket in self.rollup(segment).items():
+                    if point_target == target_id and start <= bucket_start < end:
+                        merge_bucket(buckets, (point_target, bucket_start - bucket_start % step), bucket)
+                raw_from = max(raw_from, segment + SEGMENT_SPAN)
+            points = self.points_between(raw_from, end) if raw_from < end else []
+        else:
+            points = self.points_between(start, end)
+
+        for key, bucket in aggregate((point for point in points if point[5] == target_id), step).items():
+            merge_bucket(buckets, key, bucket)
+
+        return {
+            'from': start,
+            'to': end,
+            'step': step,
+            'points': [self.format_bucket(bucket_start, bucket) for (_, bucket_start), bucket in sorted(buckets.items())]
+        }
+
+    def format_bucket(self, bucket_start, bucket):
+        checks, protected, alerts, errors, inconclusive, latency_sum, latency_count, latency_max, _, last_ip, last_range = bucket
+        return {
+            'timestamp': bucket_start,
+            'checks': checks,
+            'protected': protected,
+            'alerts': alerts,
+            'errors': errors,
+            'inconclusive': inconclusive,
+            'latency_avg_ms': round(latency_sum / latency_count, 1) if latency_count else None,
+            'latency_max_ms': round(latency_max, 1) if latency_count else None,
+            'ip': last_ip,
+            'protected_range': self.strings[last_range] if last_range else None
+        }
+
+class TimestampView:
+    """Read-only sequence of record timestamps in a segment buffer"""
+
+    def __init__(self, data, start, end):
+        self.data = data
+        self.start = start
+        self.count = (end - start) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return struct.unpack_from('<d', self.data, self.start + i * RECORD.size)[0]
+
+def aggregate(points, step):
+    """Group raw points into {(target id, bucket start): bucket} with mergeable bucket lists"""
+    buckets = {}
+    for timestamp, outcome, ip, range_id, _, target_id, latency in points:
+        key = (target_id, int(timestamp - timestamp % step))
+        bucket = buckets.get(key)
+        if bucket is None:
+            # checks, one count per outcome, latency sum, latency count, latency max, last timestamp, last IP, last range id
+            bucket = buckets[key] = [0, 0, 0, 0, 0, 0.0, 0, 0.0, 0.0, None, 0]
+        bucket[0] += 1
+        bucket[1 + outcome] += 1
+        if latency is not None:
+            bucket[5] += latency
+            bucket[6] += 1
+            bucket[7] = max(bucket[7], latency)
+        if timestamp >= bucket[8]:
+            bucket[8] = timestamp
+            if ip:
+                bucket[9], bucket[10] = ip, range_id
+    return buckets
+
+def merge_bucket(buckets, key, other):
+    """Fold a bucket list into buckets[key]"""
+    bucket = buckets.get(key)
+    if bucket is None:
+        buckets[key] = list(other)
+        return
+    for i in range(7):
+        bucket[i] += other[i]
+    bucket[7] = max(bucket[7], other[7])
+    if other[8] >= bucket[8]:
+        bucket[8] = other[8]
+        if other[9]:
+            bucket[9], bucket[10] = other[9], other[10]
@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+
+from filelock import FileLock
+
+# Matches the RotatingFileHandler in IPMonitor.setup_logging
+LOG_BACKUP_COUNT = 5
+
+# Bytes read per seek when walking a file backwards
+BLOCK_SIZE = 64 * 1024
+
+def rotation_chain(log_file, backup_count=LOG_BACKUP_COUNT):
+    """The live log file followed by its rotated backups, newest first"""
+    return [log_file] + [f"{log_file}.{i}" for i in range(1, backup_count + 1)]
+
+def reverse_lines(f, block_size=BLOCK_SIZE):
+    """Yield the lines of a binary file object from last to first, reading fixed-size blocks from the end"""
+    position = f.seek(0, os.SEEK_END)
+    remainder = b''
+
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        f.seek(position)
+        block = f.read(read_size) + remainder
+
+        lines = block.split(b'\n')
+        # The first piece may be the tail of a line that starts in an earlier block
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+
+    yield remainder
+
+def iter_recent_lines(log_file, backup_count=LOG_BACKUP_COUNT, block_size=BLOCK_SIZE):
+    """Yield non-empty log lines newest first, continuing into rotated backups.
+
+    A file is skipped when it is the same inode as one already read, so a
+    rotation that happens mid-read does not yield the same lines twice.
+    """
+    seen = set()
+    for path in rotation_chain(log_file, backup_count):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            continue
+
+        with f:
+            st = os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+
+            for line in reverse_lines(f, block_size):
+                line = line.strip()
+                if line:
+                    yield line.decode('utf-8', errors='replace')
+
+def read_recent_lines(log_file, count, backup_count=LOG_BACKUP_COUNT):
+    """Last count non-empty log lines in file order, spanning rotations when needed"""
+    lines = []
+    if count <= 0:
+        return lines
+
+    for line in iter_recent_lines(log_file, backup_count):
+        lines.append(line)
+        if len(lines) >= count:
+            break
+
+    lines.reverse()
+    return lines
+
+# Lines per postings chunk; token postings point at chunks, not single lines
+CHUNK_LINES = 64
+
+# How often the background indexer picks up appended lines
+INDEX_INTERVAL = 2
+
+# How often the indexing process rewrites the snapshots of files that grew,
+# and how often a process that isn't indexing tries to take over
+SNAPSHOT_INTERVAL = 30
+STANDBY_INTERVAL = 10
+
+# Shared index snapshot layout: header, the first bytes of the log file (to
+# tell a reused inode apart), line offsets (uint32), one level code byte per
+# line, newline-separated level names, postings lengths (uint32), postings
+# (uint32 chunk numbers) and newline-separated tokens
+SNAPSHOT_MAGIC = b'IPLIDX01'
+BYTE_ORDER_MARK = 0x01020304
+SNAPSHOT_HEADER = struct.Struct('<8sIQIIIIII')
+HEAD_BYTES = 64
+
+LEVEL_PATTERN = re.compile(rb'^\[[^\]]*\] ([A-Z]+):')
+TOKEN_PATTERN = re.compile(r'[a-z0-9][a-z0-9._:/-]*[a-z0-9]|[a-z0-9]')
+TOKEN_CHARS = frozenset('abcdefghijklmnopqrstuvwxyz0123456789._:/-')
+
+def code_for_level(level_codes, level):
+    """Code of level in level_codes, added if new; 0 without a level or once 255 codes are taken"""
+    if level is not None and level not in level_codes and len(level_codes) < 255:
+        level_codes[level] = len(level_codes) + 1
+    return level_codes.get(level, 0)
+
+def indexable(token):
+    """Tokens worth a postings list; bare numbers and times would only bloat the vocabulary"""
+    return any(c.isalpha() or c in './' for c in token)
+
+def tokenize(text):
+    """Lower-cased index tokens in text"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def query_tokens(search):
+    """(token, whole) for the indexable tokens of a lower-cased search.
+
+    A token with a non-token character on both sides is a whole token in any
+    matching line, so it is looked up exactly; one at either end of the
+    search may be part of a longer token.
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(search):
+        if not indexable(match.group()):
+            continue
+        start, end = match.span()
+        whole = start > 0 and search[start - 1] not in TOKEN_CHARS and end < len(search) and search[end] not in TOKEN_CHARS
+        tokens.append((match.group(), whole))
+    return tokens
+
+class IndexedFile:
+    """Postings for one log file, identified by inode so it survives being rotated"""
+
+    def __init__(self, key):
+        self.key = key
+        self.scanned = 0
+        self.head = b''
+        self.offsets = array('I')
+        self.levels = bytearray()
+        self.postings = {}
+        # Trigram -> indexed tokens containing it, to find tokens by substring without a vocabulary scan
+        self.trigrams = {}
+
+    def add_line(self, offset, line, level_codes):
+        line_number = len(self.offsets)
+        chunk = line_number // CHUNK_LINES
+        self.offsets.append(offset)
+
+        match = LEVEL_PATTERN.match(line)
+        self.levels.append(code_for_level(level_codes, match.group(1).decode('ascii') if match else None))
+
+        for token in set(tokenize(line.decode('utf-8', errors='replace'))):
+            if not indexable(token):
+                continue
+            postings = self.postings.get(token)
+            if postings is None:
+                self.postings[token] = array('I', [chunk])
+                self.add_trigrams(token)
+            elif postings[-1] != chunk:
+                postings.append(chunk)
+
+    def add_trigrams(self, token):
+        for i in range(len(token) - 2):
+            self.trigrams.setdefault(token[i:i + 3], set()).add(token)
+
+    def tokens_containing(self, text):
+        """Indexed tokens that contain text"""
+        if len(text) < 3:
+            # Too short for a trigram: scan the vocabulary
+            return [token for token in self.postings if text in token]
+        rarest = min((self.trigrams.get(text[i:i + 3], ()) for i in range(len(text) - 2)), key=len)
+        return [token for token in rarest if text in token]
+
+    def save(self, path, level_codes):
+        """Write this file's index to path in the snapshot format"""
+        names = sorted(level_codes, key=level_codes.get)
+        names_blob = '\n'.join(names).encode('utf-8')
+        tokens_blob = '\n'.join(self.postings).encode('utf-8')
+        lengths = array('I', (len(postings) for postings in self.postings.values()))
+
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, BYTE_ORDER_MARK, self.scanned, len(self.offsets), len(names_blob),
+            len(self.postings), sum(lengths), len(tokens_blob), len(self.head)
+        )
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(self.head)
+            f.write(self.offsets.tobytes())
+            f.write(self.levels)
+            f.write(names_blob)
+            f.write(lengths.tobytes())
+            for postings in self.postings.values():
+                f.write(postings.tobytes())
+            f.write(tokens_blob)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, key, head, level_codes):
+        """Index saved at path, with its level codes mapped to level_codes; None if missing,
+        unreadable, or saved from a file that doesn't start with head
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if len(data) < SNAPSHOT_HEADER.size:
+            return None
+        magic, bom, scanned, lines, names_len, token_count, postings_len, tokens_len, head_len = \
+            SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or bom != BYTE_ORDER_MARK:
+            return None
+
+        view = memoryview(data)
+        sections = {}
+        offset = SNAPSHOT_HEADER.size
+        for name, size in (('head', head_len), ('offsets', lines * 4), ('levels', lines), ('names', names_len),
+                           ('lengths', token_count * 4), ('postings', postings_len * 4), ('tokens', tokens_len)):
+            sections[name] = view[offset:offset + size]
+            offset += size
+        if offset != len(data) or bytes(sections['head']) != head[:head_len]:
+            return None
+
+        indexed = cls(key)
+        indexed.scanned = scanned
+        indexed.head = bytes(sections['head'])
+        indexed.offsets.frombytes(sections['offsets'])
+
+        # Level codes are per process; map the saved ones onto ours
+        table = bytearray(256)
+        names = bytes(sections['names']).decode('utf-8').split('\n') if names_len else []
+        for code, name in enumerate(names, 1):
+            table[code] = code_for_level(level_codes, name)
+        indexed.levels = bytearray(bytes(sections['levels']).translate(table))
+
+        postings, lengths = array('I'), array('I')
+        postings.frombytes(sections['postings'])
+        lengths.frombytes(sections['lengths'])
+        tokens = bytes(sections['tokens']).decode('utf-8').split('\n') if token_count else []
+        start = 0
+        for token, length in zip(tokens, lengths):
+            indexed.postings[token] = postings[start:start + length]
+            indexed.add_trigrams(token)
+            start += length
+        return indexed
+
+class LogIndex:
+    """Incremental level and token index over a log file and its rotated backups.
+
+    Each file is indexed once, keyed by inode, and only bytes appended since
+    the last scan are read afterwards, so rotation renames cost nothing.
+    Postings map tokens to chunks of CHUNK_LINES lines and every line keeps a
+    level code; queries narrow candidates with these and confirm matches
+    against the line text, so results equal a plain substring filter. Whole
+    query tokens are looked up directly and partial ones through a trigram
+    map of the vocabulary, so neither scans every token.
+
+    With a snapshot_dir, only one process (the holder of its lock) indexes
+    in the background and saves each file's index there; the others load
+    those snapshots when queried and index just the lines appended since.
+    """
+
+    def __init__(self, log_file, backup_count=LOG_BACKUP_COUNT, logger=None, snapshot_dir=None):
+        self.log_file = log_file
+        self.backup_count = backup_count
+        self.logger = logger or logging.getLogger(__name__)
+        self.snapshot_dir = snapshot_dir
+        # key -> scanned as of the last save, and the mtime of each snapshot last looked at
+        self.saved = {}
+        self.snapshot_mtimes = {}
+        self.last_save = 0.0
+        self.lock = threading.Lock()
+        self.level_codes = {}
+        # (dev, inode) -> IndexedFile, and the chain as (path, key), newest first
+        self.files = {}
+        self.chain = []
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def update(self):
+        """Index lines appended to any file in the rotation chain since the last call"""
+        with self.lock:
+            chain = []
+            for path in rotation_chain(self.log_file, self.backup_count):
+                try:
+                    with open(path, 'rb') as f:
+                        st = os.fstat(f.fileno())
+                        key = (st.st_dev, st.st_ino)
+                        if any(key == seen for _, seen in chain):
+                            continue
+
+                        indexed = self.files.get(key)
+                        if indexed is None or st.st_size < indexed.scanned:
+                            # New file, or truncated in place
+                            indexed = self.files[key] = IndexedFile(key)
+                        if st.st_size > indexed.scanned and self.snapshot_dir:
+                            indexed = self._adopt_snapshot(f, st, indexed)
+                        if st.st_size > indexed.scanned:
+                            self._scan(f, indexed)
+                        chain.append((path, key))
+                except FileNotFoundError:
+                    continue
+
+            live = {key for _, key in chain}
+            for key in list(self.files):
+                if key not in live:
+                    del self.files[key]
+            self.chain = chain
+
+    def snapshot_path(self, key):
+        return os.path.join(self.snapshot_dir, f"{key[0]}-{key[1]}.idx")
+
+    def _adopt_snapshot(self, f, st, indexed):
+        """The saved index of f if it covers more than indexed does, else indexed"""
+        path = self.snapshot_path(indexed.key)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return indexed
+        if self.snapshot_mtimes.get(indexed.key) == mtime:
+            return indexed
+        self.snapshot_mtimes[indexed.key] = mtime
+
+        f.seek(0)
+        loaded = IndexedFile.load(path, indexed.key, f.read(HEAD_BYTES), self.level_codes)
+        if loaded is None or loaded.scanned <= indexed.scanned or loaded.scanned > st.st_size:
+            return indexed
+        self.files[indexed.key] = loaded
+        return loaded
+
+    def save(self):
+        """Write the snapshots of files that grew since the last save and drop those of files gone"""
+        with self.lock:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            for _, key in self.chain:
+                indexed = self.files[key]
+                if self.saved.get(key) != indexed.scanned:
+                    indexed.save(self.snapshot_path(key), self.level_codes)
+                    self.saved[key] = indexed.scanned
+
+            live = {self.snapshot_path(key) for _, key in self.chain}
+            for entry in os.listdir(self.snapshot_dir):
+                path = os.path.join(self.snapshot_dir, entry)
+                if entry.endswith('.idx') and path not in live:
+                    os.remove(path)
+            self.last_save = time.monotonic()
+
+    def _scan(self, f, indexed):
+        """Index complete lines from indexed.scanned to the end of f"""
+        f.seek(indexed.scanned)
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                # Partial line still being written; pick it up next time
+                break
+            if indexed.scanned == 0:
+                indexed.head = data[:HEAD_BYTES]
+
+            offset = indexed.scanned
+            for line in data[:end].split(b'\n')[:-1]:
+                if line.strip():
+                    indexed.add_line(offset, line, self.level_codes)
+                offset += len(line) + 1
+
+            indexed.scanned += end
+            f.seek(indexed.scanned)
+
+    def candidate_chunks(self, indexed, tokens):
+        """Chunks that contain every (token, whole) of query_tokens (all chunks without tokens), newest first"""
+        chunk_count = (len(indexed.offsets) + CHUNK_LINES - 1) // CHUNK_LINES
+        if not tokens:
+            return range(chunk_count - 1, -1, -1)
+
+        # A partial token shorter than a trigram costs a vocabulary scan; skip it when others narrow the chunks
+        tokens = [(token, whole) for token, whole in tokens if whole or len(token) >= 3] or tokens
+
+        chunks = None
+        for token, whole in tokens:
+            found = set()
+            if whole:
+                found.update(indexed.postings.get(token, ()))
+            else:
+                for word in indexed.tokens_containing(token):
+                    found.update(indexed.postings[word])
+            chunks = found if chunks is None else chunks & found
+            if not chunks:
+                return []
+        return sorted(chunks, reverse=True)
+
+    def candidate_lines(self, indexed, buffer, tokens, needle, level_code):
+        """Line numbers that may match, newest first"""
+        count = len(indexed.offsets)
+
+        if not tokens and not needle:
+            if level_code is None:
+                yield from range(count - 1, -1, -1)
+                return
+            line_number = indexed.levels.rfind(level_code)
+            while line_number >= 0:
+                yield line_number
+                line_number = indexed.levels.rfind(level_code, 0, line_number)
+            return
+
+        for chunk in self.candidate_chunks(indexed, tokens):
+            first = chunk * CHUNK_LINES
+            last = min(count, first + CHUNK_LINES)
+            if needle is not None:
+                # One search over the whole chunk before looking at its lines
+                chunk_end = indexed.offsets[last] if last < count else indexed.scanned
+                if buffer[indexed.offsets[first]:chunk_end].lower().find(needle) < 0:
+                    continue
+            for line_number in range(last - 1, first - 1, -1):
+                if level_code is None or indexed.levels[line_number] == level_code:
+                    yield line_number
+
+    def query(self, search='', level='', limit=100):
+        """Newest limit lines matching search (substring, case-insensitive) and level, in file order"""
+        self.update()
+        search = search.lower()
+        tokens = query_tokens(search)
+        # bytes.lower() only folds ASCII, so the chunk pre-check is limited to ASCII searches
+        needle = search.encode('ascii') if search and search.isascii() else None
+        matches = []
+
+        with self.lock:
+            level_code = None
+            if level:
+                level_code = self.level_codes.get(level.upper())
+                if level_code is None:
+                    return matches
+
+            for path, key in self.chain:
+                indexed = self.files[key]
+                if not indexed.offsets:
+                    continue
+                try:
+                    with open(path, 'rb') as f:
+                        st = os.fstat(f.fileno())
+                        if (st.st_dev, st.st_ino) != key:
+                            # Rotated since update(); caught up on the next query
+                            continue
+                        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    continue
+
+                with buffer:
+                    for line_number in self.candidate_lines(indexed, buffer, tokens, needle, level_code):
+                        start = indexed.offsets[line_number]
+                        end = buffer.find(b'\n', start)
+                        line = buffer[start:end if end >= 0 else indexed.scanned].decode('utf-8', errors='replace').strip()
+                        if search and search not in line.lower():
+                            continue
+                        matches.append(line)
+                        if len(matches) >= limit:
+                            break
+
+                if len(matches) >= limit:
+                    break
+
+        matches.reverse()
+        return matches
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'files': len(self.chain),
+                'lines': sum(len(indexed.offsets) for indexed in self.files.values()),
+                'tokens': sum(len(indexed.postings) for indexed in self.files.values()),
+                'bytes_indexed': sum(indexed.scanned for indexed in self.files.values())
+            }
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='log-indexer', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def run(self):
+        if not self.snapshot_dir:
+            self.loop()
+            return
+
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        leader_lock = FileLock(os.path.join(self.snapshot_dir, '.lock'))
+        while not leader_lock.acquire(blocking=False):
+            if self.stop_event.wait(STANDBY_INTERVAL):
+                return
+        try:
+            self.loop()
+        finally:
+            leader_lock.release()
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.update()
+                if self.snapshot_dir and time.monotonic() - self.last_save >= SNAPSHOT_INTERVAL:
+                    self.save()
+            except Exception as e:
+                self.logger.error(f"Log indexer error: {e}")
+            self.stop_event.wait(INDEX_INTERVAL)
+
+class LogFollower:
+    """Lines appended to a log file since the last call, following it across rotation"""
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.key = None
+        self.offset = 0
+
+    def seek_end(self):
+        """Skip everything written so far"""
+        try:
+            st = os.stat(self.log_file)
+        except OSError:
+            self.key, self.offset = None, 0
+            return
+        self.key, self.offset = (st.st_dev, st.st_ino), st.st_size
+
+    def _read_from(self, path, key, offset):
+        """Complete lines in path from offset, and the offset after them; None if path is not that file"""
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if key is not None and (st.st_dev, st.st_ino) != key:
+                    return None
+                if st.st_size < offset:
+                    offset = 0
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        end = data.rfind(b'\n') + 1
+        lines = [line.decode('utf-8', errors='replace').strip() for line in data[:end].split(b'\n')]
+        return [line for line in lines if line], offset + end, (st.st_dev, st.st_ino)
+
+    def read_new(self):
+        lines = []
+        try:
+            st = os.stat(self.log_file)
+        except OSError:
+            return lines
+
+        if self.key is not None and (st.st_dev, st.st_ino) != self.key:
+            # Rotated: finish the old file, which is now the first backup
+            result = self._read_from(f"{self.log_file}.1", self.key, self.offset)
+            if result:
+                lines.extend(result[0])
+            self.key, self.offset = None, 0
+
+        result = self._read_from(self.log_file, self.key, self.offset)
+        if result:
+            lines.extend(result[0])
+            self.offset, self.key = result[1], result[2]
+        return lines
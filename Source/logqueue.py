@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, RotatingFileHandler
+
+from filelock import FileLock
+
+# A batch is written once it holds this many records or its oldest record is this many seconds old
+BATCH_RECORDS = 256
+FLUSH_INTERVAL = 0.5
+
+# Longest wait for the writer to catch up when flushing or closing
+CLOSE_TIMEOUT = 5
+
+# Tells the writer thread to write what it holds and exit
+_STOP = object()
+
+class BatchWriteMixin:
+    """Lets a stream handler write a batch of records with one write and one flush"""
+
+    def emit_batch(self, records):
+        lines = []
+        for record in records:
+            if record.levelno < self.level or not self.filter(record):
+                continue
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        if not lines:
+            return
+        self.acquire()
+        try:
+            self.write_batch(''.join(lines))
+        except Exception:
+            self.handleError(records[-1])
+        finally:
+            self.release()
+
+    def write_batch(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+class BatchStreamHandler(BatchWriteMixin, logging.StreamHandler):
+    pass
+
+class BatchRotatingFileHandler(BatchWriteMixin, RotatingFileHandler):
+    """Rotating file handler that checks for rollover once per batch instead of once per record.
+
+    Several processes (web workers, the scheduler, cron runs) write the same
+    log, so each batch is written under a lock file next to it: the process
+    that finds the file full rotates it once, and the others notice they are
+    holding the renamed file and reopen the new one instead of rotating again.
+    """
+
+    def __init__(self, filename, *args, **kwargs):
+        super().__init__(filename, *args, **kwargs)
+        self.write_lock = FileLock(f"{self.baseFilename}.lock")
+
+    def emit(self, record):
+        # Single records (e.g. logged after the queue closed) take the same path
+        self.emit_batch([record])
+
+    def write_batch(self, text):
+        with self.write_lock:
+            if self.stream is not None and self._rotated_away():
+                self.stream.close()
+                self.stream = None
+            if self.stream is None:
+                self.stream = self._open()
+            if self.maxBytes > 0:
+                size = os.fstat(self.stream.fileno()).st_size
+                if size and size + len(text) >= self.maxBytes:
+                    self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+            super().write_batch(text)
+
+    def _rotated_away(self):
+        """Whether the open stream is no longer the file at baseFilename"""
+        try:
+            st = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        current = os.fstat(self.stream.fileno())
+        return (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino)
+
+class QueueLogHandler(QueueHandler):
+    """Hands records to a background writer thread, so a logging call only appends to a queue.
+
+    The writer formats and writes records for handlers in batches: a batch
+    goes out when it holds BATCH_RECORDS records or its oldest record is
+    FLUSH_INTERVAL seconds old. Handlers with emit_batch() get the whole batch
+    at once; others get the records one by one. flush() waits until everything
+    logged so far is written, and close() (also run at exit) writes what is
+    still queued before stopping. Records logged after close() are written
+    directly by the caller.
+    """
+
+    def __init__(self, handlers, batch_records=BATCH_RECORDS, flush_interval=FLUSH_INTERVAL):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = list(handlers)
+        self.batch_records = batch_records
+        self.flush_interval = flush_interval
+        self.start_lock = threading.Lock()
+        self.writer = None
+        self.pid = None
+        self._start()
+        atexit.register(self.close)
+
+    def _start(self):
+        """Start the writer (again after a fork, which only copies the calling thread)"""
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            # Records queued before a fork belong to the parent's writer
+            self.queue = queue.SimpleQueue()
+            self.writer = threading.Thread(target=self._run, args=(self.queue,), name='log-writer', daemon=True)
+            self.writer.start()
+
+    def prepare(self, record):
+        # Records stay in this process, so unlike QueueHandler.prepare this only
+        # merges the message arguments (they could change before the writer gets
+        # to them) and leaves formatting to the writer thread
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self._start()
+        if self.writer is None:
+            self.write([record])
+        else:
+            self.queue.put(record)
+
+    def _run(self, records):
+        batch, deadline = [], None
+        while True:
+            try:
+                item = records.get(timeout=max(0.0, deadline - time.monotonic()) if batch else None)
+            except queue.Empty:
+                item = None
+            if isinstance(item, logging.LogRecord):
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                if len(batch) < self.batch_records:
+                    continue
+            self.write(batch)
+            batch = []
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def write(self, records):
+        if not records:
+            return
+        for handler in self.handlers:
+            if hasattr(handler, 'emit_batch'):
+                handler.emit_batch(records)
+            else:
+                for record in records:
+                    handler.handle(record)
+
+    def flush(self, timeout=CLOSE_TIMEOUT):
+        """Wait until every record logged so far has been written"""
+        writer = self.writer
+        if writer is None or writer is threading.current_thread() or self.pid != os.getpid():
+            return
+        written = threading.Event()
+        self.queue.put(written)
+        written.wait(timeout)
+
+    def close(self):
+        """Write what is still queued, then stop the writer and close the handlers"""
+        atexit.unregister(self.close)
+        with self.start_lock:
+            writer, self.writer = self.writer, None
+        if writer is not None and self.pid == os.getpid():
+            self.queue.put(_STOP)
+            writer.join(CLOSE_TIMEOUT)
+            # Records that were queued while the writer was stopping
+            leftover = []
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, logging.LogRecord):
+                    leftover.append(item)
+                elif isinstance(item, threading.Event):
+                    item.set()
+            self.write(leftover)
+        for handler in self.handlers:
+            handler.close()
+        super().close()
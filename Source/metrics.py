@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+from config import data_path
+from filelock import FileLock
+
+# Upper bounds (seconds) shared by every histogram, so snapshots merge bucket by bucket
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# How often a process writes its snapshot while it keeps recording
+FLUSH_INTERVAL = 5
+
+# How often a writing process also folds the snapshots of processes that died without retiring
+SWEEP_INTERVAL = 60
+
+# name -> (type, help)
+METRICS = {
+    'ipmonitor_check_duration_seconds': ('histogram', 'Duration of a complete IP check, by egress target and outcome'),
+    'ipmonitor_provider_lookup_seconds': ('histogram', 'Latency of a single IP service query, by provider and result'),
+    'ipmonitor_webhook_delivery_seconds': ('histogram', 'Duration of a webhook request, by HTTP status code'),
+    'ipmonitor_status_cache_requests_total': ('counter', 'Status lookups answered from the observation cache (hit) or by a fresh lookup (miss)'),
+    'ipmonitor_log_bytes_written_total': ('counter', 'Bytes written to the monitor log file'),
+}
+
+class MetricsRegistry:
+    """Counters and fixed-bucket histograms for one process, shared with the others through files.
+
+    Recording only touches in-memory dicts under a lock held for a few
+    dictionary operations. Every process writes its values to its own
+    snapshot file in directory (at most every FLUSH_INTERVAL seconds);
+    collect() merges the snapshots of all processes. At exit a process folds
+    its values into a retired total and removes its snapshot, so counters
+    never go backwards when a cron run ends or a web worker is recycled.
+    Snapshots of processes killed before they could do that are folded by
+    the next process that writes its own (at most every SWEEP_INTERVAL
+    seconds) or collects, so they don't pile up without a /metrics scraper.
+    """
+
+    def __init__(self, directory=None, logger=None):
+        self.directory = directory or data_path('metrics')
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.role = 'main'
+        self.pid = None
+        self.flusher = None
+        self.dirty = False
+        self.last_sweep = 0.0
+        self._reset()
+
+    def _reset(self):
+        """Start empty values for this process (also after a fork)"""
+        self.pid = os.getpid()
+        self.token = os.urandom(4).hex()
+        self.counters = {}
+        self.histograms = {}
+
+    def set_role(self, role):
+        """Name shown in the process label of this process's RSS and CPU"""
+        self.role = role
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.dirty = True
+        self._ensure_flusher()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bucket_index(seconds)
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Per-bucket (not cumulative) counts, then the sum
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            histogram[bucket] += 1
+            histogram[-1] += seconds
+            self.dirty = True
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self.flusher is not None and self.flusher.is_alive():
+            return
+        with self.lock:
+            if self.flusher is not None and self.flusher.is_alive():
+                return
+            self.flusher = threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True)
+            self.flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush_if_dirty()
+
+    def flush_if_dirty(self):
+        """Write the snapshot only if something was recorded since the last write"""
+        if self.dirty:
+            self.flush()
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, f"{self.pid}-{self.token}.json")
+
+    def snapshot(self, reset=False):
+        """This process's values in the snapshot file format; with reset, start counting from zero again"""
+        with self.lock:
+            self.dirty = False
+            counters = [[name, dict(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, dict(labels), list(values)] for (name, labels), values in self.histograms.items()]
+            if reset:
+                self.counters, self.histograms = {}, {}
+        return {
+            'pid': self.pid,
+            'role': self.role,
+            'updated': time.time(),
+            'process': process_usage(),
+            'counters': counters,
+            'histograms': histograms
+        }
+
+    def flush(self, sweep=True):
+        """Write this process's snapshot, and now and then fold those of dead processes; never raises"""
+        if self.pid != os.getpid():
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_json_atomic(self.snapshot_path, self.snapshot())
+            if sweep and time.monotonic() - self.last_sweep >= SWEEP_INTERVAL:
+                self.sweep()
+        except Exception as e:
+            self.logger.warning(f"Could not write metrics snapshot: {e}")
+
+    def sweep(self):
+        """Fold the snapshots of exited processes into retired.json; returns (retired, live snapshots)"""
+        self.last_sweep = time.monotonic()
+        live = []
+        with FileLock(os.path.join(self.directory, '.lock')):
+            retired_path = os.path.join(self.directory, 'retired.json')
+            retired = read_json(retired_path) or {'counters': [], 'histograms': []}
+            retired_changed = False
+
+            for entry in sorted(os.listdir(self.directory)):
+                if not entry.endswith('.json') or entry == 'retired.json':
+                    continue
+                path = os.path.join(self.directory, entry)
+                snapshot = read_json(path)
+                if snapshot is None:
+                    continue
+                if pid_alive(snapshot['pid']):
+                    live.append(snapshot)
+                else:
+                    # Keep what an exited process counted, then forget the process
+                    retired = fold(retired, snapshot)
+                    retired_changed = True
+                    os.remove(path)
+
+            if retired_changed:
+                write_json_atomic(retired_path, retired)
+        return retired, live
+
+    def retire(self):
+        """Fold this process's values into retired.json and remove its snapshot; runs at exit, never raises"""
+        if self.pid != os.getpid():
+            return
+        with self.lock:
+            if not self.counters and not self.histograms and not os.path.exists(self.snapshot_path):
+                return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with FileLock(os.path.join(self.directory, '.lock')):
+                retired_path = os.path.join(self.directory, 'retired.json')
+                retired = read_json(retired_path) or {'counters': [], 'histograms': []}
+                # Anything recorded after this (e.g. while shutting down) goes to a new snapshot
+                write_json_atomic(retired_path, fold(retired, self.snapshot(reset=True)))
+                try:
+                    os.remove(self.snapshot_path)
+                except FileNotFoundError:
+                    pass
+        except Exception as e:
+            self.logger.warning(f"Could not retire metrics snapshot: {e}")
+
+    def collect(self):
+        """Merged values of all processes: (counters, histograms, live process usage)"""
+        self.flush(sweep=False)
+        counters, histograms, processes = {}, {}, []
+
+        retired, live = self.sweep()
+        for snapshot in live:
+            merge_snapshot(counters, histograms, snapshot)
+            processes.append((snapshot['role'], snapshot['pid'], snapshot['process']))
+        merge_snapshot(counters, histograms, retired)
+
+        return counters, histograms, processes
+
+    def render(self, extra=None):
+        """Prometheus text exposition of the merged metrics, plus extra (name, type, help, value) gauges"""
+        counters, histograms, processes = self.collect()
+        lines = []
+
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                continue
+
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), values):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else format_value(bound)
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(values[-1])}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        for name, key, kind, help_text in (
+            ('process_resident_memory_bytes', 'rss_bytes', 'gauge', 'Resident memory of each monitor process'),
+            ('process_cpu_seconds_total', 'cpu_seconds', 'counter', 'CPU time used by each monitor process')
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for role, pid, usage in processes:
+                if usage.get(key) is not None:
+                    lines.append(f"{name}{format_labels((('pid', str(pid)), ('process', role)))} {format_value(usage[key])}")
+
+        for name, kind, help_text, value in extra or []:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+def bucket_index(seconds):
+    """Index of the first bucket whose upper bound is at least seconds (len(BUCKETS) for +Inf)"""
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(BUCKETS)
+
+def merge_snapshot(counters, histograms, snapshot):
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in snapshot['histograms']:
+        key = (name, tuple(sorted(labels.items())))
+        merged = histograms.get(key)
+        histograms[key] = list(values) if merged is None else [a + b for a, b in zip(merged, values)]
+
+def fold(retired, snapshot):
+    """retired plus the counters and histograms of snapshot, in snapshot format"""
+    counters, histograms = {}, {}
+    merge_snapshot(counters, histograms, retired)
+    merge_snapshot(counters, histograms, snapshot)
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), values] for (name, labels), values in histograms.items()]
+    }
+
+def process_usage():
+    """Current RSS (from /proc where available) and CPU seconds of this process"""
+    rss = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    times = os.times()
+    return {'rss_bytes': rss, 'cpu_seconds': round(times.user + times.system, 3)}
+
+def pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+# Process-wide registry used by the monitor, the scheduler and the web app
+registry = MetricsRegistry()
+atexit.register(registry.retire)
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+def observe(name, seconds, **labels):
+    registry.observe(name, seconds, **labels)
@@ -1,24 +1,255 @@
 #!/usr/bin/env python3
 
-import requests
 import ipaddress
 import logging
 import json
 import os
+import queue
+import threading
 import time
 from datetime import datetime, timedelta
-from config import Config
+import metrics
+from config import Config, data_path, log_path
+from history import HistoryStore
+from logqueue import BatchRotatingFileHandler, BatchStreamHandler, QueueLogHandler
+from filelock import FileLock
+from outbox import OutboxWorker, WebhookOutbox
+from state import StateStore
+from providers import ProviderHealth
+from ranges import RangeIndex, load_range_index, range_fingerprint
+
+# Built-in public IP echo services, used unless IP_PROVIDERS is configured
+IP_SERVICES = [
+    'https://ipinfo.io/ip',
+    'https://api.ipify.org',
+    'https://ip.seeip.org',
+    'https://ifconfig.me/ip',
+    'https://checkip.amazonaws.com'
+]
+
+# Read timeout for webhook calls in seconds
+WEBHOOK_TIMEOUT = 30
+
+# Number of distinct hosts whose connection pools are kept alive per session
+POOL_HOSTS = 16
+
+# Most bytes read from an IP service on the standard library path
+MAX_IP_RESPONSE = 1024
+
+# Local address that pins a connection to one address family
+FAMILY_WILDCARDS = {4: '0.0.0.0', 6: '::'}
+
+# Shown instead of an IP for checks that could not decide
+CHECK_ERRORS = {
+    'error': "Could not retrieve current IP",
+    'inconclusive': "IP services disagree on the current IP"
+}
+
+def build_session(config, adapter_class=None, **adapter_kwargs):
+    """Create a keep-alive session with a per-host connection pool sized by HTTP_POOL_SIZE"""
+    # requests (with urllib3, charset detection and certifi) is the bulk of
+    # import time, so it is only loaded once a session is actually needed
+    import requests
+    from requests.adapters import HTTPAdapter
+    
+    session = requests.Session()
+    adapter = (adapter_class or HTTPAdapter)(pool_connections=POOL_HOSTS, pool_maxsize=config.HTTP_POOL_SIZE, **adapter_kwargs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def build_pinned_opener(family):
+    """urllib opener whose connections only use addresses of one family (4 or 6)"""
+    import functools
+    import http.client
+    import urllib.request
+    
+    source_address = (FAMILY_WILDCARDS[family], 0)
+    
+    class PinnedHTTPHandler(urllib.request.HTTPHandler):
+        def http_open(self, req):
+            return self.do_open(functools.partial(http.client.HTTPConnection, source_address=source_address), req)
+    
+    class PinnedHTTPSHandler(urllib.request.HTTPSHandler):
+        def https_open(self, req):
+            return self.do_open(functools.partial(http.client.HTTPSConnection, source_address=source_address), req,
+                                context=self._context)
+    
+    return urllib.request.build_opener(PinnedHTTPHandler, PinnedHTTPSHandler)
+
+def get_pool_stats(session):
+    """Count requests and newly opened connections across all connection pools of a session"""
+    stats = {'requests': 0, 'connections': 0}
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        
+        managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+        for manager in managers:
+            if manager is None:
+                continue
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+                if pool is not None:
+                    stats['requests'] += pool.num_requests
+                    stats['connections'] += pool.num_connections
+    return stats
+
+class ObservationCache:
+    """Caches the latest public IP observation and shares in-flight lookups between callers.
+    
+    With a path, the observation is also shared between processes (web
+    workers and the check process): a stale cache first looks at the file,
+    and only the process holding the file lock looks the IP up while the
+    others wait for its result.
+    
+    Observations are stored with the key (the protected range key) they were
+    evaluated under; one stored under another key counts as stale, so once
+    any process swaps in new ranges no process serves the old verdict.
+    """
+    
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._observation = None
+        self._observed_at = 0.0
+        self._key = None
+        self._flight = None
+        self.path = path
+        self.file_lock = FileLock(f"{path}.lock") if path else None
+    
+    def put(self, observation, age=0.0, share=True, key=None):
+        """Store a fresh observation (or one already age seconds old) evaluated under key"""
+        with self._lock:
+            self._observation = observation
+            self._observed_at = time.monotonic() - age
+            self._key = key
+        
+        if self.path and share:
+            try:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump({'observed_at': time.time() - age, 'key': key, 'observation': observation}, f, default=str)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                pass
+    
+    def load_shared(self, ttl, key=None):
+        """Adopt the shared observation if it is younger than ttl and has key; returns (observation, age) or None"""
+        try:
+            with open(self.path, 'r') as f:
+                shared = json.load(f)
+            age = max(0.0, time.time() - shared['observed_at'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        
+        if age >= ttl or shared.get('key') != key or not shared['observation'].get('ip'):
+            return None
+        self.put(shared['observation'], age, share=False, key=key)
+        return shared['observation'], age
+    
+    def get(self, fetch, ttl, key=None):
+        """Return (observation, age_seconds), calling fetch only when the cached one is older than ttl or has another key"""
+        with self._lock:
+            age = time.monotonic() - self._observed_at
+            if self._observation is not None and age < ttl and self._key == key:
+                metrics.inc('ipmonitor_status_cache_requests_total', result='hit')
+                return self._observation, age
+            
+            # Join the lookup that is already running, or become the one that runs it
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = {'done': threading.Event(), 'result': None, 'error': None, 'age': 0.0}
+        
+        if not leader:
+            # Waiting on another caller's lookup still saves one
+            metrics.inc('ipmonitor_status_cache_requests_total', result='hit')
+            flight['done'].wait()
+            if flight['error'] is not None:
+                # The lookup we waited for failed; fail the same way instead of returning nothing
+                raise flight['error']
+            return flight['result'], flight['age']
+        
+        observation = None
+        fetched = False
+        try:
+            if self.path:
+                shared = self.load_shared(ttl, key)
+                if shared is None:
+                    with self.file_lock:
+                        # Another process may have looked it up while we waited for the lock
+                        shared = self.load_shared(ttl, key)
+                        if shared is None:
+                            observation, fetched = fetch(), True
+                            if observation.get('ip'):
+                                self.put(observation, key=key)
+                if shared is not None:
+                    observation, flight['age'] = shared
+            else:
+                observation, fetched = fetch(), True
+                if observation.get('ip'):
+                    self.put(observation, key=key)
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            flight['result'] = observation
+            with self._lock:
+                self._flight = None
+            flight['done'].set()
+        
+        metrics.inc('ipmonitor_status_cache_requests_total', result='miss' if fetched else 'hit')
+        return observation, flight['age']
+
+class CountingFileHandler(BatchRotatingFileHandler):
+    """Rotating log file handler that counts the bytes it writes for /metrics"""
+    
+    def format(self, record):
+        message = super().format(record)
+        metrics.inc('ipmonitor_log_bytes_written_total', len(message.encode('utf-8', 'replace')) + len(self.terminator))
+        return message
 
 class IPMonitor:
-    def __init__(self):
+    def __init__(self, fast_start=False):
         self.config = Config()
-        self.log_file = '/var/log/ip-monitor.log'
-        self.state_file = '/app/data/monitor_state.json'
+        # One-shot runs look up the default egress IP with the standard library
+        # instead of building a requests session for a single GET
+        self.fast_start = fast_start
+        self.log_file = log_path('ip-monitor.log')
+        self.state_file = data_path('monitor_state.json')
+        self.range_index_file = data_path('protected_ranges.idx')
+        self.outbox_file = data_path('outbox.jsonl')
+        self.history_dir = data_path('history')
+        self.observation_file = data_path('observation.json')
+        self.check_lock_file = data_path('check.lock')
+        self.outbox_worker = None
+        self.last_lookup = None
+        self._session = None
+        self._session_key = None
+        # family -> (pool size, session)
+        self._family_sessions = {}
+        self.session_lock = threading.Lock()
+        self._closed_pool_stats = {'requests': 0, 'connections': 0}
+        self.observations = ObservationCache(self.observation_file)
+        self.providers = ProviderHealth(self)
+        self.state_lock = threading.RLock()
+        self.config_lock = threading.Lock()
+        # (key, index) swapped as one tuple so readers never see a mismatched pair
+        self._ranges = (None, None)
         self.setup_logging()
+        self.outbox = WebhookOutbox(self.outbox_file, self.logger)
+        self.history = HistoryStore(self.history_dir, self.logger)
         self.load_state()
     
-    def setup_logging(self):
-        """Setup logging to both file and console"""
+    def setup_logging(self, console=True):
+        """Setup logging to both file and console, written by a background thread.
+        
+        Logging calls only queue the record; a QueueLogHandler formats and writes
+        records in batches, so checks and web requests don't wait for the file
+        (or its rotation check) and the console.
+        """
         # Ensure log directory exists
         os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
         
@@ -26,8 +257,11 @@ class IPMonitor:
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
         
-        # Clear any existing handlers
-        self.logger.handlers.clear()
+        # Remove existing handlers, writing out what they still hold
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        handlers = []
         
         # Create formatter
         formatter = logging.Formatter(
@@ -37,15 +271,14 @@ class IPMonitor:
         
         # File handler with rotation
         try:
-            from logging.handlers import RotatingFileHandler
-            file_handler = RotatingFileHandler(
+            file_handler = CountingFileHandler(
                 self.log_file, 
                 maxBytes=10*1024*1024,  # 10MB
                 backupCount=5
             )
             file_handler.setLevel(logging.INFO)
             file_handler.setFormatter(formatter)
-            self.logger.addHandler(file_handler)
+            handlers.append(file_handler)
         except Exception as e:
             print(f"Warning: Could not create rotating file handler: {e}")
             # Fallback to regular file handler
@@ -53,15 +286,19 @@ class IPMonitor:
                 file_handler = logging.FileHandler(self.log_file, mode='a')
                 file_handler.setLevel(logging.INFO)
                 file_handler.setFormatter(formatter)
-                self.logger.addHandler(file_handler)
+                handlers.append(file_handler)
             except Exception as e2:
                 print(f"Warning: Could not create file handler: {e2}")
         
         # Console handler (for docker logs)
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.INFO)
-        console_handler.setFormatter(formatter)
-        self.logger.addHandler(console_handler)
+        if console:
+            console_handler = BatchStreamHandler()
+            console_handler.setLevel(logging.INFO)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+        
+        self.log_handler = QueueLogHandler(handlers)
+        self.logger.addHandler(self.log_handler)
         
         # Prevent propagation to root logger
         self.logger.propagate = False
@@ -71,80 +308,550 @@ class IPMonitor:
         self.logger.info(f"Log file: {self.log_file}")
     
     def load_state(self):
-        """Load monitor state from file"""
-        self.state = {
+        """Load monitor state from the snapshot and journal"""
+        defaults = {
             'last_alert_time': None,
             'consecutive_alerts': 0,
             'last_known_ip': None,
+            'last_known_ips': {},
             'total_checks': 0,
-            'alerts_sent': 0
+            'alerts_sent': 0,
+            'targets': {}
         }
         
-        if os.path.exists(self.state_file):
-            try:
-                with open(self.state_file, 'r') as f:
-                    self.state.update(json.load(f))
-                self.logger.info("Loaded monitor state")
-            except Exception as e:
-                self.logger.warning(f"Could not load state file: {e}")
+        self.state_store = StateStore(self.state_file, defaults, self.state_lock, self.logger)
+        try:
+            self.state_store.load()
+            self.logger.info("Loaded monitor state")
+        except Exception as e:
+            self.logger.warning(f"Could not load state file: {e}")
+        
+        self.state = self.state_store.state
+    
+    def refresh_state(self):
+        """Apply state changes other processes have journaled since we last read or wrote"""
+        try:
+            return self.state_store.refresh()
+        except Exception as e:
+            self.logger.warning(f"Could not refresh state: {e}")
+            return False
+    
+    def try_check_lock(self):
+        """Take the lock that keeps checks of all processes from overlapping; None if a check is running
+        
+        The scheduler, /api/test and cron one-shot runs all hold it for a whole
+        check, so the same alert is never raised twice by checks running at once.
+        """
+        os.makedirs(os.path.dirname(self.check_lock_file), exist_ok=True)
+        lock = FileLock(self.check_lock_file)
+        return lock if lock.acquire(blocking=False) else None
     
     def save_state(self):
-        """Save monitor state to file"""
+        """Journal state changes made since the last save"""
         try:
-            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
-            with open(self.state_file, 'w') as f:
-                json.dump(self.state, f, indent=2, default=str)
+            self.state_store.flush()
         except Exception as e:
             self.logger.error(f"Could not save state: {e}")
     
+    def get_state_version(self):
+        """Opaque value that changes whenever any process saves state"""
+        return self.state_store.version()
+    
+    def increment_state(self, key, by=1, target=None):
+        """Add to a counter of the global or a target state; merged with other processes' increments"""
+        self.state_store.increment([key] if target is None else ['targets', target, key], by)
+    
+    def set_state(self, key, value, target=None):
+        """Set a field of the global or a target state"""
+        self.state_store.set([key] if target is None else ['targets', target, key], value)
+    
+    def get_target_state(self, name):
+        """Get (creating if needed) the state of a named egress target"""
+        defaults = {
+            'last_alert_time': None,
+            'consecutive_alerts': 0,
+            'last_known_ip': None,
+            'last_known_ips': {},
+            'total_checks': 0,
+            'alerts_sent': 0
+        }
+        with self.state_lock:
+            target_state = self.state.setdefault('targets', {}).setdefault(name, {})
+            for key, value in defaults.items():
+                target_state.setdefault(key, value)
+            return target_state
+    
+    def track_ip_change(self, ips, target=None):
+        """Log egress IP changes and remember the current IPs; ips[0] becomes last_known_ip.
+        
+        Changes are compared per address family, so a dual-stack host whose
+        deciding family alternates between checks does not log a change each time.
+        """
+        state = self.state if target is None else self.get_target_state(target)
+        path = [] if target is None else ['targets', target]
+        known = dict(state.get('last_known_ips') or {})
+        if not known and state.get('last_known_ip'):
+            # State saved before IPs were tracked per family
+            known[f"ipv{ipaddress.ip_address(state['last_known_ip']).version}"] = state['last_known_ip']
+        
+        prefix = f"[{target}] " if target else ""
+        for ip in ips:
+            family = f"ipv{ipaddress.ip_address(ip).version}"
+            if known.get(family) and known[family] != ip:
+                self.logger.info(f"{prefix}IP changed from {known[family]} to {ip}")
+            self.state_store.set(path + ['last_known_ips', family], ip)
+        self.set_state('last_known_ip', ips[0], target)
+    
+    def get_session(self, family=None):
+        """Get the shared keep-alive HTTP session, rebuilding it only when the pool settings change.
+        
+        A family (4 or 6) gets its own session whose connections only use that address family.
+        """
+        if family is not None:
+            return self.get_family_session(family)
+        config = self.config
+        key = config.HTTP_POOL_SIZE
+        session = self._session
+        if session is not None and self._session_key == key:
+            return session
+        
+        # Lookup threads (race and consensus mode) may get here at once; build one session for all
+        with self.session_lock:
+            if self._session is None or self._session_key != key:
+                if self._session is not None:
+                    self._close(self._session)
+                self._session_key = None
+                self._session = build_session(config)
+                self._session_key = key
+            return self._session
+    
+    def get_family_session(self, family):
+        with self.session_lock:
+            key = self.config.HTTP_POOL_SIZE
+            cached = self._family_sessions.get(family)
+            if cached and cached[0] == key:
+                return cached[1]
+            if cached:
+                self._close(cached[1])
+            
+            from engine import SourceAddressAdapter
+            # Binding to the family's wildcard address makes sockets of the other family fail
+            # to bind, so connections fall through to the addresses of this family
+            session = build_session(self.config, SourceAddressAdapter, source_address=FAMILY_WILDCARDS[family])
+            self._family_sessions[family] = (key, session)
+            return session
+    
+    def close_session(self):
+        """Close the shared HTTP sessions, keeping their counters for the stats"""
+        with self.session_lock:
+            if self._session is not None:
+                self._close(self._session)
+                self._session = None
+            for _, session in self._family_sessions.values():
+                self._close(session)
+            self._family_sessions = {}
+    
+    def _close(self, session):
+        for name, value in get_pool_stats(session).items():
+            self._closed_pool_stats[name] += value
+        session.close()
+    
+    def get_http_timeout(self, read_timeout=None):
+        """Get (connect, read) timeouts for outgoing requests"""
+        return (self.config.HTTP_CONNECT_TIMEOUT, read_timeout or self.config.HTTP_READ_TIMEOUT)
+    
+    def get_lookup_timeout(self, deadline=None):
+        """(connect, read) timeouts for one IP service query, cut short to end by deadline (a time.monotonic() value)"""
+        connect, read = self.get_http_timeout()
+        if deadline is None:
+            return connect, read
+        left = max(0.001, deadline - time.monotonic())
+        return min(connect, left), min(read, left)
+    
+    def get_http_stats(self):
+        """Get connection reuse statistics of the shared HTTP session"""
+        stats = dict(self._closed_pool_stats)
+        sessions = [session for _, session in self._family_sessions.values()]
+        if self._session is not None:
+            sessions.append(self._session)
+        for session in sessions:
+            for name, value in get_pool_stats(session).items():
+                stats[name] += value
+        
+        stats['reused'] = max(0, stats['requests'] - stats['connections'])
+        stats['reuse_ratio'] = round(stats['reused'] / stats['requests'], 3) if stats['requests'] else None
+        return stats
+    
+    def lookup_public_ip(self, session=None, family=None):
+        """Get current public IP address along with the winning provider and per-provider latencies.
+        
+        A session routes the lookup through a specific egress path (proxy or source address);
+        a family (4 or 6) pins the default egress connections to that address family.
+        Services are tried fastest first and ones with an open circuit are skipped. Only
+        default egress lookups update provider health, so a dead tunnel can't trip them,
+        and IPv6 lookups don't either, so services without IPv6 aren't tripped.
+        The whole lookup is over after LOOKUP_TIMEOUT seconds, however many services
+        it still had to try, so a web request waiting on it is never stuck for long.
+        """
+        deadline = time.monotonic() + self.config.LOOKUP_TIMEOUT
+        configured = self.get_ip_services(session)
+        services, half_open = self.providers.order(configured)
+        if not services:
+            # Every circuit is open; asking anyway beats certainly failing
+            services = configured
+        
+        if self.config.IP_LOOKUP_MODE == 'race':
+            result = self._race_lookup(services, session, family, deadline)
+        elif self.config.IP_LOOKUP_MODE == 'consensus':
+            result = self._consensus_lookup(services, session, family, deadline)
+        else:
+            result = self._sequential_lookup(services, session, family, deadline)
+        
+        for service, latency in result['latencies'].items():
+            if latency['latency_ms'] is not None:
+                metrics.observe('ipmonitor_provider_lookup_seconds', latency['latency_ms'] / 1000,
+                                provider=service, status=latency['status'])
+        for service in configured:
+            result['latencies'].setdefault(service, {'status': 'open', 'latency_ms': None})
+        
+        if session is None and family != 6:
+            for service in services:
+                latency = result['latencies'][service]
+                self.providers.record(service, latency['status'], latency['latency_ms'], latency.get('error'))
+            self.save_state()
+            self.providers.probe(half_open)
+            self.last_lookup = result
+        return result
+    
+    def lookup_families(self, families):
+        """Look up the default egress IP of each address family at the same time; returns {family: lookup}"""
+        if len(families) == 1:
+            return {families[0]: self.lookup_public_ip(family=families[0])}
+        
+        lookups = {}
+        
+        def lookup(family):
+            lookups[family] = self.lookup_public_ip(family=family)
+        
+        # The first family is looked up on this thread, the others alongside it
+        threads = [threading.Thread(target=lookup, args=(family,), daemon=True, name=f"ip-lookup-ipv{family}")
+                   for family in families[1:]]
+        for thread in threads:
+            thread.start()
+        lookup(families[0])
+        for thread in threads:
+            thread.join()
+        return lookups
+    
+    def get_ip_services(self, session=None):
+        """Configured IP providers, or the built-in list.
+        
+        DNS providers are left out of lookups through a session: their UDP query
+        would leave by the default route, not through the target's proxy.
+        """
+        services = self.config.get_ip_providers() or list(IP_SERVICES)
+        if session is not None:
+            services = [service for service in services if not service.startswith('dns://')]
+        return services
+    
     def get_public_ip(self):
         """Get current public IP address with retry logic"""
-        services = [
-            'https://ipinfo.io/ip',
-            'https://api.ipify.org',
-            'https://ip.seeip.org',
-            'https://ifconfig.me/ip',
-            'https://checkip.amazonaws.com'
-        ]
+        return self.lookup_public_ip()['ip']
+    
+    def _query_service(self, service, cancelled=None, session=None, family=None, deadline=None):
+        """Query a single IP service and return (ip, status, latency_ms, error)"""
+        if service.startswith('dns://'):
+            return self._query_dns(service, family, deadline)
+        if session is None and self.fast_start:
+            return self._query_service_stdlib(service, cancelled, family, deadline)
+        
+        import requests
+        start = time.monotonic()
+        ip = ''
+        try:
+            response = (session or self.get_session(family)).get(
+                service, timeout=self.get_lookup_timeout(deadline), stream=cancelled is not None
+            )
+            if cancelled is not None and cancelled.is_set():
+                # Another provider already won; don't bother reading the body
+                response.close()
+                return None, 'cancelled', None, None
+            response.raise_for_status()
+            ip = response.text.strip()
+            
+            # Validate IP format
+            ipaddress.ip_address(ip)
+            return ip, 'ok', round((time.monotonic() - start) * 1000, 1), None
+            
+        except requests.RequestException as e:
+            return None, 'error', round((time.monotonic() - start) * 1000, 1), str(e)
+        except ValueError:
+            return None, 'invalid', round((time.monotonic() - start) * 1000, 1), f"Invalid IP format: {ip[:64]}"
+    
+    def _query_service_stdlib(self, service, cancelled=None, family=None, deadline=None):
+        """Like _query_service, but with urllib so a one-shot check never imports requests"""
+        import http.client
+        import urllib.request
+        
+        start = time.monotonic()
+        ip = ''
+        try:
+            opener = build_pinned_opener(family) if family else urllib.request.build_opener()
+            # urllib has a single timeout for connecting and for each read
+            with opener.open(service, timeout=self.get_lookup_timeout(deadline)[1]) as response:
+                if cancelled is not None and cancelled.is_set():
+                    return None, 'cancelled', None, None
+                ip = response.read(MAX_IP_RESPONSE).decode('utf-8', errors='replace').strip()
+            
+            ipaddress.ip_address(ip)
+            return ip, 'ok', round((time.monotonic() - start) * 1000, 1), None
+            
+        except (OSError, http.client.HTTPException) as e:
+            return None, 'error', round((time.monotonic() - start) * 1000, 1), str(e)
+        except ValueError:
+            return None, 'invalid', round((time.monotonic() - start) * 1000, 1), f"Invalid IP format: {ip[:64]}"
+    
+    def _query_dns(self, service, family=None, deadline=None):
+        """Like _query_service, for a dns:// provider: one UDP query to the resolver it names"""
+        import resolver
+        
+        start = time.monotonic()
+        try:
+            ip = resolver.lookup(service, self.get_lookup_timeout(deadline)[0], family)
+        except (resolver.DNSError, OSError, ValueError) as e:
+            return None, 'error', round((time.monotonic() - start) * 1000, 1), str(e)
+        
+        latency_ms = round((time.monotonic() - start) * 1000, 1)
+        if ip is None:
+            return None, 'invalid', latency_ms, "No IP address in the DNS answer"
+        return ip, 'ok', latency_ms, None
+    
+    def _sequential_lookup(self, services, session=None, family=None, deadline=None):
+        """Try each service in turn until one returns a valid IP or the deadline passes"""
+        latencies = {service: {'status': 'skipped', 'latency_ms': None} for service in services}
         
         for attempt, service in enumerate(services, 1):
-            try:
-                self.logger.info(f"Attempt {attempt}: Checking IP via {service}")
-                response = requests.get(service, timeout=10)
-                response.raise_for_status()
-                ip = response.text.strip()
+            if deadline is not None and time.monotonic() >= deadline:
+                self.logger.error(f"Lookup timeout of {self.config.LOOKUP_TIMEOUT}s reached, skipping the remaining services")
+                break
+            self.logger.info(f"Attempt {attempt}: Checking IP via {service}")
+            ip, status, latency_ms, error = self._query_service(service, session=session, family=family, deadline=deadline)
+            latencies[service] = {'status': status, 'latency_ms': latency_ms, 'error': error}
+            
+            if ip:
+                self.logger.info(f"Retrieved IP: {ip}")
+                return {'ip': ip, 'provider': service, 'mode': 'sequential', 'latencies': latencies}
+            
+            self.logger.warning(f"Failed to get IP from {service}: {error}")
+        
+        self.logger.error("Failed to get public IP from all services")
+        return {'ip': None, 'provider': None, 'mode': 'sequential', 'latencies': latencies}
+    
+    def _race_lookup(self, services, session=None, family=None, deadline=None):
+        """Query all services concurrently and return the first valid answer"""
+        latencies = {service: {'status': 'cancelled', 'latency_ms': None} for service in services}
+        results = queue.Queue()
+        cancelled = threading.Event()
+        
+        def worker(service):
+            results.put((service,) + self._query_service(service, cancelled, session, family, deadline))
+        
+        self.logger.info(f"Racing {len(services)} IP services")
+        
+        # Daemon threads so that abandoned lookups never delay interpreter exit
+        for service in services:
+            threading.Thread(target=worker, args=(service,), daemon=True, name=f"ip-lookup-{service}").start()
+        
+        wait_until = min(time.monotonic() + sum(self.get_http_timeout()), deadline or float('inf'))
+        winner = None
+        pending = len(services)
+        
+        try:
+            while pending:
+                try:
+                    service, ip, status, latency_ms, error = results.get(timeout=max(0, wait_until - time.monotonic()))
+                except queue.Empty:
+                    break
                 
-                # Validate IP format
-                ipaddress.ip_address(ip)
+                pending -= 1
+                latencies[service] = {'status': status, 'latency_ms': latency_ms, 'error': error}
                 
-                self.logger.info(f"Retrieved IP: {ip}")
-                return ip
+                if ip:
+                    winner = (service, ip)
+                    break
                 
-            except requests.RequestException as e:
-                self.logger.warning(f"Failed to get IP from {service}: {e}")
-                continue
-            except ipaddress.AddressValueError as e:
-                self.logger.warning(f"Invalid IP format from {service}: {ip}")
-                continue
+                self.logger.warning(f"Failed to get IP from {service}: {error}")
+        finally:
+            # Tell the losing lookups to drop their responses
+            cancelled.set()
         
-        self.logger.error("Failed to get public IP from all services")
-        return None
+        if not winner:
+            self.logger.error("Failed to get public IP from all services")
+            return {'ip': None, 'provider': None, 'mode': 'race', 'latencies': latencies}
+        
+        service, ip = winner
+        self.logger.info(f"Retrieved IP: {ip} via {service} ({latencies[service]['latency_ms']} ms)")
+        return {'ip': ip, 'provider': service, 'mode': 'race', 'latencies': latencies}
+    
+    def _consensus_lookup(self, services, session=None, family=None, deadline=None):
+        """Ask the fastest CONSENSUS_PROVIDERS services at once; accept an IP once CONSENSUS_QUORUM agree.
+        
+        A service that fails is replaced by the next one, so a dead provider
+        costs no extra round trip. The lookup ends as soon as the quorum is
+        reached, or at CONSENSUS_TIMEOUT. If by then every answer names the
+        same IP but too few services answered, that IP is used unconfirmed;
+        only answers naming different IPs make the result inconclusive, with
+        no IP.
+        """
+        quorum = self.config.CONSENSUS_QUORUM
+        latencies = {service: {'status': 'skipped', 'latency_ms': None} for service in services}
+        votes = {}
+        results = queue.Queue()
+        cancelled = threading.Event()
+        waiting = list(services)
+        
+        def worker(service):
+            results.put((service,) + self._query_service(service, cancelled, session, family, deadline))
+        
+        def ask(service):
+            latencies[service] = {'status': 'cancelled', 'latency_ms': None}
+            threading.Thread(target=worker, args=(service,), daemon=True, name=f"ip-lookup-{service}").start()
+        
+        self.logger.info(f"Asking {min(self.config.CONSENSUS_PROVIDERS, len(services))} IP services for a quorum of {quorum}")
+        start = time.monotonic()
+        wait_until = min(start + self.config.CONSENSUS_TIMEOUT, deadline or float('inf'))
+        pending = 0
+        for _ in range(min(self.config.CONSENSUS_PROVIDERS, len(services))):
+            ask(waiting.pop(0))
+            pending += 1
+        
+        agreed = None
+        try:
+            while pending:
+                try:
+                    service, ip, status, latency_ms, error = results.get(timeout=max(0, wait_until - time.monotonic()))
+                except queue.Empty:
+                    break
+                
+                pending -= 1
+                latencies[service] = {'status': status, 'latency_ms': latency_ms, 'error': error}
+                if not ip:
+                    self.logger.warning(f"Failed to get IP from {service}: {error}")
+                    if waiting:
+                        ask(waiting.pop(0))
+                        pending += 1
+                    continue
+                
+                votes.setdefault(ip, []).append(service)
+                if len(votes[ip]) >= quorum:
+                    agreed = ip
+                    break
+        finally:
+            cancelled.set()
+        
+        if agreed:
+            decision = 'agreed'
+        elif len(votes) == 1:
+            # Every service that answered agrees; the rest failed or timed out
+            decision = 'unconfirmed'
+            agreed = next(iter(votes))
+        else:
+            decision = 'inconclusive' if votes else 'no_answer'
+        
+        consensus = {
+            'decision': decision,
+            'quorum': quorum,
+            'votes': votes,
+            'elapsed_ms': round((time.monotonic() - start) * 1000, 1)
+        }
+        result = {'ip': agreed, 'provider': votes[agreed][0] if agreed else None, 'mode': 'consensus',
+                  'latencies': latencies, 'consensus': consensus}
+        
+        if decision == 'agreed':
+            self.logger.info(f"Retrieved IP: {agreed}, confirmed by {', '.join(votes[agreed])} in {consensus['elapsed_ms']} ms")
+        elif decision == 'unconfirmed':
+            self.logger.warning(f"Retrieved IP: {agreed} from {', '.join(votes[agreed])} only, short of a quorum of {quorum}; "
+                                f"other services did not answer")
+        elif votes:
+            self.logger.warning(f"IP services disagree, no quorum of {quorum}: "
+                                + '; '.join(f"{ip} from {', '.join(names)}" for ip, names in votes.items()))
+        else:
+            self.logger.error("Failed to get public IP from all services")
+        return result
+    
+    def get_range_key(self, config):
+        """Identity of the protected range sources of a configuration"""
+        range_files = config.get_range_files()
+        if range_files:
+            # Range files are compiled to disk once and memory-mapped by every process
+            return range_fingerprint(config.SAFE_IP_RANGE, range_files)
+        return config.SAFE_IP_RANGE
+    
+    def build_range_index(self, config, key):
+        """Compile (or memory-map) the protected range index of a configuration"""
+        range_files = config.get_range_files()
+        if range_files:
+            index = load_range_index(config.SAFE_IP_RANGE, range_files, self.range_index_file, self.logger, key)
+        else:
+            index = RangeIndex.from_cidrs(config.get_safe_ranges(), self.logger)
+        self.logger.info(f"Loaded {len(index)} protected IP intervals")
+        return index
+    
+    def get_range_index(self):
+        """Get the compiled protected range index, rebuilding it only when the range sources change"""
+        config = self.config
+        key = self.get_range_key(config)
+        cached_key, index = self._ranges
+        if index is None or cached_key != key:
+            index = self.build_range_index(config, key)
+            self._ranges = (key, index)
+        return index
+    
+    def reload_config(self):
+        """Swap in config.json if it changed since it was loaded; returns True if it did.
+        
+        Costs one stat when nothing changed. The range index for the new
+        configuration is built before the swap, so concurrent checks see
+        either the old configuration and ranges or the new ones. Sessions and
+        cooldowns are derived from self.config and follow on next use.
+        """
+        if not self.config.has_changed():
+            return False
+        
+        with self.config_lock:
+            config = self.config
+            if not config.has_changed():
+                # Another thread reloaded it while we waited
+                return False
+            
+            try:
+                new_config = config.reload()
+                key = self.get_range_key(new_config)
+                ranges = (key, self.build_range_index(new_config, key))
+            except Exception as e:
+                self.logger.error(f"Keeping current configuration, reload failed: {e}")
+                # Don't retry until the file changes again
+                try:
+                    config.file_key = config.get_file_key(os.stat(config.config_file))
+                except OSError:
+                    config.file_key = None
+                return False
+            
+            self.config = new_config
+            self._ranges = ranges
+        
+        self.logger.info(f"Configuration reloaded (version {new_config.version})")
+        return True
     
     def is_ip_safe(self, ip_str):
         """Check if IP is within any protected CIDR range - returns False if IP needs protection (alert should be triggered)"""
         try:
             ip = ipaddress.ip_address(ip_str)
-            safe_ranges = self.config.get_safe_ranges()
+            protected_range = self.get_range_index().lookup(ip)
             
-            for cidr_range in safe_ranges:
-                try:
-                    network = ipaddress.ip_network(cidr_range.strip(), strict=False)
-                    if ip in network:
-                        self.logger.warning(f"IP {ip_str} is in protected range {cidr_range} - VPN may be disabled")
-                        return False, cidr_range  # Alert needed - IP is in protected range
-                except ValueError as e:
-                    self.logger.error(f"Invalid CIDR range {cidr_range}: {e}")
-                    continue
+            if protected_range:
+                self.logger.warning(f"IP {ip_str} is in protected range {protected_range} - VPN may be disabled")
+                return False, protected_range  # Alert needed - IP is in protected range
             
             self.logger.info(f"IP {ip_str} is not in any protected ranges - VPN appears active")
             return True, None  # No alert needed - IP is outside protected ranges
@@ -153,14 +860,28 @@ class IPMonitor:
             self.logger.error(f"Invalid IP address: {e}")
             return False, None
     
-    def should_send_alert(self):
+    def in_coalesce_window(self, state):
+        """Check if an alert batch opened within the coalescing window is still collecting events"""
+        window = self.get_coalesce_window()
+        if not window or not state.get('alert_batch_started'):
+            return False
+        
+        batch_started = datetime.fromisoformat(state['alert_batch_started'])
+        return datetime.now() - batch_started < timedelta(seconds=window)
+    
+    def should_send_alert(self, state=None, cooldown=None):
         """Check if we should send an alert based on cooldown"""
-        if not self.state['last_alert_time']:
+        state = self.state if state is None else state
+        if not state['last_alert_time']:
             return True
         
         try:
-            last_alert = datetime.fromisoformat(self.state['last_alert_time'])
-            cooldown_str = self.config.ALERT_COOLDOWN
+            # Alerts raised while a batch is still open join it instead of being suppressed
+            if self.in_coalesce_window(state):
+                return True
+            
+            last_alert = datetime.fromisoformat(state['last_alert_time'])
+            cooldown_str = cooldown or self.config.ALERT_COOLDOWN
             
             # Parse cooldown (e.g., "1h", "30m", "2h30m")
             cooldown_seconds = self.parse_time_string(cooldown_str)
@@ -200,36 +921,77 @@ class IPMonitor:
         
         return total_seconds if total_seconds > 0 else 3600  # Default 1 hour
     
-    def send_notification(self, current_ip, protected_range):
+    def send_notification(self, current_ip, protected_range, target=None):
         """Send HTTP notification when IP is in a protected range (VPN disabled)"""
-        if not self.should_send_alert():
+        state = self.state if target is None else self.get_target_state(target.name)
+        cooldown = None if target is None else target.alert_cooldown
+        
+        if not self.should_send_alert(state, cooldown):
             self.logger.info("Alert suppressed due to cooldown period")
             return
         
-        message = f"VPN ALERT: Current IP {current_ip} is in protected range {protected_range}. VPN may be disabled - you are not protected!"
+        if target is None:
+            message = f"VPN ALERT: Current IP {current_ip} is in protected range {protected_range}. VPN may be disabled - you are not protected!"
+        else:
+            message = f"VPN ALERT [{target.name}]: Egress IP {current_ip} is in protected range {protected_range}. Tunnel may be down!"
         
         payload = {
             "message": message,
             "current_ip": current_ip,
-            "protected_ranges": self.config.get_safe_ranges(),
+            "protected_ranges": self.config.get_safe_ranges() if target is None else target.get_safe_ranges(self.config),
             "matched_range": protected_range,
             "timestamp": datetime.now().isoformat(),
             "alert_type": "vpn_disabled",
-            "consecutive_alerts": self.state['consecutive_alerts'] + 1,
+            "consecutive_alerts": state['consecutive_alerts'] + 1,
             "monitor_stats": {
-                "total_checks": self.state['total_checks'],
-                "alerts_sent": self.state['alerts_sent'] + 1
+                "total_checks": state['total_checks'],
+                "alerts_sent": state['alerts_sent'] + 1
             }
         }
         
+        if target is not None:
+            payload['target'] = target.name
+        
+        # Queue the alert; the outbox worker delivers it with retries
+        try:
+            entry_id = self.outbox.enqueue(payload)
+        except Exception as e:
+            self.logger.error(f"Could not queue notification: {e}")
+            return
+        
+        self.logger.info(f"Queued {self.config.WEBHOOK_METHOD} notification {entry_id}")
+        self.logger.info(f"Message: {message}")
+        
+        # Update state
+        name = None if target is None else target.name
+        with self.state_lock:
+            if not self.in_coalesce_window(state):
+                self.set_state('alert_batch_started', datetime.now().isoformat(), name)
+            self.set_state('last_alert_time', datetime.now().isoformat(), name)
+            self.increment_state('consecutive_alerts', 1, name)
+        self.save_state()
+        
+        if self.outbox_worker:
+            self.outbox_worker.wake()
+    
+    def deliver_webhook(self, payload):
+        """Send a notification payload to the webhook; returns (ok, status_code, error)"""
+        started = time.monotonic()
+        ok, status_code, error = self._send_webhook(payload)
+        metrics.observe('ipmonitor_webhook_delivery_seconds', time.monotonic() - started, status=str(status_code or 'error'))
+        return ok, status_code, error
+    
+    def _send_webhook(self, payload):
+        import requests
+        
         try:
             self.logger.info(f"Sending {self.config.WEBHOOK_METHOD} notification")
             self.logger.info(f"Webhook URL: {self.config.WEBHOOK_URL}")
-            self.logger.info(f"Message: {message}")
             
             # Prepare request arguments
+            session = self.get_session()
             request_kwargs = {
-                'timeout': 30,
+                'timeout': self.get_http_timeout(WEBHOOK_TIMEOUT),
                 'headers': {'Content-Type': 'application/json'}
             }
             
@@ -241,7 +1003,7 @@ class IPMonitor:
             # Handle different HTTP methods
             if self.config.WEBHOOK_METHOD in ['POST', 'PUT', 'PATCH']:
                 request_kwargs['json'] = payload
-                response = getattr(requests, self.config.WEBHOOK_METHOD.lower())(
+                response = getattr(session, self.config.WEBHOOK_METHOD.lower())(
                     self.config.WEBHOOK_URL,
                     **request_kwargs
                 )
@@ -250,60 +1012,220 @@ class IPMonitor:
                 import urllib.parse
                 params = {k: str(v) for k, v in payload.items() if k not in ['safe_ranges', 'monitor_stats']}
                 url_with_params = f"{self.config.WEBHOOK_URL}?{urllib.parse.urlencode(params)}"
-                response = requests.get(url_with_params, **{k: v for k, v in request_kwargs.items() if k != 'headers'})
+                response = session.get(url_with_params, **{k: v for k, v in request_kwargs.items() if k != 'headers'})
             elif self.config.WEBHOOK_METHOD == 'HEAD':
                 # HEAD requests don't send body data
-                response = requests.head(self.config.WEBHOOK_URL, **{k: v for k, v in request_kwargs.items() if k not in ['headers', 'json']})
+                response = session.head(self.config.WEBHOOK_URL, **{k: v for k, v in request_kwargs.items() if k not in ['headers', 'json']})
             
             if response.status_code in [200, 201, 202, 204]:
                 self.logger.info(f"Notification sent successfully (HTTP {response.status_code})")
-                
-                # Update state
-                self.state['last_alert_time'] = datetime.now().isoformat()
-                self.state['consecutive_alerts'] += 1
-                self.state['alerts_sent'] += 1
-                self.save_state()
-                
-            else:
-                self.logger.error(f"Failed to send notification (HTTP {response.status_code})")
-                self.logger.error(f"Response: {response.text}")
+                return True, response.status_code, None
+            
+            self.logger.error(f"Failed to send notification (HTTP {response.status_code})")
+            self.logger.error(f"Response: {response.text}")
+            return False, response.status_code, f"HTTP {response.status_code}"
                 
         except requests.RequestException as e:
             self.logger.error(f"Error sending notification: {e}")
+            return False, None, str(e)
         except Exception as e:
             self.logger.error(f"Unexpected error sending notification: {e}")
+            return False, None, str(e)
+    
+    def on_notification_delivered(self, payload):
+        """Count a delivered alert against the global or target state"""
+        if payload.get('target'):
+            self.get_target_state(payload['target'])
+        self.increment_state('alerts_sent', 1, payload.get('target'))
+        self.save_state()
+    
+    def get_outbox_max_age(self):
+        """Get how long undelivered notifications are retried, in seconds"""
+        return self.parse_time_string(self.config.WEBHOOK_MAX_AGE)
+    
+    def get_coalesce_window(self):
+        """Get the alert coalescing window in seconds (0 disables coalescing)"""
+        return self.config.get_coalesce_window()
+    
+    def drain_outbox(self):
+        """Deliver queued notifications once in this thread; returns number delivered"""
+        return self.outbox.drain(
+            self.deliver_webhook, self.get_outbox_max_age(), self.on_notification_delivered, self.get_coalesce_window()
+        )
+    
+    def start_outbox_worker(self):
+        """Start delivering queued notifications in the background"""
+        if self.outbox_worker is None:
+            # A worker idling in the web process must not keep sending to an old WEBHOOK_URL
+            self.outbox_worker = OutboxWorker(
+                self.outbox, self.deliver_webhook, self.get_outbox_max_age, self.on_notification_delivered,
+                self.get_coalesce_window, before_drain=self.reload_config
+            )
+            self.outbox_worker.start()
+        return self.outbox_worker
+    
+    def close(self):
+        """Stop background workers and release network resources"""
+        if self.outbox_worker:
+            self.outbox_worker.stop()
+            self.outbox_worker = None
+        self.close_session()
+        self.log_handler.flush()
+    
+    def observe(self):
+        """Look up the current public IP and evaluate it against the protected ranges.
+        
+        With IP_FAMILIES set, every family's egress IP is looked up at the same time
+        and reported under 'families'. The check is decided by a family in a
+        protected range if there is one, else by the first family that answered.
+        """
+        families = self.config.get_ip_families()
+        if not families:
+            return self.evaluate(self.lookup_public_ip())
+        
+        lookups = self.lookup_families(families)
+        evaluated = {f"ipv{family}": self.evaluate(lookups[family]) for family in families}
+        entries = list(evaluated.values())
+        primary = (next((entry for entry in entries if entry['is_safe'] is False), None)
+                   or next((entry for entry in entries if entry['ip']), entries[0]))
+        
+        observation = dict(primary)
+        observation['families'] = {
+            name: {key: entry[key] for key in ('ip', 'is_safe', 'protected_range', 'lookup')}
+            for name, entry in evaluated.items()
+        }
+        return observation
+    
+    def evaluate(self, lookup):
+        """Observation of a single lookup: its IP matched against the protected ranges"""
+        observation = {
+            "ip": lookup['ip'],
+            "is_safe": None,
+            "protected_range": None,
+            "observed_at": datetime.now().isoformat(),
+            "lookup": lookup
+        }
+        
+        if lookup['ip']:
+            observation['is_safe'], observation['protected_range'] = self.is_ip_safe(lookup['ip'])
+        
+        return observation
+    
+    def record_history(self, lookup, protected_range=None, target=None):
+        """Append a check result to the history store; returns the outcome, never fails the check"""
+        if not lookup['ip']:
+            outcome = 'inconclusive' if is_inconclusive(lookup) else 'error'
+        else:
+            outcome = 'alert' if protected_range else 'protected'
+        provider = lookup.get('provider')
+        latency_ms = lookup['latencies'].get(provider, {}).get('latency_ms') if provider else None
+        
+        try:
+            self.history.append(time.time(), outcome, lookup['ip'], protected_range, provider, latency_ms, target)
+        except Exception as e:
+            self.logger.error(f"Could not record check history: {e}")
+        
+        return outcome
+    
+    def record_check_duration(self, started, outcome, target=None):
+        """Add a finished check (started at a time.monotonic() value) to the check duration histogram"""
+        metrics.observe('ipmonitor_check_duration_seconds', time.monotonic() - started,
+                        target=target or 'default', outcome=outcome)
+    
+    def get_targets_status(self):
+        """Get the last known result of every egress target, as saved by the check process"""
+        self.refresh_state()
+        
+        with self.state_lock:
+            return [
+                {
+                    "name": name,
+                    "current_ip": target_state.get('last_known_ip'),
+                    "is_safe": target_state.get('last_is_safe'),
+                    "protected_range": target_state.get('last_protected_range'),
+                    "status": target_state.get('last_status'),
+                    "error": target_state.get('last_error'),
+                    "last_check": target_state.get('last_check'),
+                    "total_checks": target_state.get('total_checks', 0),
+                    "alerts_sent": target_state.get('alerts_sent', 0)
+                }
+                for name, target_state in sorted(self.state.get('targets', {}).items())
+            ]
+    
+    def get_last_status(self):
+        """Status as of the most recent recorded check, without an IP lookup; None before the first check"""
+        point = self.history.latest()
+        if point is None:
+            return None
+        
+        self.refresh_state()
+        outcome = point['outcome']
+        # A failed or inconclusive check is shown as such, not as the last check that found an IP
+        is_safe = {'protected': True, 'alert': False}.get(outcome)
+        observed_at = datetime.fromtimestamp(point['timestamp']).isoformat()
+        
+        status = {
+            "current_ip": point['ip'],
+            "protected_ranges": self.config.get_safe_ranges(),
+            "is_safe": is_safe,
+            "protected_range": point['protected_range'],
+            "status": outcome.capitalize() if is_safe is None else "Protected" if is_safe else "Alert",
+            "timestamp": observed_at,
+            "observed_at": observed_at,
+            "config_source": self.config.config_source,
+            "monitor_stats": self.state,
+            "next_alert_allowed": self.should_send_alert(),
+            "lookup": {"provider": point['provider'], "latency_ms": point['latency_ms']},
+            "targets": self.get_targets_status()
+        }
+        if is_safe is None:
+            status["error"] = CHECK_ERRORS[outcome]
+        return status
     
     def get_status(self):
-        """Get current monitor status"""
-        current_ip = self.get_public_ip()
+        """Get current monitor status, reusing a recent observation when available"""
+        ttl = self.parse_time_string(self.config.STATUS_CACHE_TTL)
+        # Taken before the lookup: if the ranges change during it, the result is stored as stale
+        range_key = self.get_range_key(self.config)
+        observation, age = self.observations.get(self.observe, ttl, range_key)
+        current_ip = observation['ip']
         if not current_ip:
             return {
-                "error": "Could not retrieve current IP",
-                "timestamp": datetime.now().isoformat()
+                "error": CHECK_ERRORS['inconclusive' if is_inconclusive(observation['lookup']) else 'error'],
+                "timestamp": datetime.now().isoformat(),
+                "lookup": observation['lookup'],
+                "families": observation.get('families'),
+                "targets": self.get_targets_status()
             }
         
-        is_safe, safe_range = self.is_ip_safe(current_ip)
+        is_safe = observation['is_safe']
         
         return {
             "current_ip": current_ip,
             "protected_ranges": self.config.get_safe_ranges(),
             "is_safe": is_safe,
-            "protected_range": safe_range,
+            "protected_range": observation['protected_range'],
             "status": "Protected" if is_safe else "Alert",
             "timestamp": datetime.now().isoformat(),
+            "observed_at": observation['observed_at'],
+            "observation_age": round(age, 3),
             "config_source": self.config.config_source,
             "monitor_stats": self.state,
-            "next_alert_allowed": self.should_send_alert()
+            "next_alert_allowed": self.should_send_alert(),
+            "lookup": observation['lookup'],
+            "families": observation.get('families'),
+            "targets": self.get_targets_status()
         }
     
     def run_check(self):
         """Main monitoring logic"""
         self.logger.info("=" * 50)
         self.logger.info("Starting IP check...")
+        started = time.monotonic()
         self.logger.info(f"Timestamp: {datetime.now().isoformat()}")
         
         # Update check counter
-        self.state['total_checks'] += 1
+        self.increment_state('total_checks')
         
         # Log configuration
         self.logger.info(f"Protected IP ranges (VPN off alert): {', '.join(self.config.get_safe_ranges())}")
@@ -311,21 +1233,35 @@ class IPMonitor:
         self.logger.info(f"Config source: {self.config.config_source}")
         
         # Get current public IP
-        current_ip = self.get_public_ip()
+        range_key = self.get_range_key(self.config)
+        observation = self.observe()
+        lookup = observation['lookup']
+        current_ip = observation['ip']
+        outcome = self.record_history(lookup, observation['protected_range'])
         if not current_ip:
-            self.logger.error("Could not retrieve current IP address - check failed")
+            if outcome == 'inconclusive':
+                # Not trusted either way: no alert, and the alert streak is left as it is
+                self.logger.warning("IP services disagree on the public IP - check inconclusive")
+            else:
+                self.logger.error("Could not retrieve current IP address - check failed")
+            self.record_check_duration(started, outcome)
             return False
         
-        self.logger.info(f"Current public IP: {current_ip}")
+        self.logger.info(f"Current public IP: {current_ip} (provider: {lookup['provider']}, mode: {lookup['mode']})")
+        for name, entry in (observation.get('families') or {}).items():
+            self.logger.info(f"{name} egress: {entry['ip'] or 'none'}")
+            if entry['ip'] and not self.get_range_index().covers_family(int(name[3])):
+                self.logger.warning(f"No {name} protected ranges configured; a leak over {name} can't be detected")
         
         # Track IP changes
-        if self.state['last_known_ip'] and self.state['last_known_ip'] != current_ip:
-            self.logger.info(f"IP changed from {self.state['last_known_ip']} to {current_ip}")
+        family_ips = [entry['ip'] for entry in (observation.get('families') or {}).values() if entry['ip']]
+        self.track_ip_change([current_ip] + [ip for ip in family_ips if ip != current_ip])
         
-        self.state['last_known_ip'] = current_ip
+        # Share the fresh observation with status requests
+        self.observations.put(observation, key=range_key)
         
         # Check if IP is in protected range (VPN disabled)
-        is_safe, protected_range = self.is_ip_safe(current_ip)
+        is_safe, protected_range = observation['is_safe'], observation['protected_range']
         
         if not is_safe:
             self.logger.warning(f"⚠️  VPN ALERT: IP {current_ip} is in protected range {protected_range}")
@@ -339,7 +1275,7 @@ class IPMonitor:
         else:
             self.logger.info(f"Success; VPN Active: IP {current_ip} is outside protected ranges")
             # Reset consecutive alerts counter
-            self.state['consecutive_alerts'] = 0
+            self.set_state('consecutive_alerts', 0)
         
         # Save state
         self.save_state()
@@ -347,15 +1283,37 @@ class IPMonitor:
         self.logger.info(f"Total checks: {self.state['total_checks']}, Alerts sent: {self.state['alerts_sent']}")
         self.logger.info("IP check completed")
         self.logger.info("=" * 50)
+        self.record_check_duration(started, outcome)
         return True
 
+def is_inconclusive(lookup):
+    """Whether a lookup got answers but no consensus on them"""
+    return lookup.get('consensus', {}).get('decision') == 'inconclusive'
+
 def main():
     """Main entry point"""
     print("ip monitor starting...")
-    monitor = IPMonitor()
+    metrics.registry.set_role('check')
+    monitor = IPMonitor(fast_start=True)
+    
+    # Held until the process exits
+    check_lock = monitor.try_check_lock()
+    if check_lock is None:
+        monitor.logger.info("Another check is running, skipping this run")
+        exit(0)
     
     try:
-        success = monitor.run_check()
+        if monitor.config.get_targets():
+            # Targets need proxies and bound sessions, so this path loads requests
+            from engine import MonitoringEngine
+            success, _ = MonitoringEngine(monitor).run_cycle()
+        else:
+            success = monitor.run_check()
+        
+        # No background worker in one-shot mode; try queued alerts before exiting
+        monitor.drain_outbox()
+        # Half-open providers are probed alongside the check; exiting would kill the probes
+        monitor.providers.join_probes(sum(monitor.get_http_timeout()))
         exit_code = 0 if success else 1
         monitor.logger.info(f"Monitor exiting with code: {exit_code}")
         exit(exit_code)
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from config import data_path
+from filelock import FileLock
+
+# Retry backoff: first retry after BACKOFF_BASE seconds, doubling up to BACKOFF_MAX
+BACKOFF_BASE = 5
+BACKOFF_MAX = 900
+
+# Rewrite the outbox once this many finished records have piled up
+COMPACT_AFTER = 200
+
+# Longest the worker sleeps before looking for entries queued by other processes
+POLL_INTERVAL = 5
+
+# How often a worker that another process is already running tries to take over
+STANDBY_INTERVAL = 10
+
+# Delivery latencies kept for the stats
+LATENCY_SAMPLES = 100
+
+# Bytes before the replay offset compared on the next read, to notice a rewritten file
+REPLAY_TAIL = 64
+
+class WebhookOutbox:
+    """Durable, append-only queue of webhook notifications.
+
+    Every change is a JSON line: 'enqueue' adds a notification, 'attempt'
+    records a failed try and when to retry, 'done'/'dead' finish it. Replaying
+    the file gives the pending queue, so notifications survive restarts. Any
+    process may enqueue; one process at a time drains, and only one runs an
+    OutboxWorker.
+    """
+
+    def __init__(self, path=None, logger=None):
+        path = path or data_path('outbox.jsonl')
+        self.path = path
+        self.logger = logger or logging.getLogger(__name__)
+        self.append_lock = FileLock(f"{path}.lock")
+        self.drain_lock = FileLock(f"{path}.drain.lock")
+        # Held by the process whose OutboxWorker polls the outbox
+        self.worker_lock = FileLock(f"{path}.worker.lock")
+        # What replay() has parsed so far; see there
+        self.replay_lock = threading.Lock()
+        self._replayed = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _append(self, *records):
+        """Append records to the outbox file durably"""
+        data = ''.join(json.dumps(record, default=str) + '\n' for record in records).encode('utf-8')
+        with self.append_lock:
+            with open(self.path, 'ab+') as f:
+                # A record torn by a crash has no newline; start on a new line so
+                # only the torn record is lost, not the one appended after it
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        data = b'\n' + data
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def enqueue(self, payload):
+        """Queue a payload for delivery and return its id"""
+        # uuid pulls in platform; most one-shot checks never queue anything
+        import uuid
+        entry_id = uuid.uuid4().hex
+        self._append({'op': 'enqueue', 'id': entry_id, 'created': time.time(), 'payload': payload})
+        return entry_id
+
+    def replay(self):
+        """(pending entries, stats) of the outbox file, parsing only what was appended since the last call.
+
+        The replayed queue is kept with the file's identity (device, inode),
+        the offset it was read up to and the bytes just before that offset.
+        If the file was replaced (compaction writes a new one) or those bytes
+        changed, it is replayed from the start. Only complete lines are read;
+        a record still being appended is picked up by a later call.
+        """
+        with self.replay_lock:
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                self._replayed = None
+                return {}, new_stats()
+
+            with f:
+                st = os.fstat(f.fileno())
+                identity = (st.st_dev, st.st_ino)
+                replayed = self._replayed
+                data = None
+                if replayed is not None and replayed['identity'] == identity and replayed['offset'] <= st.st_size:
+                    tail = replayed['tail']
+                    f.seek(replayed['offset'] - len(tail))
+                    data = f.read()
+                    if data.startswith(tail):
+                        data = data[len(tail):]
+                    else:
+                        data = None
+                if data is None:
+                    replayed = {'identity': identity, 'offset': 0, 'tail': b'', 'pending': {}, 'stats': new_stats()}
+                    f.seek(0)
+                    data = f.read()
+
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].splitlines():
+                apply_record(replayed['pending'], replayed['stats'], line)
+            if end:
+                replayed['offset'] += end
+                replayed['tail'] = (replayed['tail'] + data[:end])[-REPLAY_TAIL:]
+            self._replayed = replayed
+
+            # Entries are replaced, never changed in place, so a shallow copy is a snapshot
+            stats = dict(replayed['stats'], latencies=deque(replayed['stats']['latencies'], maxlen=LATENCY_SAMPLES))
+            return dict(replayed['pending']), stats
+
+    def get_stats(self):
+        """Queue depth and delivery latency summary"""
+        pending, stats = self.replay()
+        latencies = [latency for latency in stats['latencies'] if latency is not None]
+        now = time.time()
+        return {
+            'queue_depth': len(pending),
+            'oldest_pending_age': round(now - min(e['created'] for e in pending.values()), 1) if pending else None,
+            'retrying': sum(1 for e in pending.values() if e['attempts']),
+            'delivered': stats['delivered'],
+            'dead': stats['dead'],
+            'last_delivery_latency_ms': latencies[-1] if latencies else None,
+            'avg_delivery_latency_ms': round(sum(latencies) / len(latencies), 1) if latencies else None
+        }
+
+    def next_due(self, window=0):
+        """Timestamp of the next pending delivery attempt, or None if the queue is empty"""
+        pending, _ = self.replay()
+        return min((max(e['next_attempt'], e['created'] + window) for e in pending.values()), default=None)
+
+    def backoff(self, attempts):
+        """Delay before retry number attempts, with jitter"""
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def drain(self, deliver, max_age, on_delivered=None, window=0):
+        """Deliver due entries once; returns number of entries delivered, or None if another process is draining.
+
+        deliver(payload) returns (ok, status_code, error). Entries older than
+        max_age seconds are dropped as dead. With a coalescing window, nothing
+        is sent until the oldest due entry has waited window seconds; then all
+        due entries go out together as one merged payload.
+        """
+        if not self.drain_lock.acquire(blocking=False):
+            return None
+
+        try:
+            pending, stats = self.replay()
+            now = time.time()
+            due = []
+
+            for entry in sorted(pending.values(), key=lambda e: e['created']):
+                if now - entry['created'] > max_age:
+                    self.logger.error(f"Dropping notification {entry['id']} after {entry['attempts']} attempt(s): older than max age")
+                    self._append({'op': 'dead', 'id': entry['id'], 'at': time.time(), 'reason': 'max_age'})
+                elif entry['next_attempt'] <= now:
+                    due.append(entry)
+
+            if not due:
+                return 0
+
+            if window:
+                if due[0]['created'] + window > now:
+                    # Coalescing window still open
+                    return 0
+                batches = [due]
+            else:
+                batches = [[entry] for entry in due]
+
+            delivered = 0
+            for batch in batches:
+                delivered += self._deliver_batch(batch, deliver, on_delivered)
+
+            if stats['finished_records'] + delivered >= COMPACT_AFTER:
+                self.compact()
+
+            return delivered
+        finally:
+            self.drain_lock.release()
+
+    def _deliver_batch(self, batch, deliver, on_delivered):
+        """Deliver entries as one request and record the outcome for each of them"""
+        payloads = [entry['payload'] for entry in batch]
+        payload = payloads[0] if len(payloads) == 1 else coalesce_payloads(payloads)
+
+        start = time.time()
+        try:
+            ok, status_code, error = deliver(payload)
+        except Exception as e:
+            ok, status_code, error = False, None, str(e)
+        finished = time.time()
+
+        if ok:
+            self._append(*[{
+                'op': 'done', 'id': entry['id'], 'at': finished, 'status': status_code,
+                'request_ms': round((finished - start) * 1000, 1),
+                'latency_ms': round((finished - entry['created']) * 1000, 1)
+            } for entry in batch])
+            if on_delivered:
+                for entry_payload in payloads:
+                    on_delivered(entry_payload)
+            return len(batch)
+
+        attempts = max(entry['attempts'] for entry in batch) + 1
+        next_attempt = finished + self.backoff(attempts)
+        self.logger.warning(f"Notification delivery failed (attempt {attempts}, {len(batch)} event(s)): {error}; retrying in {next_attempt - finished:.0f}s")
+        self._append(*[{
+            'op': 'attempt', 'id': entry['id'], 'at': finished, 'attempts': attempts,
+            'next_attempt': next_attempt, 'status': status_code, 'error': error
+        } for entry in batch])
+        return 0
+
+    def compact(self):
+        """Rewrite the outbox with only pending entries and a stats summary"""
+        with self.append_lock:
+            pending, stats = self.replay()
+            records = [{
+                'op': 'stats', 'delivered': stats['delivered'], 'dead': stats['dead'],
+                'latencies': list(stats['latencies'])
+            }]
+            for entry in pending.values():
+                records.append({
+                    'op': 'enqueue', 'id': entry['id'], 'created': entry['created'], 'payload': entry['payload'],
+                    'attempts': entry['attempts'], 'next_attempt': entry['next_attempt']
+                })
+
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+def new_stats():
+    return {'delivered': 0, 'dead': 0, 'latencies': deque(maxlen=LATENCY_SAMPLES), 'finished_records': 0}
+
+def apply_record(pending, stats, line):
+    """Apply one outbox line to the replayed queue and stats"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        # Torn write from a crash; everything before it is still valid
+        return
+
+    op = record.get('op')
+    if op == 'enqueue':
+        pending[record['id']] = {
+            'id': record['id'],
+            'created': record['created'],
+            'payload': record['payload'],
+            'attempts': record.get('attempts', 0),
+            'next_attempt': record.get('next_attempt', record['created'])
+        }
+    elif op == 'attempt' and record['id'] in pending:
+        pending[record['id']] = dict(
+            pending[record['id']], attempts=record['attempts'], next_attempt=record['next_attempt'], last_error=record.get('error')
+        )
+    elif op == 'done':
+        pending.pop(record['id'], None)
+        stats['delivered'] += 1
+        stats['latencies'].append(record.get('latency_ms'))
+        stats['finished_records'] += 1
+    elif op == 'dead':
+        pending.pop(record['id'], None)
+        stats['dead'] += 1
+        stats['finished_records'] += 1
+    elif op == 'stats':
+        stats['delivered'] += record.get('delivered', 0)
+        stats['dead'] += record.get('dead', 0)
+        stats['latencies'].extend(record.get('latencies', []))
+
+def coalesce_payloads(payloads):
+    """Merge several alert payloads into one, grouping identical events with counts and first/last timestamps"""
+    groups = {}
+    for payload in payloads:
+        key = (payload.get('alert_type'), payload.get('target'), payload.get('current_ip'), payload.get('matched_range'))
+        timestamp = payload.get('timestamp')
+        group = groups.get(key)
+        if group is None:
+            groups[key] = {
+                'alert_type': payload.get('alert_type'),
+                'target': payload.get('target'),
+                'current_ip': payload.get('current_ip'),
+                'matched_range': payload.get('matched_range'),
+                'message': payload.get('message'),
+                'count': 1,
+                'first_seen': timestamp,
+                'last_seen': timestamp
+            }
+        else:
+            group['count'] += 1
+            group['message'] = payload.get('message')
+            group['first_seen'] = min(group['first_seen'], timestamp)
+            group['last_seen'] = max(group['last_seen'], timestamp)
+
+    events = sorted(groups.values(), key=lambda group: group['first_seen'])
+    summary = ', '.join(
+        f"{event['count']}x {event['current_ip']} in {event['matched_range']}" + (f" [{event['target']}]" if event['target'] else '')
+        for event in events
+    )
+    latest = payloads[-1]
+
+    return {
+        "message": f"VPN ALERT: {len(payloads)} alerts ({summary}). VPN may be disabled - you are not protected!",
+        "current_ip": latest.get('current_ip'),
+        "matched_range": latest.get('matched_range'),
+        "timestamp": latest.get('timestamp'),
+        "alert_type": "vpn_disabled_batch",
+        "event_count": len(payloads),
+        "first_seen": events[0]['first_seen'],
+        "last_seen": max(event['last_seen'] for event in events),
+        "events": events,
+        "monitor_stats": latest.get('monitor_stats')
+    }
+
+class OutboxWorker:
+    """Background thread that drains the outbox; before_drain() runs first each time (e.g. to reload config).
+
+    Only the worker holding the outbox's worker lock polls; in the other
+    processes (web workers next to the scheduler, say) the thread stands by
+    and takes over when that process exits.
+    """
+
+    def __init__(self, outbox, deliver, get_max_age, on_delivered=None, get_window=None, before_drain=None):
+        self.outbox = outbox
+        self.deliver = deliver
+        self.get_max_age = get_max_age
+        self.on_delivered = on_delivered
+        self.get_window = get_window or (lambda: 0)
+        self.before_drain = before_drain
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.active = False
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='outbox-worker', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def wake(self):
+        """Deliver newly queued entries now instead of at the next poll"""
+        self.wake_event.set()
+
+    def run(self):
+        while not self.outbox.worker_lock.acquire(blocking=False):
+            if self.stop_event.wait(STANDBY_INTERVAL):
+                return
+        self.active = True
+        try:
+            self.loop()
+        finally:
+            self.active = False
+            self.outbox.worker_lock.release()
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.before_drain:
+                    self.before_drain()
+                window = self.get_window()
+                self.outbox.drain(self.deliver, self.get_max_age(), self.on_delivered, window)
+                next_due = self.outbox.next_due(window)
+            except Exception as e:
+                self.outbox.logger.error(f"Outbox worker error: {e}")
+                next_due = None
+
+            wait = POLL_INTERVAL if next_due is None else min(POLL_INTERVAL, max(0, next_due - time.time()))
+            self.wake_event.wait(wait)
+            self.wake_event.clear()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+# Weight of the newest sample in the latency and success averages
+EWMA_ALPHA = 0.3
+
+# Consecutive failures that open a provider's circuit
+FAILURE_THRESHOLD = 3
+
+# An open circuit is probed again after this long, doubling with every failed probe
+OPEN_BASE = 60
+OPEN_MAX = 3600
+
+# Floor of the success average when turning latency into expected latency
+MIN_SUCCESS = 0.1
+
+class ProviderHealth:
+    """Per-provider success rate, latency average and circuit breaker, kept in the monitor state.
+
+    Providers are tried in order of expected latency: the average latency of
+    successful answers divided by the recent success rate, so a provider that
+    often fails sinks even when its answers are fast. After FAILURE_THRESHOLD
+    failures in a row a provider's circuit opens and lookups skip it. Once the
+    open period has passed one background probe is sent (half-open); success
+    closes the circuit, failure opens it again for twice as long. A one-shot
+    check waits for its probes with join_probes() before it exits.
+
+    Health is stored under 'providers' in the state journal, so the scheduler,
+    web workers and one-shot checks learn from each other's lookups.
+    """
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.lock = threading.Lock()
+        # service -> thread of its running probe
+        self.probing = {}
+
+    def get(self, service):
+        return self.monitor.state.get('providers', {}).get(service, {})
+
+    def circuit(self, health, now=None):
+        """'closed', 'open' or 'half_open'"""
+        open_until = health.get('open_until')
+        if not open_until:
+            return 'closed'
+        return 'open' if (now or time.time()) < open_until else 'half_open'
+
+    def expected_latency(self, health):
+        """Expected milliseconds until an answer: 0 for providers never asked, so they get tried,
+        and None for providers that have never answered"""
+        latency = health.get('latency_ewma_ms')
+        if latency is None:
+            return None if health.get('failures') else 0.0
+        return latency / max(health.get('success_ewma', 1.0), MIN_SUCCESS)
+
+    def order(self, services):
+        """Services worth asking now, fastest expected first, and the ones due for a probe"""
+        now = time.time()
+        available, half_open = [], []
+        with self.monitor.state_lock:
+            for index, service in enumerate(services):
+                health = self.get(service)
+                circuit = self.circuit(health, now)
+                if circuit == 'closed':
+                    expected = self.expected_latency(health)
+                    available.append((float('inf') if expected is None else expected, index, service))
+                elif circuit == 'half_open':
+                    half_open.append(service)
+        return [service for _, _, service in sorted(available)], half_open
+
+    def record(self, service, status, latency_ms, error=None):
+        """Update a provider's averages and circuit with the result of one query"""
+        if status not in ('ok', 'error', 'invalid'):
+            return
+        now = time.time()
+        store = self.monitor.state_store
+
+        with self.monitor.state_lock:
+            # Copy: the journal operations below update the stored dict in place
+            health = dict(self.get(service))
+            circuit = self.circuit(health, now)
+            success = status == 'ok'
+            store.set(['providers', service, 'success_ewma'], ewma(health.get('success_ewma'), 1.0 if success else 0.0))
+            store.set(['providers', service, 'last_checked'], now)
+
+            if success:
+                store.increment(['providers', service, 'successes'])
+                store.set(['providers', service, 'latency_ewma_ms'], round(ewma(health.get('latency_ewma_ms'), latency_ms), 1))
+                store.set(['providers', service, 'consecutive_failures'], 0)
+                if health.get('open_until'):
+                    self.monitor.logger.info(f"Provider {service} answered again; circuit closed")
+                    store.set(['providers', service, 'open_until'], None)
+                    store.set(['providers', service, 'trips'], 0)
+                return
+
+            store.increment(['providers', service, 'failures'])
+            store.increment(['providers', service, 'consecutive_failures'])
+            store.set(['providers', service, 'last_error'], error)
+            in_a_row = health.get('consecutive_failures', 0) + 1
+            if circuit == 'half_open' or (circuit == 'closed' and in_a_row >= FAILURE_THRESHOLD):
+                trips = health.get('trips', 0) + 1
+                cooldown = open_period(trips)
+                store.set(['providers', service, 'trips'], trips)
+                store.set(['providers', service, 'open_until'], now + cooldown)
+                self.monitor.logger.warning(f"Provider {service} failed {in_a_row} times in a row; skipping it for {cooldown}s")
+
+    def probe(self, services):
+        """Query half-open providers in the background; never delays the check"""
+        for service in services:
+            thread = threading.Thread(target=self._probe, args=(service,), daemon=True, name=f"ip-probe-{service}")
+            with self.lock:
+                if service in self.probing:
+                    continue
+                self.probing[service] = thread
+            with self.monitor.state_lock:
+                # Claim the probe for another open period, so other processes don't probe at once
+                cooldown = open_period(self.get(service).get('trips', 1))
+                self.monitor.state_store.set(['providers', service, 'open_until'], time.time() + cooldown)
+            thread.start()
+
+    def join_probes(self, timeout=None):
+        """Wait up to timeout seconds for running probes to finish.
+
+        A process that exits right after its check (cron one-shot runs) must
+        call this: its probe threads would die with it, leaving each claimed
+        circuit open for another period without ever having been probed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            threads = list(self.probing.values())
+        for thread in threads:
+            if thread.is_alive():
+                thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def _probe(self, service):
+        try:
+            ip, status, latency_ms, error = self.monitor._query_service(service)
+            # A probe only decides the circuit; an earlier open period no longer applies
+            with self.monitor.state_lock:
+                self.monitor.state_store.set(['providers', service, 'open_until'], time.time() - 1)
+                self.record(service, status, latency_ms, error)
+            self.monitor.save_state()
+        except Exception as e:
+            self.monitor.logger.error(f"Probe of {service} failed: {e}")
+        finally:
+            with self.lock:
+                self.probing.pop(service, None)
+
+    def get_scores(self, services):
+        """Health of every provider, in the order the next lookup would try them"""
+        ordered, _ = self.order(services)
+        now = time.time()
+        scores = []
+        with self.monitor.state_lock:
+            for service in ordered + [s for s in services if s not in ordered]:
+                health = self.get(service)
+                successes, failures = health.get('successes', 0), health.get('failures', 0)
+                circuit = self.circuit(health, now)
+                expected = self.expected_latency(health)
+                scores.append({
+                    'provider': service,
+                    'circuit': circuit,
+                    'expected_latency_ms': round(expected, 1) if circuit == 'closed' and expected is not None else None,
+                    'latency_ewma_ms': health.get('latency_ewma_ms'),
+                    'success_rate': round(successes / (successes + failures), 3) if successes + failures else None,
+                    'recent_success': round(health['success_ewma'], 3) if 'success_ewma' in health else None,
+                    'successes': successes,
+                    'failures': failures,
+                    'consecutive_failures': health.get('consecutive_failures', 0),
+                    'retry_at': health.get('open_until') if circuit != 'closed' else None,
+                    'last_error': health.get('last_error')
+                })
+        return scores
+
+def open_period(trips):
+    """Seconds a circuit stays open after its trips-th consecutive opening"""
+    return min(OPEN_MAX, OPEN_BASE * 2 ** max(0, trips - 1))
+
+def ewma(previous, sample):
+    return sample if previous is None else previous + EWMA_ALPHA * (sample - previous)
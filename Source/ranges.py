@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import bisect
+import gzip
+import hashlib
+import ipaddress
+import logging
+import mmap
+import os
+import socket
+import struct
+from array import array
+
+# Compiled index file layout: header, IPv4 starts/ends/labels as native uint32
+# arrays, IPv6 starts/ends as 16-byte big-endian integers plus uint32 labels,
+# then label offsets (uint32) and the UTF-8 label blob
+INDEX_MAGIC = b'IPRIDX01'
+BYTE_ORDER_MARK = 0x01020304
+HEADER = struct.Struct('<8sI32sIIIII')
+
+class RangeIndex:
+    """Compiled lookup index over protected CIDR ranges.
+
+    Ranges are flattened into sorted, non-overlapping integer intervals per
+    address family. Each interval remembers the most specific CIDR covering
+    it, so a single bisection answers both "is this IP protected" and "which
+    range matched" (longest-prefix match).
+    """
+
+    def __init__(self, families=None, labels=None, buffer=None):
+        # family -> (starts, ends, label_ids), all sorted by start
+        self.families = families or {4: ([], [], []), 6: ([], [], [])}
+        self.labels = labels or []
+        # Backing mmap when loaded from a compiled file
+        self._buffer = buffer
+
+    @classmethod
+    def from_cidrs(cls, cidrs, logger=None):
+        """Compile an iterable of CIDR strings into an index"""
+        logger = logger or logging.getLogger(__name__)
+        labels = []
+        networks = {4: {}, 6: {}}
+
+        for cidr in cidrs:
+            cidr = cidr.strip()
+            if not cidr:
+                continue
+            try:
+                version, start, end, prefixlen = parse_cidr(cidr)
+            except (ValueError, OSError) as e:
+                logger.error(f"Invalid CIDR range {cidr}: {e}")
+                continue
+
+            key = (start, prefixlen)
+            if key not in networks[version]:
+                networks[version][key] = (end, len(labels))
+                labels.append(cidr)
+
+        families = {
+            version: flatten_networks((start, prefixlen, end, label) for (start, prefixlen), (end, label) in found.items())
+            for version, found in networks.items()
+        }
+        return cls(families, labels)
+
+    def lookup(self, ip):
+        """Return the most specific range containing ip, or None"""
+        if isinstance(ip, str):
+            ip = ipaddress.ip_address(ip)
+
+        starts, ends, label_ids = self.families[ip.version]
+        value = int(ip)
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return self.labels[label_ids[i]]
+        return None
+
+    def __len__(self):
+        """Number of intervals in the index"""
+        return sum(len(starts) for starts, _, _ in self.families.values())
+
+    def covers_family(self, version):
+        """Whether any range of address family version (4 or 6) is indexed"""
+        return len(self.families[version][0]) > 0
+
+    def save(self, path, fingerprint):
+        """Write the index to path in the compiled binary format"""
+        v4_starts, v4_ends, v4_labels = self.families[4]
+        v6_starts, v6_ends, v6_labels = self.families[6]
+        encoded = [label.encode('utf-8') for label in self.labels]
+        offsets = array('I', [0])
+        for label in encoded:
+            offsets.append(offsets[-1] + len(label))
+        blob = b''.join(encoded)
+
+        header = HEADER.pack(
+            INDEX_MAGIC, BYTE_ORDER_MARK, bytes.fromhex(fingerprint),
+            len(v4_starts), len(v6_starts), len(encoded), len(blob), 0
+        )
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            for values in (v4_starts, v4_ends, v4_labels):
+                f.write(array('I', values).tobytes())
+            f.write(b''.join(value.to_bytes(16, 'big') for value in v6_starts))
+            f.write(b''.join(value.to_bytes(16, 'big') for value in v6_ends))
+            f.write(array('I', v6_labels).tobytes())
+            f.write(offsets.tobytes())
+            f.write(blob)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """Memory-map a compiled index; returns None if missing, stale or unreadable"""
+        try:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if len(buffer) < HEADER.size:
+            return None
+
+        magic, bom, stored_fingerprint, n4, n6, nlabels, blob_len, _ = HEADER.unpack_from(buffer)
+        if magic != INDEX_MAGIC or bom != BYTE_ORDER_MARK:
+            return None
+        if fingerprint is not None and stored_fingerprint != bytes.fromhex(fingerprint):
+            return None
+
+        view = memoryview(buffer)
+        sections = {}
+        offset = HEADER.size
+        for name, size in (('v4_starts', n4 * 4), ('v4_ends', n4 * 4), ('v4_labels', n4 * 4),
+                           ('v6_starts', n6 * 16), ('v6_ends', n6 * 16), ('v6_labels', n6 * 4),
+                           ('offsets', (nlabels + 1) * 4), ('blob', blob_len)):
+            sections[name] = view[offset:offset + size]
+            offset += size
+
+        if offset != len(buffer):
+            return None
+
+        families = {
+            4: (sections['v4_starts'].cast('I'), sections['v4_ends'].cast('I'), sections['v4_labels'].cast('I')),
+            6: (WideIntView(sections['v6_starts']), WideIntView(sections['v6_ends']), sections['v6_labels'].cast('I'))
+        }
+        labels = LabelView(sections['offsets'].cast('I'), sections['blob'])
+        return cls(families, labels, buffer)
+
+class WideIntView:
+    """Read-only sequence of 128-bit big-endian integers stored in a buffer"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer) // 16
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return int.from_bytes(self.buffer[i * 16:(i + 1) * 16], 'big')
+
+class LabelView:
+    """Read-only sequence of strings decoded on access from an offsets array and a UTF-8 blob"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+def parse_cidr(text):
+    """Parse a CIDR string into (version, start, end, prefixlen); host bits are masked off"""
+    address, _, prefix = text.partition('/')
+    if ':' in address:
+        version, bits = 6, 128
+        packed = socket.inet_pton(socket.AF_INET6, address)
+    else:
+        version, bits = 4, 32
+        packed = socket.inet_pton(socket.AF_INET, address)
+
+    prefixlen = int(prefix) if prefix else bits
+    if not 0 <= prefixlen <= bits:
+        raise ValueError(f"Invalid prefix length /{prefixlen}")
+
+    host_bits = bits - prefixlen
+    start = (int.from_bytes(packed, 'big') >> host_bits) << host_bits
+    return version, start, start | ((1 << host_bits) - 1), prefixlen
+
+def read_range_file(path):
+    """Yield CIDR strings from a plain or gzipped file with one prefix per line"""
+    with open(path, 'rb') as f:
+        gzipped = f.read(2) == b'\x1f\x8b'
+
+    opener = gzip.open if gzipped else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield line
+
+def range_fingerprint(inline_ranges, range_files):
+    """Fingerprint the range sources from their text and file metadata, without reading the files"""
+    digest = hashlib.sha256(inline_ranges.encode('utf-8'))
+    for path in range_files:
+        try:
+            st = os.stat(path)
+            digest.update(f"\0{path}\0{st.st_mtime_ns}\0{st.st_size}".encode('utf-8'))
+        except OSError:
+            digest.update(f"\0{path}\0missing".encode('utf-8'))
+    return digest.hexdigest()
+
+def load_range_index(inline_ranges, range_files, index_file, logger=None, fingerprint=None):
+    """Memory-map the compiled index for these sources, compiling it first if it is missing or stale"""
+    logger = logger or logging.getLogger(__name__)
+    fingerprint = fingerprint or range_fingerprint(inline_ranges, range_files)
+
+    index = RangeIndex.load(index_file, fingerprint)
+    if index is not None:
+        return index
+
+    logger.info(f"Compiling protected ranges from {len(range_files)} file(s) into {index_file}")
+
+    def sources():
+        yield from inline_ranges.split(',')
+        for path in range_files:
+            try:
+                yield from read_range_file(path)
+            except OSError as e:
+                logger.error(f"Could not read range file {path}: {e}")
+
+    compiled = RangeIndex.from_cidrs(sources(), logger)
+    try:
+        compiled.save(index_file, fingerprint)
+    except OSError as e:
+        logger.error(f"Could not write compiled range index: {e}")
+        return compiled
+
+    return RangeIndex.load(index_file, fingerprint) or compiled
+
+def flatten_networks(networks):
+    """Turn (start, prefixlen, end, label) networks into disjoint (starts, ends, labels) intervals.
+
+    CIDR blocks never partially overlap, so sorting outer blocks before the
+    blocks they contain lets a stack sweep emit each stretch of address space
+    labelled with the innermost block that covers it.
+    """
+    starts, ends, label_ids = [], [], []
+
+    def emit(start, end, label):
+        if start > end:
+            return
+        # Merge with the previous interval when it continues the same range
+        if starts and ends[-1] + 1 == start and label_ids[-1] == label:
+            ends[-1] = end
+            return
+        starts.append(start)
+        ends.append(end)
+        label_ids.append(label)
+
+    stack = []
+    cursor = 0
+    for start, _, end, label in sorted(networks):
+        # Close every open block that ends before this one starts
+        while stack and stack[-1][0] < start:
+            open_end, open_label = stack.pop()
+            emit(cursor, open_end, open_label)
+            cursor = open_end + 1
+
+        # Part of the enclosing block that precedes this nested one
+        if stack:
+            emit(cursor, start - 1, stack[-1][1])
+
+        cursor = start
+        stack.append((end, label))
+
+    while stack:
+        open_end, open_label = stack.pop()
+        emit(cursor, open_end, open_label)
+        cursor = open_end + 1
+
+    return starts, ends, label_ids
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import ipaddress
+import os
+import socket
+import struct
+import time
+from urllib.parse import parse_qs, urlsplit
+
+# Record types a "whoami" name can answer with
+RECORD_TYPES = {'A': 1, 'TXT': 16, 'AAAA': 28}
+
+# Large enough for any answer to a single-question query (EDNS is not used)
+MAX_RESPONSE = 4096
+
+class DNSError(Exception):
+    pass
+
+def parse_dns_provider(spec):
+    """Split dns://resolver[:port]/name[?type=A|AAAA|TXT] into (host, port, name, record type)"""
+    parts = urlsplit(spec)
+    name = parts.path.strip('/')
+    record_type = parse_qs(parts.query).get('type', ['A'])[0].upper()
+    if parts.scheme != 'dns' or not parts.hostname or not name:
+        raise ValueError(f"DNS provider must look like dns://resolver/name: {spec}")
+    if record_type not in RECORD_TYPES:
+        raise ValueError(f"DNS provider record type must be one of {', '.join(RECORD_TYPES)}: {spec}")
+    return parts.hostname, parts.port or 53, name, record_type
+
+def build_query(query_id, name, record_type):
+    """Wire format of a recursive single-question query"""
+    header = struct.pack('>HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
+    question = b''.join(bytes([len(label)]) + label.encode('ascii') for label in name.split('.') if label)
+    return header + question + b'\x00' + struct.pack('>HH', RECORD_TYPES[record_type], 1)
+
+def skip_name(message, offset):
+    """Offset just past a (possibly compressed) name"""
+    while True:
+        if offset >= len(message):
+            raise DNSError("Truncated name")
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += length + 1
+
+def parse_response(message, query_id, record_type):
+    """Address or TXT strings of the answers to our question"""
+    if len(message) < 12:
+        raise DNSError("Short response")
+    response_id, flags, questions, answers = struct.unpack('>HHHH', message[:8])
+    if response_id != query_id:
+        raise DNSError("Response ID does not match the query")
+    if flags & 0x0200:
+        raise DNSError("Truncated response")
+    if flags & 0x000F:
+        raise DNSError(f"Resolver answered with rcode {flags & 0x000F}")
+
+    offset = 12
+    for _ in range(questions):
+        offset = skip_name(message, offset) + 4
+
+    wanted = RECORD_TYPES[record_type]
+    values = []
+    for _ in range(answers):
+        offset = skip_name(message, offset)
+        rtype, _, _, length = struct.unpack('>HHIH', message[offset:offset + 10])
+        offset += 10
+        data = message[offset:offset + length]
+        offset += length
+        if rtype != wanted:
+            continue
+        if rtype == RECORD_TYPES['TXT']:
+            # One or more length-prefixed character strings
+            i = 0
+            while i < len(data):
+                values.append(data[i + 1:i + 1 + data[i]].decode('ascii', errors='replace'))
+                i += 1 + data[i]
+        else:
+            values.append(str(ipaddress.ip_address(data)))
+    return values
+
+def lookup(spec, timeout, family=None):
+    """Ask a DNS provider for our public IP; returns the first answer that is an IP address, or None.
+
+    One UDP round trip to the resolver, instead of a TCP and TLS handshake
+    for an HTTPS echo service. A family (4 or 6) sends the query over that
+    address family. Raises DNSError or OSError on failure.
+    """
+    host, port, name, record_type = parse_dns_provider(spec)
+    address_family = {4: socket.AF_INET, 6: socket.AF_INET6}.get(family, 0)
+    sock_family, _, _, _, address = socket.getaddrinfo(host, port, address_family, socket.SOCK_DGRAM)[0]
+    query_id = struct.unpack('>H', os.urandom(2))[0]
+    deadline = time.monotonic() + timeout
+
+    with socket.socket(sock_family, socket.SOCK_DGRAM) as sock:
+        sock.connect(address)
+        sock.send(build_query(query_id, name, record_type))
+        while True:
+            sock.settimeout(max(0.001, deadline - time.monotonic()))
+            try:
+                message = sock.recv(MAX_RESPONSE)
+            except socket.timeout:
+                raise DNSError(f"No answer from {host} within {timeout}s") from None
+            # Ignore stray datagrams, e.g. late answers to an earlier query
+            if len(message) >= 2 and struct.unpack('>H', message[:2])[0] == query_id:
+                break
+
+    try:
+        values = parse_response(message, query_id, record_type)
+    except (struct.error, ValueError) as e:
+        raise DNSError(f"Malformed response from {host}: {e}") from None
+
+    for value in values:
+        try:
+            return str(ipaddress.ip_address(value.strip()))
+        except ValueError:
+            continue
+    return None
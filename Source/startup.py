@@ -3,11 +3,12 @@
 import os
 import sys
 import time
+import random
 import signal
 import subprocess
 import logging
 from datetime import datetime
-from threading import Thread
+from threading import Thread, Event
 import multiprocessing
 
 # Setup logging
@@ -19,11 +20,160 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Production web server defaults (gunicorn); each can be overridden with the env var of the same name
+WEB_DEFAULTS = {
+    'WEB_WORKERS': 2,
+    'WEB_THREADS': 8,
+    'WEB_TIMEOUT': 30,
+    'WEB_GRACEFUL_TIMEOUT': 10,
+    'WEB_MAX_REQUESTS': 1000,
+    'WEB_MAX_REQUESTS_JITTER': 100
+}
+
+# Longest single sleep, so wall-clock jumps (e.g. host suspend) are noticed quickly
+MAX_SLEEP = 30
+
+def get_scheduler_mode():
+    """SCHEDULER ('internal' or 'cron'); cron when only CRON_SCHEDULE is set, so a cron setup keeps its schedule
+    
+    An explicit SCHEDULER=internal next to CRON_SCHEDULE is refused rather than
+    silently checking every CHECK_INTERVAL instead of on the cron schedule.
+    """
+    mode = os.getenv('SCHEDULER', '').strip().lower()
+    cron_schedule = os.getenv('CRON_SCHEDULE', '').strip()
+    if not mode:
+        return 'cron' if cron_schedule else 'internal'
+    if mode not in ('internal', 'cron'):
+        raise ValueError(f"SCHEDULER must be 'internal' or 'cron', not '{mode}'")
+    if mode == 'internal' and cron_schedule:
+        raise ValueError("CRON_SCHEDULE is only used with SCHEDULER=cron; unset SCHEDULER (or set it to cron) "
+                         "to keep the cron schedule, or remove CRON_SCHEDULE and use CHECK_INTERVAL")
+    return mode
+
+class CheckScheduler:
+    """Runs IP checks on one long-lived IPMonitor at CHECK_INTERVAL"""
+    
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.monitor = None
+        self.engine = None
+        self.thread = None
+        self.stop_event = Event()
+        self.last_slot = None
+        self.next_slot = None
+        self.next_run = None
+    
+    def start(self):
+        """Create the monitor and start the scheduling thread"""
+        from monitor import IPMonitor
+        from engine import MonitoringEngine
+        import metrics
+        
+        metrics.registry.set_role('scheduler')
+        if self.monitor is None:
+            self.monitor = IPMonitor()
+            self.engine = MonitoringEngine(self.monitor)
+        
+        # Alerts are only queued by checks; this worker delivers them
+        self.monitor.start_outbox_worker()
+        
+        self.stop_event.clear()
+        self.thread = Thread(target=self.loop, name='check-scheduler', daemon=True)
+        self.thread.start()
+        logger.info(f"Check scheduler started (interval: {self.monitor.config.CHECK_INTERVAL})")
+    
+    def stop(self, timeout=10):
+        """Stop scheduling and wait for a running check to finish"""
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout)
+        if self.monitor:
+            self.monitor.close()
+    
+    def is_alive(self):
+        """Check if the scheduling thread is running"""
+        return self.thread is not None and self.thread.is_alive()
+    
+    def refresh_config(self):
+        """Pick up config.json changes without rebuilding the monitor"""
+        if not self.monitor.reload_config():
+            return False
+        
+        logger.info(f"Configuration changed, check interval is now {self.monitor.config.CHECK_INTERVAL}")
+        return True
+    
+    def get_interval(self):
+        """Get check interval in seconds"""
+        return max(1, self.monitor.parse_time_string(self.monitor.config.CHECK_INTERVAL))
+    
+    def get_jitter(self, interval):
+        """Random delay of up to CHECK_JITTER, capped at 10% of the interval"""
+        max_jitter = min(self.monitor.parse_time_string(self.monitor.config.CHECK_JITTER), interval * 0.1)
+        return random.uniform(0, max_jitter)
+    
+    def run_check(self):
+        """Run a single check unless one is already in progress in any process"""
+        check_lock = self.monitor.try_check_lock()
+        if check_lock is None:
+            logger.warning("Another check is still running, skipping this run")
+            return False
+        
+        try:
+            self.monitor.refresh_state()
+            success, _ = self.engine.run_cycle()
+            return success
+        except Exception as e:
+            logger.error(f"Scheduled check failed: {e}")
+            with open(self.log_file, 'a') as f:
+                f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Scheduled check failed: {e}\n")
+            return False
+        finally:
+            check_lock.release()
+    
+    def schedule_after(self, slot, interval):
+        """Plan the next run one interval after slot, skipping slots that are already in the past"""
+        now = time.time()
+        next_slot = slot + interval
+        if next_slot <= now:
+            next_slot = now + interval
+        self.next_slot = next_slot
+        self.next_run = next_slot + self.get_jitter(interval)
+    
+    def loop(self):
+        """Scheduling loop: run immediately, then every CHECK_INTERVAL"""
+        self.next_slot = self.next_run = time.time()
+        
+        while not self.stop_event.is_set():
+            if self.refresh_config() and self.last_slot is not None:
+                # Re-plan from the last slot with the new interval
+                self.schedule_after(self.last_slot, self.get_interval())
+            
+            now = time.time()
+            if now < self.next_run:
+                self.stop_event.wait(min(self.next_run - now, MAX_SLEEP))
+                continue
+            
+            interval = self.get_interval()
+            missed = int((now - self.next_slot) // interval)
+            if missed:
+                # Suspended or stalled: run one catch-up check instead of replaying every missed slot
+                logger.warning(f"Missed {missed} scheduled check(s), running catch-up check now")
+            
+            self.last_slot = self.next_slot + missed * interval
+            self.run_check()
+            self.schedule_after(self.last_slot, interval)
+            logger.info(f"Next check at {datetime.fromtimestamp(self.next_run).strftime('%Y-%m-%d %H:%M:%S')}")
+
 class VPNMonitorContainer:
     def __init__(self):
-        self.log_file = '/var/log/vpn-monitor.log'
+        from config import log_path
+        
+        self.log_file = log_path('vpn-monitor.log')
         self.cron_process = None
         self.web_process = None
+        self.scheduler = None
+        self.scheduler_mode = None
+        self.web_server_mode = os.getenv('WEB_SERVER', 'gunicorn').lower()
         self.running = True
         
         # Setup signal handlers
@@ -36,7 +186,7 @@ class VPNMonitorContainer:
     def setup_logging(self):
         """Setup logging infrastructure"""
         try:
-            os.makedirs('/var/log', exist_ok=True)
+            os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
             
             # Create log file if it doesn't exist
             if not os.path.exists(self.log_file):
@@ -95,6 +245,23 @@ class VPNMonitorContainer:
                 f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Failed to setup cron: {e}\n")
             return False
     
+    def start_scheduler(self):
+        """Start the in-process check scheduler"""
+        try:
+            with open(self.log_file, 'a') as f:
+                f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] INFO: Starting internal check scheduler\n")
+            
+            if self.scheduler is None:
+                self.scheduler = CheckScheduler(self.log_file)
+            self.scheduler.start()
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to start scheduler: {e}")
+            with open(self.log_file, 'a') as f:
+                f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Failed to start scheduler: {e}\n")
+            return False
+    
     def run_initial_check(self):
         """Run initial IP check"""
         try:
@@ -115,19 +282,60 @@ class VPNMonitorContainer:
             with open(self.log_file, 'a') as f:
                 f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Initial check failed: {e}\n")
     
+    def get_web_setting(self, name):
+        """Integer web server setting from the environment, falling back to its default"""
+        try:
+            return int(os.getenv(name, WEB_DEFAULTS[name]))
+        except ValueError:
+            logger.warning(f"Invalid {name}, using default {WEB_DEFAULTS[name]}")
+            return WEB_DEFAULTS[name]
+    
+    def get_web_command(self, web_port):
+        """Command line for the web server: gunicorn in production, Flask's server with WEB_SERVER=flask"""
+        if self.web_server_mode == 'gunicorn':
+            try:
+                import gunicorn
+            except ImportError:
+                logger.warning("gunicorn is not installed; falling back to the Flask development server")
+            else:
+                # gthread workers: a slow handler or an open event stream only holds
+                # one thread; workers are recycled after max requests (with jitter
+                # so they don't all restart together) and given the graceful
+                # timeout to finish in-flight requests. --timeout is only the
+                # worker heartbeat: gthread workers never time out a single
+                # request, so IP lookups bound themselves with LOOKUP_TIMEOUT
+                return [
+                    sys.executable, '-m', 'gunicorn',
+                    '--bind', f"0.0.0.0:{web_port}",
+                    '--worker-class', 'gthread',
+                    '--workers', str(self.get_web_setting('WEB_WORKERS')),
+                    '--threads', str(self.get_web_setting('WEB_THREADS')),
+                    '--timeout', str(self.get_web_setting('WEB_TIMEOUT')),
+                    '--graceful-timeout', str(self.get_web_setting('WEB_GRACEFUL_TIMEOUT')),
+                    '--max-requests', str(self.get_web_setting('WEB_MAX_REQUESTS')),
+                    '--max-requests-jitter', str(self.get_web_setting('WEB_MAX_REQUESTS_JITTER')),
+                    '--error-logfile', '-',
+                    '--config', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'),
+                    '--chdir', os.path.dirname(os.path.abspath(__file__)),
+                    'app:app'
+                ]
+        
+        return [sys.executable, 'app.py']
+    
     def start_web_server(self):
         """Start the web server in a separate process"""
         try:
             web_port = int(os.getenv('WEB_PORT', 8080))
-            logger.info(f"Starting web server on port {web_port}")
+            command = self.get_web_command(web_port)
+            server = 'gunicorn' if 'gunicorn' in command else 'Flask development server'
+            logger.info(f"Starting web server ({server}) on port {web_port}")
             
             with open(self.log_file, 'a') as f:
-                f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] INFO: Starting web server on port {web_port}\n")
+                f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] INFO: Starting web server ({server}) on port {web_port}\n")
             
             # Start web server with proper output handling
-            self.web_process = subprocess.Popen([
-                sys.executable, 'app.py'
-            ], 
+            self.web_process = subprocess.Popen(
+            command,
             env=os.environ.copy(),
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
@@ -145,6 +353,8 @@ class VPNMonitorContainer:
             
             # Check if it's still running
             if self.web_process.poll() is None:
+                # Keep draining its output so a full pipe never blocks the server
+                Thread(target=self.forward_output, args=(self.web_process,), name='web-output', daemon=True).start()
                 return True
             else:
                 # Process died immediately, get the error
@@ -160,6 +370,15 @@ class VPNMonitorContainer:
                 f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Failed to start web server: {e}\n")
             return False
     
+    def forward_output(self, process):
+        """Copy the web server's output to our stdout (docker logs) until it exits"""
+        try:
+            for line in process.stdout:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+        except (OSError, ValueError):
+            pass
+    
     def signal_handler(self, signum, frame):
         """Handle shutdown signals"""
         logger.info(f"Received signal {signum}, shutting down...")
@@ -182,12 +401,19 @@ class VPNMonitorContainer:
             logger.info("Stopping web server...")
             self.web_process.terminate()
             try:
-                self.web_process.wait(timeout=5)
+                # gunicorn lets workers finish in-flight requests for the graceful timeout
+                self.web_process.wait(timeout=self.get_web_setting('WEB_GRACEFUL_TIMEOUT') + 5)
                 logger.info("Web server stopped")
             except subprocess.TimeoutExpired:
                 logger.warning("Web server didn't stop gracefully, killing...")
                 self.web_process.kill()
         
+        # Stop scheduler
+        if self.scheduler and self.scheduler.is_alive():
+            logger.info("Stopping check scheduler...")
+            self.scheduler.stop()
+            logger.info("Check scheduler stopped")
+        
         # Stop cron
         if self.cron_process and self.cron_process.poll() is None:
             logger.info("Stopping cron daemon...")
@@ -226,6 +452,13 @@ class VPNMonitorContainer:
                         f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Cron process died, restarting\n")
                     self.setup_cron()
                 
+                # Check scheduler thread
+                if self.scheduler and not self.scheduler.is_alive() and self.running:
+                    logger.error("Check scheduler stopped unexpectedly, restarting...")
+                    with open(self.log_file, 'a') as f:
+                        f.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ERROR: Check scheduler stopped, restarting\n")
+                    self.start_scheduler()
+                
                 # Check web process
                 if self.web_process and self.web_process.poll() is not None:
                     if restart_count < max_restarts:
@@ -264,13 +497,22 @@ class VPNMonitorContainer:
         logger.info("=" * 60)
         
         try:
-            # Setup cron
-            if not self.setup_cron():
-                logger.error("Failed to setup cron, exiting")
-                return 1
-            
-            # Run initial check
-            self.run_initial_check()
+            self.scheduler_mode = get_scheduler_mode()
+            logger.info(f"Scheduler: {self.scheduler_mode}")
+            
+            if self.scheduler_mode == 'cron':
+                # Legacy mode: crond spawns monitor.py for every check
+                if not self.setup_cron():
+                    logger.error("Failed to setup cron, exiting")
+                    return 1
+                
+                # Run initial check
+                self.run_initial_check()
+            else:
+                # Internal scheduler runs the initial check straight away
+                if not self.start_scheduler():
+                    logger.error("Failed to start scheduler, exiting")
+                    return 1
             
             # Start web server
             if not self.start_web_server():
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import copy
+import json
+import logging
+import os
+import threading
+
+from filelock import FileLock
+
+# Fold the journal into the snapshot once it holds this many records
+COMPACT_AFTER = 500
+
+class StateStore:
+    """Monitor state shared between processes as a snapshot plus an append-only journal.
+
+    The snapshot (the familiar monitor_state.json) is only ever replaced by
+    atomic rename. Changes are journaled as 'incr' and 'set' operations, so
+    counters bumped by several processes add up instead of the last full
+    rewrite winning. All file access happens under an flock; each process
+    keeps its own copy of the state and catches up by replaying only the
+    journal records it has not seen yet.
+    """
+
+    def __init__(self, path, defaults, lock=None, logger=None):
+        self.path = path
+        self.journal_path = f"{os.path.splitext(path)[0]}.journal"
+        self.defaults = defaults
+        self.lock = lock or threading.RLock()
+        self.logger = logger or logging.getLogger(__name__)
+        self.file_lock = FileLock(f"{path}.lock")
+        self.state = copy.deepcopy(defaults)
+        # Operations applied locally but not yet written to the journal
+        self.pending = []
+        # (dev, inode) of the journal we have replayed and how far
+        self._journal_key = None
+        self._journal_offset = 0
+        self._journal_records = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def version(self):
+        """Changes whenever any process writes state"""
+        try:
+            st = os.stat(self.journal_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def load(self):
+        """Read the snapshot and replay the whole journal"""
+        with self.lock, self.file_lock:
+            self._reload()
+
+    def _reload(self):
+        state = copy.deepcopy(self.defaults)
+        try:
+            with open(self.path, 'r') as f:
+                state.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            self.logger.warning(f"Could not load state snapshot: {e}")
+
+        self.state.clear()
+        self.state.update(state)
+        # Make sure there is a journal to pin down, so a compaction by
+        # another process is always noticed as a change of inode
+        open(self.journal_path, 'ab').close()
+        self._journal_key = None
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._catch_up()
+
+        # Local changes not yet journaled still apply on top
+        for op in self.pending:
+            apply_op(self.state, op)
+
+    def _catch_up(self):
+        """Apply journal records written since our offset; caller holds both locks"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                key = (st.st_dev, st.st_ino)
+                if self._journal_key is not None and key != self._journal_key:
+                    # Compacted by another process: the snapshot now holds what we replayed
+                    self._reload()
+                    return True
+                self._journal_key = key
+                f.seek(self._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return False
+
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                op = json.loads(line)
+            except ValueError:
+                # Torn write from a crash; later records are still valid
+                continue
+            apply_op(self.state, op)
+            self._journal_records += 1
+        self._journal_offset += end
+        return end > 0
+
+    def refresh(self):
+        """Pick up changes written by other processes; returns True if any were applied"""
+        try:
+            st = os.stat(self.journal_path)
+        except OSError:
+            return False
+        if (st.st_dev, st.st_ino) == self._journal_key and st.st_size == self._journal_offset:
+            return False
+
+        with self.lock, self.file_lock:
+            return self._catch_up()
+
+    def increment(self, path, by=1):
+        self._record({'op': 'incr', 'path': path, 'value': by})
+
+    def set(self, path, value):
+        self._record({'op': 'set', 'path': path, 'value': value})
+
+    def _record(self, op):
+        with self.lock:
+            apply_op(self.state, op)
+            self.pending.append(op)
+
+    def flush(self):
+        """Append pending operations to the journal, compacting it when it has grown large"""
+        with self.lock:
+            if not self.pending:
+                return
+            with self.file_lock:
+                self._catch_up()
+                data = ''.join(json.dumps(op, default=str) + '\n' for op in self.pending)
+
+                with open(self.journal_path, 'ab') as f:
+                    # Never glue a record onto a line torn by a crash
+                    if f.tell() > 0:
+                        with open(self.journal_path, 'rb') as tail:
+                            tail.seek(-1, os.SEEK_END)
+                            if tail.read(1) != b'\n':
+                                data = '\n' + data
+                    f.write(data.encode('utf-8'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    st = os.fstat(f.fileno())
+
+                self._journal_key = (st.st_dev, st.st_ino)
+                self._journal_offset = st.st_size
+                self._journal_records += len(self.pending)
+                self.pending = []
+
+                if self._journal_records >= COMPACT_AFTER:
+                    self.compact()
+
+    def compact(self):
+        """Write the full state as a new snapshot and start an empty journal; caller holds both locks"""
+        self._catch_up()
+        self.write_atomic(self.path, json.dumps(self.state, indent=2, default=str))
+        self.write_atomic(self.journal_path, '')
+
+        st = os.stat(self.journal_path)
+        self._journal_key = (st.st_dev, st.st_ino)
+        self._journal_offset = 0
+        self._journal_records = 0
+
+    def write_atomic(self, path, content):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+def apply_op(state, op):
+    """Apply one journal operation to a state dict, creating intermediate dicts as needed"""
+    *parents, key = op['path']
+    node = state
+    for name in parents:
+        child = node.get(name)
+        if not isinstance(child, dict):
+            child = node[name] = {}
+        node = child
+
+    if op['op'] == 'incr':
+        node[key] = (node.get(key) or 0) + op['value']
+    elif op['op'] == 'set':
+        node[key] = op['value']
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from config import Config
+from testing import make_monitor
+from benchmarks.stubs import StubIPServer
+
+def test_config_reload_swaps_ranges_in_place():
+    """A changed config.json is swapped in without rebuilding the monitor; an invalid one is ignored"""
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer() as echo:
+        ip_monitor = make_monitor(tmp, echo, [])
+        ip_monitor.config = Config(os.path.join(tmp, 'config.json'))
+        ip_monitor.config.write_file({'safe_ip_range': '192.168.1.0/24', 'webhook_url': echo.url})
+        assert ip_monitor.reload_config()
+        assert not ip_monitor.reload_config()
+        
+        handlers = list(ip_monitor.logger.handlers)
+        session = ip_monitor.get_session()
+        assert ip_monitor.is_ip_safe('10.0.0.1') == (True, None)
+        
+        ip_monitor.config.save_config({'safe_ip_range': '10.0.0.0/8', 'alert_cooldown': '5m'})
+        assert ip_monitor.reload_config()
+        assert ip_monitor.config.version == 3
+        assert ip_monitor.is_ip_safe('10.0.0.1') == (False, '10.0.0.0/8')
+        assert ip_monitor.parse_time_string(ip_monitor.config.ALERT_COOLDOWN) == 300
+        assert ip_monitor.get_session() is session
+        assert ip_monitor.logger.handlers == handlers
+        
+        with open(ip_monitor.config.config_file, 'w') as f:
+            f.write('{"safe_ip_range": "not-a-cidr"}')
+        assert not ip_monitor.reload_config()
+        assert ip_monitor.config.version == 3
+        assert ip_monitor.is_ip_safe('10.0.0.1') == (False, '10.0.0.0/8')
+
+def test_status_follows_a_range_change():
+    """Once the ranges change, no process serves a status evaluated against the old ones, however fresh"""
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer(ip='10.0.0.1') as echo:
+        settings = {'safe_ip_range': '192.168.1.0/24', 'ip_providers': [f"{echo.url}/ip"], 'status_cache_ttl': '5m'}
+        # Two web workers sharing the data directory
+        first, second = make_monitor(tmp), make_monitor(tmp)
+        first.config.write_file(settings)
+        assert first.reload_config() and second.reload_config()
+        
+        assert first.get_status()['status'] == 'Protected'
+        assert second.get_status()['status'] == 'Protected'
+        assert echo.requests == 1
+        
+        first.config.write_file(dict(settings, safe_ip_range='10.0.0.0/8'))
+        assert second.reload_config()
+        status = second.get_status()
+        assert status['status'] == 'Alert' and status['protected_range'] == '10.0.0.0/8'
+        assert echo.requests == 2
+        
+        # The other worker reloads too, and takes the new verdict from the shared observation
+        assert first.reload_config()
+        assert first.get_status()['protected_range'] == '10.0.0.0/8'
+        assert echo.requests == 2
+        first.close()
+        second.close()
+
+def test_coalesce_window_is_parsed_strictly():
+    """A zero window disables coalescing in any unit; a window that doesn't parse is rejected, not turned into an hour"""
+    with tempfile.TemporaryDirectory() as tmp:
+        config = Config(os.path.join(tmp, 'config.json'))
+        for value, seconds in (('0', 0), ('0s', 0), ('0m', 0), ('45', 45), ('30s', 30), ('2m', 120), ('1h30m', 5400)):
+            config.write_file({'alert_coalesce_window': value})
+            assert config.reload().get_coalesce_window() == seconds, value
+        
+        for value in ('soon', '5x', '1.5m'):
+            try:
+                config.write_file({'alert_coalesce_window': value})
+            except ValueError as e:
+                assert 'ALERT_COALESCE_WINDOW' in str(e)
+            else:
+                raise AssertionError(f"coalesce window {value!r} was accepted")
+
+if __name__ == "__main__":
+    test_config_reload_swaps_ranges_in_place()
+    test_status_follows_a_range_change()
+    test_coalesce_window_is_parsed_strictly()
+    print("Config tests passed")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import monitor
+from engine import MonitoringEngine
+from filelock import FileLock
+from startup import CheckScheduler, get_scheduler_mode
+from testing import make_monitor, run_tests, setup_function, teardown_function
+from benchmarks.stubs import StubIPServer
+
+def hold_lock(path, held, release):
+    with FileLock(path):
+        held.set()
+        release.wait(10)
+
+def test_proxy_and_source_address_targets():
+    """Each target is checked through its own egress path and keeps its own state"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubIPServer() as echo, \
+            StubIPServer(ip='10.8.0.5') as tunnel, \
+            StubIPServer(ip='192.168.1.20') as leaking:
+        monitor.IP_SERVICES[:] = [f"{echo.url}/ip"]
+        ip_monitor = make_monitor(tmp, echo, [
+            {'name': 'tunnel', 'proxy': tunnel.url},
+            {'name': 'leaking', 'proxy': leaking.url},
+            {'name': 'bound', 'source_address': '127.0.0.2', 'safe_ip_range': '127.0.0.2/32'}
+        ])
+        
+        success, results = MonitoringEngine(ip_monitor).run_cycle()
+        by_name = {result['name']: result for result in results}
+        
+        assert success
+        assert by_name['tunnel']['current_ip'] == '10.8.0.5'
+        assert by_name['tunnel']['status'] == 'Protected'
+        assert by_name['leaking']['current_ip'] == '192.168.1.20'
+        assert by_name['leaking']['protected_range'] == '192.168.1.0/24'
+        assert by_name['bound']['current_ip'] == '127.0.0.2'
+        assert by_name['bound']['status'] == 'Alert'
+        
+        ip_monitor.load_state()
+        assert ip_monitor.state['targets']['tunnel']['last_known_ip'] == '10.8.0.5'
+        assert ip_monitor.state['targets']['leaking']['last_status'] == 'Alert'
+        assert [t['name'] for t in ip_monitor.get_targets_status()] == ['bound', 'leaking', 'tunnel']
+        
+        now = time.time()
+        leaking_history = ip_monitor.history.query(now - 60, now + 60, 120, target='leaking')['points']
+        assert leaking_history[0]['alerts'] == 1 and leaking_history[0]['ip'] == '192.168.1.20'
+
+
+def test_many_targets_run_concurrently():
+    """Hundreds of slow targets finish in a fraction of their sequential time"""
+    count, latency = 200, 0.2
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubIPServer() as echo, \
+            StubIPServer(ip='10.8.0.5', latency=latency) as tunnel:
+        monitor.IP_SERVICES[:] = [f"{echo.url}/ip"]
+        ip_monitor = make_monitor(tmp, echo, [
+            {'name': f"tunnel-{i}", 'proxy': tunnel.url} for i in range(count)
+        ])
+        ip_monitor.config.TARGET_CONCURRENCY = 50
+        
+        start = time.monotonic()
+        _, results = MonitoringEngine(ip_monitor).run_cycle()
+        elapsed = time.monotonic() - start
+        
+        assert len(results) == count
+        assert all(result['status'] == 'Protected' for result in results)
+        assert elapsed < count * latency / 4, f"{count} targets took {elapsed:.1f}s"
+
+
+def test_checks_in_different_processes_do_not_overlap():
+    """A scheduled check is skipped while another process holds the check lock"""
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer() as echo:
+        monitor.IP_SERVICES[:] = [f"{echo.url}/ip"]
+        ip_monitor = make_monitor(tmp, echo, [])
+        scheduler = CheckScheduler(os.path.join(tmp, 'scheduler.log'))
+        scheduler.monitor = ip_monitor
+        scheduler.engine = MonitoringEngine(ip_monitor)
+        
+        held, release = multiprocessing.Event(), multiprocessing.Event()
+        holder = multiprocessing.Process(target=hold_lock, args=(ip_monitor.check_lock_file, held, release))
+        holder.start()
+        assert held.wait(10)
+        assert not scheduler.run_check()
+        assert ip_monitor.state['total_checks'] == 0
+        
+        release.set()
+        holder.join()
+        assert scheduler.run_check()
+        assert ip_monitor.state['total_checks'] == 1
+        # Released again once the check is done
+        lock = ip_monitor.try_check_lock()
+        assert lock is not None
+        lock.release()
+
+def test_cron_schedule_selects_the_cron_scheduler():
+    """A deployment that only sets CRON_SCHEDULE keeps its cron schedule; a conflicting SCHEDULER is refused"""
+    saved = {name: os.environ.pop(name, None) for name in ('SCHEDULER', 'CRON_SCHEDULE')}
+    try:
+        assert get_scheduler_mode() == 'internal'
+        os.environ['CRON_SCHEDULE'] = '*/30 * * * *'
+        assert get_scheduler_mode() == 'cron'
+        os.environ['SCHEDULER'] = 'Cron'
+        assert get_scheduler_mode() == 'cron'
+        
+        for mode in ('internal', 'crond'):
+            os.environ['SCHEDULER'] = mode
+            try:
+                get_scheduler_mode()
+            except ValueError as e:
+                assert 'SCHEDULER' in str(e)
+            else:
+                raise AssertionError(f"SCHEDULER={mode} with CRON_SCHEDULE was accepted")
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+if __name__ == "__main__":
+    run_tests([
+        test_proxy_and_source_address_targets, test_many_targets_run_concurrently,
+        test_checks_in_different_processes_do_not_overlap, test_cron_schedule_selects_the_cron_scheduler
+    ])
+    print("Success; All engine tests passed!")
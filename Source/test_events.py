@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import monitor
+from events import EventHub
+from testing import make_monitor
+
+def test_stream_pushes_checks_status_and_logs():
+    """A client gets a snapshot on connect, then each new check, status change and log line"""
+    with tempfile.TemporaryDirectory() as tmp:
+        ip_monitor = make_monitor(tmp)
+        # Lines the test writes itself, apart from the monitor's own log
+        log_file = os.path.join(tmp, 'events.log')
+        with open(log_file, 'w') as f:
+            f.write("[2025-01-09 14:30:22] INFO: Starting IP check...\n")
+        ip_monitor.history.append(time.time() - 5, 'protected', '8.8.8.8', None, 'https://a', 10.0)
+        
+        hub = EventHub(lambda: ip_monitor, log_file)
+        stream = hub.stream()
+        snapshot = [next(stream) for _ in range(3)]
+        assert [event.split('\n')[0] for event in snapshot] == ['event: status', 'event: config', 'event: log_tail']
+        assert '"current_ip": "8.8.8.8"' in snapshot[0]
+        
+        ip_monitor.history.append(time.time(), 'alert', '192.168.1.20', '192.168.1.0/24', 'https://a', 12.0)
+        with open(log_file, 'a') as f:
+            f.write("[2025-01-09 14:30:23] WARNING: VPN ALERT\n")
+        
+        pushed = [next(stream) for _ in range(3)]
+        assert [event.split('\n')[0] for event in pushed] == ['event: check', 'event: status', 'event: logs']
+        assert '"is_safe": false' in pushed[1] and 'VPN ALERT' in pushed[2]
+        
+        # A failed check replaces the last status instead of being skipped
+        ip_monitor.history.append(time.time(), 'error')
+        pushed = [next(stream) for _ in range(2)]
+        assert [event.split('\n')[0] for event in pushed] == ['event: check', 'event: status']
+        assert '"status": "Error"' in pushed[1] and '"is_safe": null' in pushed[1]
+        
+        ip_monitor.history.append(time.time(), 'inconclusive')
+        status = ip_monitor.get_last_status()
+        assert status['status'] == 'Inconclusive' and status['current_ip'] is None
+        assert status['error'] == monitor.CHECK_ERRORS['inconclusive']
+        
+        stream.close()
+        assert hub.subscriber_count() == 0
+
+if __name__ == '__main__':
+    test_stream_pushes_checks_status_and_logs()
+    print("Event tests passed")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import os
+import socket
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import history
+from history import HistoryStore, RECORD, SEGMENT_HEADER, SEGMENT_MAGIC, SEGMENT_SPAN
+
+def write_segment(store, start, points):
+    """Write (timestamp, outcome, ip) points straight into a segment file"""
+    with open(store.segment_path(start), 'wb') as f:
+        f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, start))
+        for timestamp, outcome, ip in points:
+            f.write(RECORD.pack(timestamp, outcome, 4, socket.inet_pton(socket.AF_INET, ip), 0, 0, 0, 10.0))
+
+def test_append_and_query_by_target():
+    """Points are bucketed per target and keep the last IP and matched range"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(tmp)
+        store.append(1000, 'protected', '8.8.8.8', None, 'https://a', 12.0)
+        store.append(1010, 'alert', '192.168.1.20', '192.168.1.0/24', 'https://a', 20.0)
+        store.append(1020, 'error')
+        store.append(1025, 'inconclusive')
+        store.append(1030, 'protected', '2001:db8::1', None, 'https://b', 5.0, target='office')
+        
+        points = store.query(960, 1080, 60)['points']
+        assert [(p['timestamp'], p['checks'], p['alerts'], p['errors'], p['inconclusive']) for p in points] == [(960, 2, 1, 0, 0), (1020, 2, 0, 1, 1)]
+        assert points[0]['ip'] == '192.168.1.20' and points[0]['protected_range'] == '192.168.1.0/24'
+        assert points[0]['latency_avg_ms'] == 16.0
+        
+        office = store.query(960, 1080, 60, target='office')['points']
+        assert [(p['checks'], p['ip']) for p in office] == [(1, '2001:db8::1')]
+        assert store.query(960, 1080, 60, target='missing')['points'] == []
+
+def test_rollups_match_raw_points():
+    """Long-range queries answered from rollups agree with aggregating every point"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = HistoryStore(tmp)
+        for day in range(3):
+            start = day * SEGMENT_SPAN
+            write_segment(store, start, [
+                (t, 1 if t % 3600 == 0 else 3 if t % 3600 == 1800 else 0, '8.8.8.8') for t in range(start, start + SEGMENT_SPAN, 30)
+            ])
+        
+        # A fresh store has an empty ring buffer for all but the last day
+        result = HistoryStore(tmp).query(0, 3 * SEGMENT_SPAN, 3600)
+        raw = history.aggregate(store.points_between(0, 3 * SEGMENT_SPAN), 3600)
+        
+        assert result['step'] == 3600 and len(result['points']) == 72
+        assert [(p['checks'], p['alerts'], p['inconclusive']) for p in result['points']] == \
+            [(bucket[0], bucket[2], bucket[4]) for _, bucket in sorted(raw.items())]
+        assert result['points'][0]['inconclusive'] == 1 and result['points'][0]['latency_avg_ms'] == 10.0
+        assert os.path.exists(os.path.join(tmp, 'seg-0.rollup'))
+
+if __name__ == '__main__':
+    test_append_and_query_by_target()
+    test_rollups_match_raw_points()
+    print("History tests passed")
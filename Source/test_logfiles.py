@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logfiles
+from logfiles import LogIndex, iter_recent_lines, query_tokens, read_recent_lines
+
+def write_log(path, first, last):
+    with open(path, 'w') as f:
+        for i in range(first, last):
+            f.write(f"[2025-01-09 14:30:22] INFO: line {i} {'x' * (i % 7)}\n")
+
+def test_reverse_read_spans_rotations():
+    """Recent lines continue from the live log into its backups, in file order"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'ip-monitor.log')
+        write_log(f"{log_file}.2", 0, 100)
+        write_log(f"{log_file}.1", 100, 250)
+        write_log(log_file, 250, 260)
+        
+        lines = read_recent_lines(log_file, 30)
+        assert [line.split()[4] for line in lines] == [str(i) for i in range(230, 260)]
+        
+        # Tiny blocks force lines to straddle block boundaries
+        newest_first = list(iter_recent_lines(log_file, block_size=7))
+        assert [int(line.split()[4]) for line in newest_first] == list(range(259, -1, -1))
+        
+        assert len(read_recent_lines(log_file, 1000)) == 260
+
+def test_rotation_during_read_is_not_duplicated():
+    """A backup that is the same file as the live log is only read once"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'ip-monitor.log')
+        write_log(log_file, 0, 5)
+        os.link(log_file, f"{log_file}.1")
+        
+        assert len(read_recent_lines(log_file, 100)) == 5
+
+def test_index_matches_plain_filter_across_rotation():
+    """Indexed queries return what a substring/level scan would, and follow appends and rotations"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'ip-monitor.log')
+        with open(log_file, 'w') as f:
+            for i in range(500):
+                level = 'WARNING' if i % 50 == 0 else 'INFO'
+                f.write(f"[2025-01-09 14:30:22] {level}: check {i} ip 10.8.0.{i % 256} via https://api.ipify.org\n")
+        
+        index = LogIndex(log_file)
+        assert len(index.query(level='warning', limit=100)) == 10
+        assert index.query('10.8.0.25 VIA', limit=100) == [line for line in read_recent_lines(log_file, 1000) if '10.8.0.25 via' in line.lower()]
+        assert index.query('check 49', 'INFO', limit=2) == [
+            "[2025-01-09 14:30:22] INFO: check 498 ip 10.8.0.242 via https://api.ipify.org",
+            "[2025-01-09 14:30:22] INFO: check 499 ip 10.8.0.243 via https://api.ipify.org"
+        ]
+        assert index.query(level='debug') == []
+        
+        # Rotate, then append to the new live file; only the new bytes are indexed
+        os.rename(log_file, f"{log_file}.1")
+        with open(log_file, 'w') as f:
+            f.write("[2025-01-10 09:00:00] ERROR: lookup failed\n")
+        assert index.query('failed', limit=10) == ["[2025-01-10 09:00:00] ERROR: lookup failed"]
+        assert len(index.query(level='WARNING', limit=100)) == 10
+        assert index.get_stats()['lines'] == 501
+
+class NoScan(dict):
+    """Postings that fail the test when the whole vocabulary is iterated"""
+
+    def __iter__(self):
+        raise AssertionError("vocabulary scanned")
+
+    def items(self):
+        raise AssertionError("vocabulary scanned")
+
+def test_query_tokens_are_looked_up_without_a_vocabulary_scan():
+    """Whole tokens are looked up exactly and partial ones by trigram, with substring results unchanged"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'ip-monitor.log')
+        with open(log_file, 'w') as f:
+            for i in range(300):
+                f.write(f"[2025-01-09 14:30:22] INFO: check {i} ip 10.8.0.{i % 256} via provider-{i % 7}.example errors={i % 3}\n")
+        
+        assert query_tokens('ip 10.8.0.2 via') == [('ip', False), ('10.8.0.2', True), ('via', False)]
+        assert query_tokens('x-ip') == [('x-ip', False)]
+        
+        index = LogIndex(log_file)
+        index.update()
+        for indexed in index.files.values():
+            indexed.postings = NoScan(indexed.postings)
+        
+        every_line = read_recent_lines(log_file, 1000)
+        for search in ('ip 10.8.0.2 via', 'vider-3.exam', 'rrors', 'check 12', ' provider-6.example '):
+            assert index.query(search, limit=1000) == [line for line in every_line if search in line.lower()], search
+        assert index.query(' ip 10.8.0.2 ', limit=1000) == [line for line in every_line if ' 10.8.0.2 ' in line]
+        
+        # Substrings shorter than a trigram still fall back to the scan
+        try:
+            index.query('e 1', limit=10)
+        except AssertionError:
+            pass
+        else:
+            assert False, "expected a vocabulary scan"
+
+def test_followers_load_the_shared_index_and_catch_up():
+    """A process that isn't indexing loads the saved snapshot and only indexes lines appended since"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'ip-monitor.log')
+        snapshot_dir = os.path.join(tmp, 'log-index')
+        with open(log_file, 'w') as f:
+            for i in range(500):
+                level = 'WARNING' if i % 50 == 0 else 'INFO'
+                f.write(f"[2025-01-09 14:30:22] {level}: check {i} ip 10.8.0.{i % 256} via https://api.ipify.org\n")
+        
+        leader = LogIndex(log_file, snapshot_dir=snapshot_dir)
+        leader.update()
+        leader.save()
+        
+        with open(log_file, 'a') as f:
+            for i in range(500, 510):
+                f.write(f"[2025-01-09 14:31:00] ERROR: check {i} failed via https://api.ipify.org\n")
+        
+        follower = LogIndex(log_file, snapshot_dir=snapshot_dir)
+        # Level codes are assigned per process, in the order levels are first seen
+        follower.level_codes['DEBUG'] = 1
+        indexed_lines = []
+        add_line = logfiles.IndexedFile.add_line
+        
+        def counting_add_line(self, offset, line, level_codes):
+            indexed_lines.append(line)
+            add_line(self, offset, line, level_codes)
+        
+        logfiles.IndexedFile.add_line = counting_add_line
+        try:
+            every_line = read_recent_lines(log_file, 1000)
+            assert follower.query('api.ipify', limit=1000) == [line for line in every_line if 'api.ipify' in line]
+            assert len(indexed_lines) == 10
+            assert len(follower.query(level='WARNING', limit=100)) == 10
+            assert len(follower.query(level='error', limit=100)) == 10
+            assert follower.query('10.8.0.25 via', 'INFO', limit=100) == [line for line in every_line if '10.8.0.25 via' in line]
+        finally:
+            logfiles.IndexedFile.add_line = add_line
+        
+        # A file that is no longer part of the chain loses its snapshot
+        os.remove(log_file)
+        with open(log_file, 'w') as f:
+            f.write("[2025-01-10 09:00:00] INFO: log file created\n")
+        leader.update()
+        leader.save()
+        assert len([entry for entry in os.listdir(snapshot_dir) if entry.endswith('.idx')]) == 1
+        assert follower.query('created', limit=10) == ["[2025-01-10 09:00:00] INFO: log file created"]
+
+if __name__ == '__main__':
+    test_reverse_read_spans_rotations()
+    test_rotation_during_read_is_not_duplicated()
+    test_index_matches_plain_filter_across_rotation()
+    test_query_tokens_are_looked_up_without_a_vocabulary_scan()
+    test_followers_load_the_shared_index_and_catch_up()
+    print("Log file tests passed")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from logqueue import BatchRotatingFileHandler, QueueLogHandler
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.handlers[:] = [handler]
+    return logger
+
+def read_lines(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+def test_records_are_written_in_batches_and_on_close():
+    """Records reach the file when a batch fills, after the flush interval, on flush() and on close()"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'monitor.log')
+        file_handler = BatchRotatingFileHandler(path, maxBytes=10*1024*1024, backupCount=1)
+        file_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        handler = QueueLogHandler([file_handler], batch_records=50, flush_interval=60)
+        logger = make_logger('test_logqueue.batches', handler)
+
+        for i in range(120):
+            logger.info("check %d", i)
+        deadline = time.monotonic() + 5
+        while len(read_lines(path)) < 100 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Two full batches are out; the rest waits for the interval
+        assert len(read_lines(path)) == 100
+
+        handler.flush()
+        assert read_lines(path)[-1] == "INFO: check 119"
+
+        handler.flush_interval = 0.05
+        logger.warning("slow provider")
+        time.sleep(0.3)
+        assert read_lines(path)[-1] == "WARNING: slow provider"
+
+        handler.flush_interval = 60
+        for i in range(10):
+            logger.info(f"shutdown {i}")
+        handler.close()
+        assert read_lines(path)[-1] == "INFO: shutdown 9"
+        assert not handler.writer
+
+        # Still written after close, by the caller
+        logger.error("late")
+        assert read_lines(path)[-1] == "ERROR: late"
+        assert len(read_lines(path)) == 132
+        file_handler.close()
+
+def test_batches_roll_over_without_losing_records():
+    """Rotation is checked per batch and every record lands in the log or a backup"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'monitor.log')
+        file_handler = BatchRotatingFileHandler(path, maxBytes=2000, backupCount=20)
+        handler = QueueLogHandler([file_handler], batch_records=10)
+        logger = make_logger('test_logqueue.rotation', handler)
+
+        for i in range(300):
+            logger.info(f"line {i:03d}")
+        handler.close()
+
+        backups = sorted((f for f in os.listdir(tmp) if f.rsplit('.', 1)[1].isdigit()), key=lambda f: -int(f.rsplit('.', 1)[1]))
+        assert backups
+        lines = [line for f in backups for line in read_lines(os.path.join(tmp, f))] + read_lines(path)
+        assert lines == [f"line {i:03d}" for i in range(300)]
+
+def test_processes_sharing_a_log_rotate_it_once():
+    """A handler whose file another process rotated writes to the new file instead of rotating again"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'monitor.log')
+        # One handler per process writing the log
+        handlers = [BatchRotatingFileHandler(path, maxBytes=2000, backupCount=20) for _ in range(2)]
+
+        for i in range(300):
+            record = logging.LogRecord('test', logging.INFO, __file__, 0, f"line {i:03d}", None, None)
+            handlers[i // 10 % 2].emit_batch([record])
+        for handler in handlers:
+            handler.close()
+
+        files = [path] + [f"{path}.{i}" for i in range(1, 21)]
+        files = [f for f in files if os.path.exists(f)]
+        assert all(os.path.getsize(f) <= 2000 for f in files)
+        lines = [line for f in reversed(files) for line in read_lines(f)]
+        assert lines == [f"line {i:03d}" for i in range(300)]
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+from metrics import MetricsRegistry
+
+def record(directory, count, ready, done):
+    registry = MetricsRegistry(directory)
+    registry.set_role('check')
+    for i in range(count):
+        registry.observe('ipmonitor_check_duration_seconds', 0.02, target='default', outcome='protected')
+        registry.inc('ipmonitor_status_cache_requests_total', result='hit')
+    registry.flush()
+    ready.set()
+    done.wait(10)
+
+def test_metrics_merge_across_processes_and_survive_exit():
+    """Counts from other processes are summed, and kept after those processes exit"""
+    with tempfile.TemporaryDirectory() as tmp:
+        ready = [multiprocessing.Event() for _ in range(2)]
+        done = multiprocessing.Event()
+        workers = [multiprocessing.Process(target=record, args=(tmp, 50, ready[i], done)) for i in range(2)]
+        for worker in workers:
+            worker.start()
+        for event in ready:
+            assert event.wait(10)
+
+        local = MetricsRegistry(tmp)
+        local.set_role('web')
+        local.observe('ipmonitor_check_duration_seconds', 3.0, target='default', outcome='protected')
+        text = local.render()
+        assert 'ipmonitor_check_duration_seconds_count{outcome="protected",target="default"} 101' in text
+        assert 'ipmonitor_check_duration_seconds_bucket{outcome="protected",target="default",le="0.025"} 100' in text
+        assert 'ipmonitor_status_cache_requests_total{result="hit"} 100' in text
+        assert text.count('process_resident_memory_bytes{') == 3
+
+        done.set()
+        for worker in workers:
+            worker.join()
+
+        text = local.render()
+        assert 'ipmonitor_status_cache_requests_total{result="hit"} 100' in text
+        assert 'ipmonitor_check_duration_seconds_count{outcome="protected",target="default"} 101' in text
+        assert text.count('process_resident_memory_bytes{') == 1
+        assert sorted(os.listdir(tmp)) == ['.lock', os.path.basename(local.snapshot_path), 'retired.json']
+
+def test_exited_processes_are_folded_without_a_scrape():
+    """A process retires its own snapshot at exit; one killed before that is folded by the next writer"""
+    with tempfile.TemporaryDirectory() as tmp:
+        script = (
+            "import metrics\n"
+            f"metrics.registry.directory = {tmp!r}\n"
+            "metrics.inc('ipmonitor_status_cache_requests_total', 7, result='miss')\n"
+            "metrics.registry.flush()\n"
+        )
+        source_dir = os.path.dirname(os.path.abspath(__file__))
+        subprocess.run([sys.executable, '-c', script], cwd=source_dir, check=True, timeout=30)
+        assert sorted(os.listdir(tmp)) == ['.lock', 'retired.json']
+        assert metrics.read_json(os.path.join(tmp, 'retired.json'))['counters'] == \
+            [['ipmonitor_status_cache_requests_total', {'result': 'miss'}, 7]]
+
+        # A forked worker leaves without running its exit hooks
+        ready, done = multiprocessing.Event(), multiprocessing.Event()
+        done.set()
+        worker = multiprocessing.Process(target=record, args=(tmp, 3, ready, done))
+        worker.start()
+        worker.join()
+        assert len(os.listdir(tmp)) == 3
+
+        writer = MetricsRegistry(tmp)
+        writer.inc('ipmonitor_log_bytes_written_total', 10)
+        writer.flush()
+        assert sorted(os.listdir(tmp)) == ['.lock', os.path.basename(writer.snapshot_path), 'retired.json']
+        counters = metrics.read_json(os.path.join(tmp, 'retired.json'))['counters']
+        assert sorted(value for _, _, value in counters) == [3, 7]
+
+def test_histogram_buckets_are_cumulative():
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = MetricsRegistry(tmp)
+        for seconds in (0.001, 0.2, 0.2, 45):
+            registry.observe('ipmonitor_webhook_delivery_seconds', seconds, status='200')
+        lines = registry.render().splitlines()
+
+        buckets = [line for line in lines if line.startswith('ipmonitor_webhook_delivery_seconds_bucket')]
+        assert len(buckets) == len(metrics.BUCKETS) + 1
+        assert buckets[0] == 'ipmonitor_webhook_delivery_seconds_bucket{status="200",le="0.005"} 1'
+        assert 'ipmonitor_webhook_delivery_seconds_bucket{status="200",le="0.25"} 3' in lines
+        assert buckets[-1] == 'ipmonitor_webhook_delivery_seconds_bucket{status="200",le="+Inf"} 4'
+        assert 'ipmonitor_webhook_delivery_seconds_sum{status="200"} 45.401' in lines
+        assert '# TYPE ipmonitor_webhook_delivery_seconds histogram' in lines
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import monitor
+from testing import make_monitor, run_tests, setup_function, teardown_function
+from benchmarks.stubs import StubIPServer
+
+def test_fast_start_lookup_uses_stdlib():
+    """One-shot lookups go through urllib without building a requests session"""
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer() as echo:
+        monitor.IP_SERVICES[:] = ['http://127.0.0.1:9/ip', f"{echo.url}/ip"]
+        ip_monitor = make_monitor(tmp, echo, [])
+        ip_monitor.fast_start = True
+        
+        lookup = ip_monitor.lookup_public_ip()
+        
+        assert lookup['ip'] == '127.0.0.1' and lookup['provider'] == f"{echo.url}/ip"
+        assert lookup['latencies']['http://127.0.0.1:9/ip']['status'] == 'error'
+        assert ip_monitor._session is None
+
+
+def test_race_lookup_takes_the_fastest_answer():
+    """Race mode answers with the fastest provider without waiting for the slow one, and reports each provider"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubIPServer(ip='198.51.100.9', latency=1.0) as slow, \
+            StubIPServer(ip='203.0.113.7', latency=0.05) as fast:
+        dead = 'http://127.0.0.1:9/ip'
+        # Listed first, the slow service would decide a sequential lookup
+        monitor.IP_SERVICES[:] = [f"{slow.url}/ip", dead, f"{fast.url}/ip"]
+        for fast_start in (False, True):
+            ip_monitor = make_monitor(os.path.join(tmp, str(fast_start)), fast, [])
+            ip_monitor.fast_start = fast_start
+            ip_monitor.config.IP_LOOKUP_MODE = 'race'
+            
+            started = time.monotonic()
+            lookup = ip_monitor.lookup_public_ip()
+            elapsed = time.monotonic() - started
+            
+            assert elapsed < 0.5, f"race lookup took {elapsed:.2f}s"
+            assert lookup['mode'] == 'race'
+            assert lookup['ip'] == '203.0.113.7' and lookup['provider'] == f"{fast.url}/ip"
+            latencies = lookup['latencies']
+            assert latencies[f"{fast.url}/ip"]['status'] == 'ok'
+            assert 50 <= latencies[f"{fast.url}/ip"]['latency_ms'] < elapsed * 1000
+            assert latencies[dead]['status'] == 'error' and latencies[dead]['latency_ms'] is not None
+            assert latencies[f"{slow.url}/ip"] == {'status': 'cancelled', 'latency_ms': None}
+            ip_monitor.close()
+
+def test_consensus_lookup_needs_a_quorum():
+    """Consensus mode accepts an IP once enough services agree, falls back to a lone answer and records disagreement as inconclusive"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubIPServer(ip='203.0.113.7') as first, \
+            StubIPServer(ip='203.0.113.7', latency=0.05) as second, \
+            StubIPServer(ip='198.51.100.9') as liar, \
+            StubIPServer(ip='203.0.113.7', latency=1.0) as slow:
+        dead = 'http://127.0.0.1:9/ip'
+        ip_monitor = make_monitor(tmp, first, [])
+        ip_monitor.config.IP_LOOKUP_MODE = 'consensus'
+        ip_monitor.config.CONSENSUS_PROVIDERS = 3
+        ip_monitor.config.CONSENSUS_QUORUM = 2
+        ip_monitor.config.CONSENSUS_TIMEOUT = 0.5
+        
+        # The dead service is replaced by the next one; the slow one is never waited for
+        monitor.IP_SERVICES[:] = [dead, f"{first.url}/ip", f"{liar.url}/ip", f"{second.url}/ip", f"{slow.url}/ip"]
+        started = time.monotonic()
+        lookup = ip_monitor.lookup_public_ip()
+        assert time.monotonic() - started < 0.4
+        assert lookup['ip'] == '203.0.113.7'
+        assert lookup['consensus']['decision'] == 'agreed'
+        assert sorted(lookup['consensus']['votes']['203.0.113.7']) == sorted([f"{first.url}/ip", f"{second.url}/ip"])
+        assert lookup['consensus']['votes']['198.51.100.9'] == [f"{liar.url}/ip"]
+        assert lookup['latencies'][dead]['status'] == 'error'
+        
+        # Two services that disagree, and no third answer within the budget
+        monitor.IP_SERVICES[:] = [f"{first.url}/ip", f"{liar.url}/ip", f"{slow.url}/ip"]
+        # The liar's address is in a protected range, but one vote raises no alert
+        ip_monitor.config.SAFE_IP_RANGE = '198.51.100.0/24'
+        assert not ip_monitor.run_check()
+        assert ip_monitor.last_lookup['consensus']['decision'] == 'inconclusive'
+        assert ip_monitor.history.points_since(0)[-1]['outcome'] == 'inconclusive'
+        assert ip_monitor.state['alerts_sent'] == 0
+        
+        # A single answer while the other services fail or time out is used, and can alert
+        monitor.IP_SERVICES[:] = [f"{liar.url}/ip", dead, f"{slow.url}/ip"]
+        ip_monitor.run_check()
+        assert ip_monitor.last_lookup['ip'] == '198.51.100.9'
+        assert ip_monitor.last_lookup['consensus']['decision'] == 'unconfirmed'
+        assert ip_monitor.history.points_since(0)[-1]['outcome'] == 'alert'
+        
+        # A quorum larger than the configured provider list can never be met
+        ip_monitor.config.IP_PROVIDERS = [f"{first.url}/ip", f"{liar.url}/ip"]
+        ip_monitor.config.CONSENSUS_QUORUM = 3
+        try:
+            ip_monitor.config._validate_config()
+        except ValueError as e:
+            assert 'CONSENSUS_QUORUM' in str(e)
+        else:
+            raise AssertionError("A quorum of 3 from 2 providers was accepted")
+
+
+def test_dual_stack_check_looks_up_both_families_at_once():
+    """IPv4 and IPv6 egress are looked up concurrently over pinned connections and matched and tracked separately"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubIPServer(latency=0.2) as echo4, \
+            StubIPServer(latency=0.2, host='::1') as echo6:
+        # Each family has to skip the service it can't reach
+        monitor.IP_SERVICES[:] = [f"{echo6.url}/ip", f"{echo4.url}/ip"]
+        for fast_start in (False, True):
+            ip_monitor = make_monitor(tmp, echo4, [])
+            ip_monitor.fast_start = fast_start
+            ip_monitor.config.IP_FAMILIES = 'ipv4,ipv6'
+            ip_monitor.config.SAFE_IP_RANGE = '192.168.1.0/24,::1/128'
+            
+            started = time.monotonic()
+            observation = ip_monitor.observe()
+            assert time.monotonic() - started < 0.35
+            
+            families = observation['families']
+            assert families['ipv4']['ip'] == '127.0.0.1' and families['ipv4']['is_safe']
+            assert families['ipv6']['ip'] == '::1' and families['ipv6']['protected_range'] == '::1/128'
+            # The leaking family decides the check
+            assert observation['ip'] == '::1' and observation['is_safe'] is False
+            
+            ip_monitor.observations.put(observation, key=ip_monitor.get_range_key(ip_monitor.config))
+            assert ip_monitor.get_status()['families']['ipv4']['ip'] == '127.0.0.1'
+            ip_monitor.close()
+        
+        # The deciding family alternates, but neither family's IP changed
+        ip_monitor = make_monitor(tmp, echo4, [])
+        ip_monitor.config.IP_FAMILIES = 'ipv4,ipv6'
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        ip_monitor.logger.addHandler(handler)
+        for safe_range in ('::1/128', '10.0.0.0/8', '::1/128'):
+            ip_monitor.config.SAFE_IP_RANGE = safe_range
+            ip_monitor.run_check()
+        assert not [message for message in messages if 'IP changed' in message]
+        assert ip_monitor.state['last_known_ips'] == {'ipv4': '127.0.0.1', 'ipv6': '::1'}
+        assert ip_monitor.state['last_known_ip'] == '::1'
+        
+        ip_monitor.track_ip_change(['127.0.0.2'])
+        assert [message for message in messages if 'IP changed' in message] == ["IP changed from 127.0.0.1 to 127.0.0.2"]
+        ip_monitor.logger.removeHandler(handler)
+        ip_monitor.close()
+
+
+def test_concurrent_status_callers_share_one_lookup():
+    """Callers arriving during a lookup wait for it, and get its error if it fails"""
+    def run(fetch):
+        cache = monitor.ObservationCache()
+        results = []
+        
+        def call():
+            try:
+                results.append(cache.get(fetch, 60)[0])
+            except RuntimeError as e:
+                results.append(e)
+        
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    calls = []
+    
+    def fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'ip': '203.0.113.7'}
+    
+    assert run(fetch) == [{'ip': '203.0.113.7'}] * 8
+    assert len(calls) == 1
+    
+    def failing_fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError("lookup failed")
+    
+    results = run(failing_fetch)
+    assert len(calls) == 2
+    assert len(results) == 8 and all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_concurrent_lookups_share_one_session():
+    """Threads asking for the session at once all get the same one"""
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer() as echo:
+        ip_monitor = make_monitor(tmp, echo, [])
+        built = []
+        build_session = monitor.build_session
+        
+        def slow_build_session(*args, **kwargs):
+            time.sleep(0.05)
+            built.append(build_session(*args, **kwargs))
+            return built[-1]
+        
+        monitor.build_session = slow_build_session
+        try:
+            sessions = []
+            threads = [threading.Thread(target=lambda: sessions.append(ip_monitor.get_session())) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            monitor.build_session = build_session
+        
+        assert len(built) == 1
+        assert all(session is built[0] for session in sessions) and len(sessions) == 8
+        ip_monitor.close()
+
+
+def test_lookup_stops_at_the_lookup_timeout():
+    """Slow services can't hold a lookup (and the web request waiting on it) past LOOKUP_TIMEOUT"""
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubIPServer(latency=3) as stuck, \
+            StubIPServer(latency=3) as also_stuck, \
+            StubIPServer() as echo:
+        monitor.IP_SERVICES[:] = [f"{stuck.url}/ip", f"{also_stuck.url}/ip", f"{echo.url}/ip"]
+        for fast_start in (False, True):
+            ip_monitor = make_monitor(os.path.join(tmp, str(fast_start)), echo, [])
+            ip_monitor.fast_start = fast_start
+            ip_monitor.config.LOOKUP_TIMEOUT = 0.5
+            
+            started = time.monotonic()
+            lookup = ip_monitor.lookup_public_ip()
+            assert time.monotonic() - started < 1.0
+            assert lookup['ip'] is None
+            assert lookup['latencies'][f"{echo.url}/ip"]['status'] == 'skipped'
+            ip_monitor.close()
+
+if __name__ == "__main__":
+    run_tests([
+        test_fast_start_lookup_uses_stdlib, test_race_lookup_takes_the_fastest_answer, test_consensus_lookup_needs_a_quorum,
+        test_dual_stack_check_looks_up_both_families_at_once, test_concurrent_status_callers_share_one_lookup,
+        test_concurrent_lookups_share_one_session, test_lookup_stops_at_the_lookup_timeout
+    ])
+    print("Monitor tests passed")
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import outbox as outbox_module
+from outbox import BACKOFF_BASE, BACKOFF_MAX, OutboxWorker, WebhookOutbox
+from benchmarks.stubs import StubWebhookSink
+
+def test_failed_deliveries_back_off_and_survive_a_restart():
+    """Queued entries are replayed from the file; a failed one waits out its backoff, old ones expire"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'outbox.jsonl')
+        outbox = WebhookOutbox(path)
+        outbox.enqueue({'message': 'first'})
+        outbox.enqueue({'message': 'second'})
+
+        sent = []
+        def deliver(payload):
+            sent.append(payload['message'])
+            if payload['message'] == 'second':
+                return False, 503, 'HTTP 503'
+            return True, 200, None
+
+        started = time.time()
+        assert outbox.drain(deliver, max_age=3600) == 1
+        assert sent == ['first', 'second']
+
+        # Not due again until the backoff has passed
+        assert outbox.drain(deliver, max_age=3600) == 0
+        assert sent == ['first', 'second']
+
+        # A new process sees the same queue, with the failed attempt recorded
+        with open(path, 'a') as f:
+            f.write('{"op": "done", "id": "torn')
+        restarted = WebhookOutbox(path)
+        pending, _ = restarted.replay()
+        assert len(pending) == 1
+        entry = next(iter(pending.values()))
+        assert entry['payload'] == {'message': 'second'}
+        assert entry['attempts'] == 1 and entry['last_error'] == 'HTTP 503'
+        assert started + BACKOFF_BASE * 0.5 <= entry['next_attempt'] <= time.time() + BACKOFF_BASE * 1.5
+        assert restarted.next_due() == entry['next_attempt']
+
+        stats = restarted.get_stats()
+        assert stats['queue_depth'] == 1 and stats['retrying'] == 1
+        assert stats['delivered'] == 1 and stats['dead'] == 0
+
+        for attempts in range(1, 20):
+            delay = restarted.backoff(attempts)
+            expected = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+            assert expected * 0.5 <= delay <= expected * 1.5
+
+        # Entries past the max age are dropped without another try
+        assert restarted.drain(deliver, max_age=-1) == 0
+        assert sent == ['first', 'second']
+        stats = restarted.get_stats()
+        assert stats['queue_depth'] == 0 and stats['dead'] == 1
+
+        # Compaction keeps the totals
+        restarted.enqueue({'message': 'third'})
+        restarted.compact()
+        with open(path) as f:
+            assert [json.loads(line)['op'] for line in f] == ['stats', 'enqueue']
+        stats = restarted.get_stats()
+        assert stats['queue_depth'] == 1 and stats['delivered'] == 1 and stats['dead'] == 1
+
+def test_worker_reloads_before_each_drain():
+    """The worker calls before_drain ahead of every delivery, so it sends with the current config"""
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = WebhookOutbox(os.path.join(tmp, 'outbox.jsonl'))
+        config = {'url': 'http://old.invalid'}
+        sent = []
+
+        def deliver(payload):
+            sent.append((config['url'], payload['message']))
+            return True, 200, None
+
+        worker = OutboxWorker(outbox, deliver, lambda: 3600, before_drain=lambda: config.update(url='http://new.invalid'))
+        outbox.enqueue({'message': 'alert'})
+        worker.start()
+        try:
+            deadline = time.time() + 5
+            while not sent and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            worker.stop()
+        assert sent == [('http://new.invalid', 'alert')]
+
+def test_only_one_worker_polls_an_outbox():
+    """A second worker on the same outbox stands by until the first one stops"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'outbox.jsonl')
+        sent = []
+
+        def deliver(payload):
+            sent.append(payload['message'])
+            return True, 200, None
+
+        saved_interval = outbox_module.STANDBY_INTERVAL
+        outbox_module.STANDBY_INTERVAL = 0.05
+        first = OutboxWorker(WebhookOutbox(path), deliver, lambda: 3600)
+        second = OutboxWorker(WebhookOutbox(path), deliver, lambda: 3600)
+        try:
+            first.start()
+            deadline = time.time() + 5
+            while not first.active and time.time() < deadline:
+                time.sleep(0.01)
+            second.start()
+            time.sleep(0.2)
+            assert first.active and not second.active
+
+            first.stop()
+            second.outbox.enqueue({'message': 'alert'})
+            deadline = time.time() + 5
+            while not sent and time.time() < deadline:
+                time.sleep(0.01)
+            assert second.active and sent == ['alert']
+        finally:
+            outbox_module.STANDBY_INTERVAL = saved_interval
+            first.stop()
+            second.stop()
+
+def post_to(url):
+    def deliver(payload):
+        request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return True, response.status, None
+    return deliver
+
+def test_alerts_within_the_window_go_out_as_one_request():
+    """Alerts queued within the coalescing window are sent once, grouped with counts and first/last seen"""
+    with tempfile.TemporaryDirectory() as tmp, StubWebhookSink() as sink:
+        outbox = WebhookOutbox(os.path.join(tmp, 'outbox.jsonl'))
+        delivered = []
+        alerts = [
+            ('10:00:00', None, '192.168.1.20'),
+            ('10:00:01', 'office', '10.0.0.9'),
+            ('10:00:02', None, '192.168.1.20'),
+        ]
+        for timestamp, target, ip in alerts:
+            outbox.enqueue({
+                'message': f"VPN ALERT: Current IP {ip}", 'current_ip': ip, 'matched_range': '192.168.1.0/24',
+                'timestamp': f"2026-01-01T{timestamp}", 'alert_type': 'vpn_disabled', 'target': target
+            })
+
+        # Nothing goes out while the window is open
+        assert outbox.drain(post_to(sink.url), 3600, delivered.append, window=0.5) == 0
+        time.sleep(0.6)
+        assert outbox.drain(post_to(sink.url), 3600, delivered.append, window=0.5) == 3
+
+        assert len(sink.received) == 1
+        payload = sink.received[0][1]
+        assert payload['alert_type'] == 'vpn_disabled_batch' and payload['event_count'] == 3
+        assert payload['first_seen'] == '2026-01-01T10:00:00' and payload['last_seen'] == '2026-01-01T10:00:02'
+        assert [(event['current_ip'], event['target'], event['count'], event['first_seen'], event['last_seen'])
+                for event in payload['events']] == [
+            ('192.168.1.20', None, 2, '2026-01-01T10:00:00', '2026-01-01T10:00:02'),
+            ('10.0.0.9', 'office', 1, '2026-01-01T10:00:01', '2026-01-01T10:00:01'),
+        ]
+        # Every coalesced alert still counts as delivered
+        assert len(delivered) == 3
+        assert outbox.get_stats()['delivered'] == 3
+
+def test_replay_parses_only_appended_records():
+    """Each replay reads what other processes appended since the last one, and starts over after a compaction"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'outbox.jsonl')
+        reader, writer = WebhookOutbox(path), WebhookOutbox(path)
+        first = writer.enqueue({'message': 'first'})
+        writer.enqueue({'message': 'second'})
+        snapshot, _ = reader.replay()
+        assert len(snapshot) == 2
+
+        parsed = []
+        apply_record = outbox_module.apply_record
+        outbox_module.apply_record = lambda pending, stats, line: (parsed.append(line), apply_record(pending, stats, line))
+        try:
+            writer._append({'op': 'attempt', 'id': first, 'attempts': 1, 'next_attempt': 0, 'error': 'HTTP 503'})
+            # A record still being written is left for the next replay
+            with open(path, 'a') as f:
+                f.write('{"op": "done", "id": "')
+            pending, _ = reader.replay()
+            assert len(parsed) == 1
+            assert pending[first]['attempts'] == 1 and snapshot[first]['attempts'] == 0
+
+            writer._append({'op': 'done', 'id': first, 'latency_ms': 12.0})
+            pending, stats = reader.replay()
+            assert len(parsed) == 3
+            assert first not in pending and len(pending) == 1 and stats['delivered'] == 1
+        finally:
+            outbox_module.apply_record = apply_record
+
+        writer.compact()
+        writer.enqueue({'message': 'third'})
+        assert reader.replay()[0] == writer.replay()[0]
+        assert reader.get_stats()['queue_depth'] == 2 and reader.get_stats()['delivered'] == 1
+
+if __name__ == '__main__':
+    test_failed_deliveries_back_off_and_survive_a_restart()
+    test_worker_reloads_before_each_drain()
+    test_only_one_worker_polls_an_outbox()
+    test_alerts_within_the_window_go_out_as_one_request()
+    test_replay_parses_only_appended_records()
+    print("Outbox tests passed")
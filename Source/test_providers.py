@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import monitor
+from providers import OPEN_BASE
+from testing import make_monitor, run_tests, setup_function, teardown_function
+from benchmarks.stubs import StubIPServer
+
+def test_failing_provider_is_demoted_then_skipped():
+    """Providers are ordered by expected latency; repeated failures open the circuit until a probe succeeds"""
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer() as echo, StubIPServer(latency=0.05) as slow:
+        dead = 'http://127.0.0.1:9/ip'
+        monitor.IP_SERVICES[:] = [dead, f"{slow.url}/ip", f"{echo.url}/ip"]
+        ip_monitor = make_monitor(tmp, echo, [])
+        
+        # Never asked providers are tried first; afterwards the fast one leads
+        for _ in range(3):
+            ip_monitor.lookup_public_ip()
+        scores = ip_monitor.providers.get_scores(monitor.IP_SERVICES)
+        assert [score['provider'] for score in scores] == [f"{echo.url}/ip", f"{slow.url}/ip", dead]
+        assert scores[-1]['expected_latency_ms'] is None
+        assert scores[-1]['last_error'] and 'Connection refused' in scores[-1]['last_error']
+        
+        for _ in range(2):
+            lookup = ip_monitor.lookup_public_ip()
+            assert lookup['provider'] == f"{echo.url}/ip"
+        assert lookup['latencies'][dead]['status'] == 'skipped'
+        
+        # Three failures in a row open the circuit: the dead provider is no longer asked
+        health = ip_monitor.providers
+        health.record(dead, 'error', 1.0)
+        assert health.get_scores(monitor.IP_SERVICES)[-1]['circuit'] == 'closed'
+        health.record(dead, 'error', 1.0)
+        assert health.get_scores(monitor.IP_SERVICES)[-1]['circuit'] == 'open'
+        ip_monitor.save_state()
+        assert ip_monitor.lookup_public_ip()['latencies'][dead]['status'] == 'open'
+        
+        # Health is shared through the state journal
+        other = make_monitor(tmp, echo, [])
+        assert other.providers.get_scores(monitor.IP_SERVICES)[-1]['circuit'] == 'open'
+        
+        # Once the open period is over, a background probe decides; the dead one fails again
+        ip_monitor.state_store.set(['providers', dead, 'open_until'], time.time() - 1)
+        health.probe([dead])
+        health.join_probes(5)
+        assert health.get(dead)['trips'] == 2
+        assert health.get(dead)['open_until'] - time.time() > OPEN_BASE * 1.5
+        
+        # Once a provider answers again its circuit closes
+        health.record(f"{slow.url}/ip", 'error', 1.0)
+        ip_monitor.state_store.set(['providers', f"{slow.url}/ip", 'open_until'], time.time() - 1)
+        health.probe([f"{slow.url}/ip"])
+        health.join_probes(5)
+        assert health.get(f"{slow.url}/ip")['open_until'] is None
+
+def test_one_shot_check_finishes_its_probe_before_exiting():
+    """A cron run exits right after its check, but the probe it started still closes the recovered circuit"""
+    with tempfile.TemporaryDirectory() as tmp, StubIPServer() as echo, StubIPServer(latency=0.5) as recovered:
+        providers = [f"{recovered.url}/ip", f"{echo.url}/ip"]
+        ip_monitor = make_monitor(tmp, echo, [])
+        # Tripped earlier, and its open period is over
+        ip_monitor.state_store.set(['providers', providers[0], 'trips'], 1)
+        ip_monitor.state_store.set(['providers', providers[0], 'open_until'], time.time() - 1)
+        ip_monitor.save_state()
+        ip_monitor.close()
+        
+        env = dict(os.environ, DATA_DIR=tmp, LOG_DIR=tmp, IP_PROVIDERS=','.join(providers), SAFE_IP_RANGE='192.168.1.0/24')
+        source_dir = os.path.dirname(os.path.abspath(__file__))
+        run = subprocess.run([sys.executable, os.path.join(source_dir, 'monitor.py')], env=env,
+                             capture_output=True, text=True, timeout=30)
+        assert run.returncode == 0, run.stdout + run.stderr
+        
+        # The check itself used the healthy provider; the probe reached the recovered one
+        assert recovered.requests == 1
+        ip_monitor = make_monitor(tmp, echo, [])
+        assert ip_monitor.providers.get(providers[0])['open_until'] is None
+        assert ip_monitor.providers.get_scores(providers)[0]['circuit'] == 'closed'
+        ip_monitor.close()
+
+if __name__ == "__main__":
+    run_tests([test_failing_provider_is_demoted_then_skipped, test_one_shot_check_finishes_its_probe_before_exiting])
+    print("Provider tests passed")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import ipaddress
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ranges import RangeIndex, flatten_networks, load_range_index, parse_cidr, range_fingerprint
+
+def brute_force(cidrs, ip):
+    """Most specific CIDR containing ip, by checking every network"""
+    ip = ipaddress.ip_address(ip)
+    best = None
+    for cidr in cidrs:
+        network = ipaddress.ip_network(cidr, strict=False)
+        if ip.version == network.version and ip in network:
+            if best is None or network.prefixlen > best[0]:
+                best = (network.prefixlen, cidr)
+    return best[1] if best else None
+
+def test_nested_and_duplicate_prefixes_flatten_to_disjoint_intervals():
+    """Nested blocks split their parent, duplicates are indexed once, and host bits are ignored"""
+    index = RangeIndex.from_cidrs(['10.0.0.0/8', '10.1.0.0/16', '10.1.2.3/24', '10.0.0.0/8', 'not-a-cidr', ''])
+
+    starts, ends, label_ids = index.families[4]
+    assert [(str(ipaddress.ip_address(s)), str(ipaddress.ip_address(e)), index.labels[l])
+            for s, e, l in zip(starts, ends, label_ids)] == [
+        ('10.0.0.0', '10.0.255.255', '10.0.0.0/8'),
+        ('10.1.0.0', '10.1.1.255', '10.1.0.0/16'),
+        ('10.1.2.0', '10.1.2.255', '10.1.2.3/24'),
+        ('10.1.3.0', '10.1.255.255', '10.1.0.0/16'),
+        ('10.2.0.0', '10.255.255.255', '10.0.0.0/8'),
+    ]
+    assert len(index.labels) == 3
+
+    # Adjacent stretches of the same range are merged back into one interval
+    assert flatten_networks([(0, 30, 3, 0), (4, 30, 7, 0)]) == ([0], [7], [0])
+    assert parse_cidr('192.168.1.77/24') == (4, 0xC0A80100, 0xC0A801FF, 24)
+
+def test_lookup_returns_the_longest_matching_prefix():
+    """Lookups pick the most specific range, for IPv4 and IPv6 alike"""
+    index = RangeIndex.from_cidrs(['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '2001:db8::/32', '2001:db8:1::/48', '192.168.1.5'])
+
+    assert index.lookup('10.9.9.9') == '10.0.0.0/8'
+    assert index.lookup('10.1.9.9') == '10.1.0.0/16'
+    assert index.lookup('10.1.2.200') == '10.1.2.0/24'
+    assert index.lookup('192.168.1.5') == '192.168.1.5'
+    assert index.lookup('192.168.1.6') is None
+    assert index.lookup('11.0.0.0') is None
+    assert index.lookup('2001:db8:1::7') == '2001:db8:1::/48'
+    assert index.lookup('2001:db8:2::7') == '2001:db8::/32'
+    assert index.lookup('2001:db9::1') is None
+    assert index.covers_family(4) and index.covers_family(6)
+    assert not RangeIndex.from_cidrs(['10.0.0.0/8']).covers_family(6)
+
+    rng = random.Random(3)
+    cidrs = []
+    for _ in range(200):
+        prefixlen = rng.randint(4, 32)
+        cidrs.append(f"{ipaddress.ip_address(rng.getrandbits(32))}/{prefixlen}")
+    index = RangeIndex.from_cidrs(cidrs)
+    for _ in range(500):
+        ip = str(ipaddress.ip_address(rng.getrandbits(32)))
+        assert index.lookup(ip) == brute_force(cidrs, ip)
+
+def test_compiled_index_round_trips_and_rejects_a_stale_fingerprint():
+    """A saved index answers like the one it was built from, and is rebuilt when its sources change"""
+    cidrs = ['10.0.0.0/8', '10.1.0.0/16', '2001:db8::/32', '2001:db8:1::/48', '198.51.100.0/24']
+    with tempfile.TemporaryDirectory() as tmp:
+        index_file = os.path.join(tmp, 'index', 'ranges.idx')
+        built = RangeIndex.from_cidrs(cidrs)
+        fingerprint = range_fingerprint(','.join(cidrs), [])
+        built.save(index_file, fingerprint)
+
+        loaded = RangeIndex.load(index_file, fingerprint)
+        assert loaded is not None and len(loaded) == len(built)
+        for ip in ('10.2.3.4', '10.1.0.1', '2001:db8:1::1', '2001:db8:ffff::1', '198.51.100.9', '8.8.8.8', '::1'):
+            assert loaded.lookup(ip) == built.lookup(ip)
+
+        assert RangeIndex.load(index_file, range_fingerprint('10.0.0.0/8', [])) is None
+        assert RangeIndex.load(os.path.join(tmp, 'missing.idx'), fingerprint) is None
+        with open(index_file, 'r+b') as f:
+            f.truncate(os.path.getsize(index_file) - 1)
+        assert RangeIndex.load(index_file, fingerprint) is None
+
+        # A changed range file changes the fingerprint, so the index is compiled again
+        range_file = os.path.join(tmp, 'extra.txt')
+        with open(range_file, 'w') as f:
+            f.write("203.0.113.0/24\n")
+        index = load_range_index('10.0.0.0/8', [range_file], index_file)
+        assert index.lookup('203.0.113.5') == '203.0.113.0/24'
+        with open(range_file, 'w') as f:
+            f.write("# moved\n203.0.114.0/24\n")
+        index = load_range_index('10.0.0.0/8', [range_file], index_file)
+        assert index.lookup('203.0.113.5') is None
+        assert index.lookup('203.0.114.5') == '203.0.114.0/24'
+
+if __name__ == '__main__':
+    test_nested_and_duplicate_prefixes_flatten_to_disjoint_intervals()
+    test_lookup_returns_the_longest_matching_prefix()
+    test_compiled_index_round_trips_and_rejects_a_stale_fingerprint()
+    print("Range tests passed")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import resolver
+from testing import make_monitor
+from benchmarks.stubs import StubDNSServer, StubIPServer
+
+RECORDS = {
+    'myip.test': ('A', '203.0.113.7'),
+    'myip6.test': ('AAAA', '2001:db8::7'),
+    'o-o.myaddr.test': ('TXT', '203.0.113.7')
+}
+
+def test_dns_lookup_record_types():
+    """A, AAAA and TXT whoami answers are read from a single UDP query each"""
+    with StubDNSServer(RECORDS) as dns:
+        assert resolver.lookup(dns.provider('myip.test'), 2) == '203.0.113.7'
+        assert resolver.lookup(dns.provider('myip6.test', 'AAAA'), 2) == '2001:db8::7'
+        assert resolver.lookup(dns.provider('o-o.myaddr.test', 'TXT'), 2) == '203.0.113.7'
+        assert dns.requests == 3
+
+        # A known name without a record of the asked type has no address
+        assert resolver.lookup(dns.provider('myip.test', 'TXT'), 2) is None
+        try:
+            resolver.lookup(dns.provider('unknown.test'), 2)
+            assert False, "NXDOMAIN should raise"
+        except resolver.DNSError as e:
+            assert 'rcode 3' in str(e)
+
+def test_dns_lookup_times_out():
+    with StubDNSServer(RECORDS, latency=0.5) as dns:
+        try:
+            resolver.lookup(dns.provider('myip.test'), 0.1)
+            assert False, "slow resolver should time out"
+        except resolver.DNSError as e:
+            assert 'No answer' in str(e)
+
+def test_configured_providers_mix_dns_and_http():
+    """IP_PROVIDERS takes HTTP and DNS providers in one list, in both lookup modes"""
+    with tempfile.TemporaryDirectory() as tmp, StubDNSServer(RECORDS) as dns, StubIPServer(ip='203.0.113.7') as echo:
+        ip_monitor = make_monitor(tmp)
+        broken = dns.provider('unknown.test')
+        ip_monitor.config.write_file({'ip_providers': [broken, dns.provider('o-o.myaddr.test', 'TXT'), f"{echo.url}/ip"]})
+        assert ip_monitor.reload_config()
+
+        lookup = ip_monitor.lookup_public_ip()
+        assert lookup['ip'] == '203.0.113.7'
+        assert lookup['provider'] == dns.provider('o-o.myaddr.test', 'TXT')
+        assert lookup['latencies'][broken]['status'] == 'error'
+
+        ip_monitor.config.IP_LOOKUP_MODE = 'race'
+        assert ip_monitor.lookup_public_ip()['ip'] == '203.0.113.7'
+
+        # Lookups through a target's session never use DNS providers
+        assert ip_monitor.get_ip_services(session=object()) == [f"{echo.url}/ip"]
+
+        try:
+            ip_monitor.config.write_file({'ip_providers': ['dns://resolver.test']})
+            assert False, "a DNS provider without a name is invalid"
+        except ValueError:
+            pass
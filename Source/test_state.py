@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import state
+from state import StateStore
+
+DEFAULTS = {'total_checks': 0, 'alerts_sent': 0, 'last_known_ip': None, 'targets': {}}
+
+def bump(path, count):
+    store = StateStore(path, DEFAULTS)
+    store.load()
+    for i in range(count):
+        store.increment(['total_checks'])
+        store.increment(['targets', 'wg0', 'total_checks'])
+        store.set(['last_known_ip'], f"10.0.0.{os.getpid() % 250}")
+        store.flush()
+
+def test_concurrent_increments_are_merged():
+    """Counters bumped by several processes add up instead of overwriting each other"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'monitor_state.json')
+        workers = [multiprocessing.Process(target=bump, args=(path, 200)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        store = StateStore(path, DEFAULTS)
+        store.load()
+        assert store.state['total_checks'] == 800
+        assert store.state['targets']['wg0']['total_checks'] == 800
+        assert store.state['last_known_ip'].startswith('10.0.0.')
+
+def test_refresh_picks_up_other_writers_and_keeps_pending():
+    """A reader catches up on another process's records without losing its own unsaved changes"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'monitor_state.json')
+        reader, writer = StateStore(path, DEFAULTS), StateStore(path, DEFAULTS)
+        reader.load()
+        writer.load()
+
+        reader.increment(['alerts_sent'])
+        writer.increment(['total_checks'], 3)
+        writer.flush()
+        assert reader.refresh()
+        assert not reader.refresh()
+        assert reader.state['total_checks'] == 3 and reader.state['alerts_sent'] == 1
+
+        reader.flush()
+        writer.refresh()
+        assert writer.state['alerts_sent'] == 1
+
+def test_torn_journal_line_is_skipped():
+    """A record cut short by a crash is ignored and later records still apply"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'monitor_state.json')
+        store = StateStore(path, DEFAULTS)
+        store.load()
+        store.increment(['total_checks'])
+        store.flush()
+        with open(store.journal_path, 'a') as f:
+            f.write('{"op": "incr", "path": ["total_ch')
+
+        store = StateStore(path, DEFAULTS)
+        store.load()
+        store.increment(['total_checks'])
+        store.flush()
+
+        store = StateStore(path, DEFAULTS)
+        store.load()
+        assert store.state['total_checks'] == 2
+
+def test_compaction_writes_snapshot(monkeypatch):
+    """Once the journal is long enough it is folded into the snapshot, which readers then start from"""
+    monkeypatch.setattr(state, 'COMPACT_AFTER', 10)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'monitor_state.json')
+        other = StateStore(path, DEFAULTS)
+        other.load()
+        store = StateStore(path, DEFAULTS)
+        store.load()
+        for _ in range(12):
+            store.increment(['total_checks'])
+            store.flush()
+
+        with open(path) as f:
+            assert json.load(f)['total_checks'] >= 10
+        with open(store.journal_path) as f:
+            assert len(f.readlines()) == 2
+
+        # A reader that saw the old journal reloads from the new snapshot
+        other.refresh()
+        assert other.state['total_checks'] == 12
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Helpers shared by the test modules that need a whole IPMonitor"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import metrics
+import monitor
+
+# The process-wide metrics registry writes its snapshots to a temp dir that is
+# removed at exit, instead of /app/data/metrics
+metrics.registry.directory = tempfile.mkdtemp(prefix='ipmonitor-tests-')
+atexit.unregister(metrics.registry.retire)
+atexit.register(shutil.rmtree, metrics.registry.directory, True)
+
+def make_monitor(state_dir, echo=None, targets=()):
+    """Build an IPMonitor with every file it uses (config, state, history, outbox, observation,
+    locks, range index and log) in state_dir, alerting to the echo stub if one is given
+    """
+    saved = {name: os.environ.get(name) for name in ('DATA_DIR', 'LOG_DIR')}
+    os.environ['DATA_DIR'] = os.environ['LOG_DIR'] = state_dir
+    try:
+        ip_monitor = monitor.IPMonitor()
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    ip_monitor.config.SAFE_IP_RANGE = '192.168.1.0/24'
+    if echo is not None:
+        ip_monitor.config.WEBHOOK_URL = echo.url
+    ip_monitor.config.TARGETS = list(targets)
+    return ip_monitor
+
+# Tests that replace the IP services get the built-in list back afterwards;
+# test modules import these so pytest runs them around each test
+def setup_function(function):
+    global saved_services
+    saved_services = list(monitor.IP_SERVICES)
+
+def teardown_function(function):
+    monitor.IP_SERVICES[:] = saved_services
+
+def run_tests(tests):
+    """Run tests in order outside pytest, with the same setup and teardown"""
+    for test in tests:
+        setup_function(test)
+        try:
+            test()
+        finally:
+            teardown_function(test)